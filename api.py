@@ -0,0 +1,164 @@
+"""
+API HTTP asynchrone de LuXas (Starlette + uvicorn).
+
+Un worker sert de nombreuses conversations en parallèle : les appels OpenAI et
+Qdrant sont asynchrones et limités par service amont (voir rag_async.py).
+
+Routes :
+- POST /chat          {"query": "...", "chat_history": [...]}
+                      -> {"answer", "sources", "chunk_ids", "sources_section"}
+- POST /chat/stream   même corps, réponse en Server-Sent Events :
+                      "data: {"token": "..."}" pour chaque morceau, puis "event: sources"
+                      (mêmes champs que /chat, sans "answer") et "event: done"
+
+Dans chat_history, les réponses de l'assistant ne doivent contenir que "answer" ;
+un résumé glissant peut être envoyé en premier message ({"role": "summary", ...}).
+- POST /summary       {"summary": "...", "messages": [...]} -> {"summary"} : résumé glissant
+                      mis à jour avec les messages (clients légers, voir conversation_memory.py)
+- GET  /health        état des composants et durée d'initialisation
+- GET  /metrics       métriques par étape au format texte Prometheus (metrics.py)
+
+Lancement : python api.py  (ou uvicorn api:app --host 0.0.0.0 --port 8000)
+"""
+
+import json
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import rag
+import rag_async
+from conversation_memory import ROLE_LABELS
+from metrics import registry
+
+# Configuration
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+
+
+async def _read_chat_request(request: Request):
+    """
+    Lit et valide le corps JSON d'une requête de chat.
+
+    Returns:
+        tuple: (query, chat_history), ou une JSONResponse d'erreur
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Corps JSON invalide"}, status_code=400)
+
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        return JSONResponse({"error": "Champ 'query' manquant"}, status_code=400)
+
+    chat_history = body.get("chat_history") or []
+    if not isinstance(chat_history, list) or not all(
+        isinstance(msg, dict) and msg.get("role") in ROLE_LABELS and isinstance(msg.get("content"), str)
+        for msg in chat_history
+    ):
+        return JSONResponse(
+            {"error": "'chat_history' doit être une liste de {\"role\": \"user/assistant/summary\", \"content\": \"...\"}"},
+            status_code=400
+        )
+    return query, chat_history
+
+
+async def chat(request: Request):
+    parsed = await _read_chat_request(request)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    query, chat_history = parsed
+
+    rag_answer = await rag_async.arag_agent_with_sources_conversational(query, chat_history)
+    return JSONResponse(rag_answer.to_dict())
+
+
+async def chat_stream(request: Request):
+    parsed = await _read_chat_request(request)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    query, chat_history = parsed
+
+    async def events():
+        try:
+            async for item in rag_async.arag_agent_with_sources_conversational_stream(query, chat_history):
+                if isinstance(item, rag.RAGAnswer):
+                    sources = {key: value for key, value in item.to_dict().items() if key != "answer"}
+                    yield f"event: sources\ndata: {json.dumps(sources, ensure_ascii=False)}\n\n"
+                else:
+                    # JSON : les retours à la ligne du texte ne cassent pas le format SSE
+                    yield f"data: {json.dumps({'token': item}, ensure_ascii=False)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"❌ Erreur pendant le streaming : {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def summary(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Corps JSON invalide"}, status_code=400)
+
+    current = body.get("summary", "") if isinstance(body, dict) else None
+    messages = body.get("messages") if isinstance(body, dict) else None
+    if not isinstance(current, str) or not isinstance(messages, list) or not messages or not all(
+        isinstance(msg, dict) and msg.get("role") in ("user", "assistant") and isinstance(msg.get("content"), str)
+        for msg in messages
+    ):
+        return JSONResponse(
+            {"error": "Attendu : {\"summary\": \"...\", \"messages\": [{\"role\": \"user/assistant\", \"content\": \"...\"}]}"},
+            status_code=400
+        )
+    if not rag_async.components_ready or rag.llm is None:
+        return JSONResponse({"error": "Composants en cours d'initialisation"}, status_code=503)
+
+    return JSONResponse({"summary": await rag_async.asummarize_history(current, messages)})
+
+
+async def health(request: Request):
+    return JSONResponse({
+        "status": "ok" if rag_async.components_ready else "starting",
+        "vector_backend": rag.VECTOR_BACKEND,
+        "init_duration_ms": rag.init_duration_ms,
+    })
+
+
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await rag_async.initialize_async_components()
+    yield
+    await rag_async.close_async_components()
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/summary", summary, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    uvicorn.run("api:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
@@ -1,5 +1,14 @@
+import functools
+import itertools
+import os
+import httpx
 import streamlit as st
-from chatbot import interact_with_chatbot
+import rag
+from chatbot import interact_with_chatbot_stream, interact_with_api_stream, summarize_with_api
+from conversation_memory import ConversationMemory
+
+# Si défini, l'application sert de client léger à l'API HTTP (api.py)
+API_URL = os.getenv("LUXAS_API_URL")
 
 st.set_page_config(
     page_title="LuXas - Assistant Juridique",
@@ -15,14 +24,26 @@ st.markdown("""
 **Conversation intelligente** : Vous pouvez poser des questions de suivi comme "Et pour les enfants ?" ou "Peux-tu préciser ?"
 """)
 
-# Initialiser l'historique de conversation (format pour le RAG)
+# Initialiser les composants une seule fois pour tout le processus (partagés entre sessions)
+@st.cache_resource(show_spinner="🔧 Initialisation des composants RAG...")
+def warm_up_components():
+    return rag.warm_up()
+
+warm_up_duration_ms = warm_up_components() if not API_URL else None
+
+# Messages affichés (avec les sources) et mémoire transmise au RAG (réponses seules
+# + résumé glissant des échanges anciens)
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
+if "memory" not in st.session_state:
+    st.session_state["memory"] = ConversationMemory()
 
 # Afficher l'historique des messages avec un style amélioré
 for message in st.session_state["messages"]:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("sources_section"):
+            st.markdown(message["sources_section"])
 
 # Champ de saisie utilisateur
 if prompt := st.chat_input("Ex: Quelle est la dernière proposition de loi sur la protection des enfants ?"):
@@ -31,25 +52,63 @@ if prompt := st.chat_input("Ex: Quelle est la dernière proposition de loi sur l
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Préparer l'historique pour le RAG (exclure le message actuel)
-    chat_history = st.session_state["messages"][:-1]
+    # Préparer l'historique pour le RAG (le message actuel n'y est pas encore)
+    memory = st.session_state["memory"]
+    chat_history = memory.history()
+
+    # Obtenir la réponse du chatbot en streaming : le spinner couvre la recherche
+    # jusqu'au premier token, puis la réponse s'affiche au fil de la génération.
+    # Le dernier élément du flux est la réponse structurée (rag.RAGAnswer).
+    rag_answers = []
+
+    def answer_tokens(stream):
+        for item in stream:
+            if isinstance(item, rag.RAGAnswer):
+                rag_answers.append(item)
+            else:
+                yield item
 
-    # Obtenir la réponse du chatbot avec spinner
     with st.chat_message("assistant"):
         with st.spinner("🔍 Recherche dans les documents..."):
-            response = interact_with_chatbot(prompt, chat_history)
-        st.markdown(response)
+            if API_URL:
+                stream = answer_tokens(interact_with_api_stream(API_URL, prompt, chat_history))
+            else:
+                stream = answer_tokens(interact_with_chatbot_stream(prompt, chat_history))
+            first_chunk = next(stream, "")
+        response = st.write_stream(itertools.chain([first_chunk], stream))
+        rag_answer = rag_answers[-1] if rag_answers else rag.RAGAnswer(answer=response)
+        if rag_answer.sources_section:
+            st.markdown(rag_answer.sources_section)
 
-    # Ajouter la réponse à l'historique
-    st.session_state["messages"].append({"role": "assistant", "content": response})
+    # Ajouter la réponse à l'affichage, et son seul texte à la mémoire du RAG
+    st.session_state["messages"].append(
+        {"role": "assistant", "content": rag_answer.answer, "sources_section": rag_answer.sources_section}
+    )
+    memory.add("user", prompt)
+    memory.add("assistant", rag_answer.answer)
+    if memory.needs_summary():
+        with st.spinner("📝 Mise à jour du résumé de la conversation..."):
+            if API_URL:
+                # Client léger : résumé calculé par l'API ; en cas d'échec, les messages
+                # restent bruts et le résumé sera retenté au prochain tour
+                try:
+                    memory.update_summary(summarize=functools.partial(summarize_with_api, API_URL))
+                except httpx.HTTPError as e:
+                    print(f"⚠️ Résumé de conversation non mis à jour : {e}")
+            else:
+                memory.update_summary(rag.reformulation_llm or rag.llm, config={"callbacks": [rag.langfuse_handler]})
 
 # Sidebar avec informations et options
 with st.sidebar:
     st.header("📊 Informations")
     st.info(f"💬 Messages dans la conversation : {len(st.session_state['messages'])}")
     
+    if st.session_state["memory"].summary:
+        st.caption(f"📝 {st.session_state['memory'].summarized_messages} messages anciens résumés")
+
     if st.button("🗑️ Réinitialiser la conversation"):
         st.session_state["messages"] = []
+        st.session_state["memory"].clear()
         st.rerun()
     
     st.markdown("---")
@@ -63,4 +122,9 @@ with st.sidebar:
     
     st.markdown("---")
     st.markdown("### ⚙️ Système RAG")
-    st.caption("Retrieval-Augmented Generation avec Qdrant + OpenAI")
\ No newline at end of file
+    st.caption("Retrieval-Augmented Generation avec Qdrant + OpenAI")
+    if API_URL:
+        st.caption(f"🌐 Réponses servies par l'API : {API_URL}")
+    else:
+        st.caption(f"⏱️ Démarrage : {rag.init_duration_ms:.0f} ms d'initialisation, "
+                   f"{warm_up_duration_ms:.0f} ms avec le préchauffage")
\ No newline at end of file
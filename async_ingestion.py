@@ -0,0 +1,411 @@
+"""
+Pipeline d'ingestion asynchrone : parsing, embeddings et upserts Qdrant en parallèle.
+
+Les trois étapes sont reliées par des files bornées :
+
+    parsing (thread) --> [file embed] --> N workers embeddings --> [file upsert] --> M workers Qdrant
+
+- les requêtes d'embeddings partent en parallèle, sous une limite de requêtes
+  et de tokens par minute
+- l'upsert d'un batch se fait pendant l'embedding des batches suivants
+- une file pleine bloque l'étape précédente (backpressure), ce qui borne la mémoire
+- comme dans le pipeline synchrone (upload_control.py), un batch en échec est réessayé
+  avec backoff, coupé en deux sur un payload trop gros ou un timeout, et journalisé ;
+  la taille des batches est réduite après une limite de débit ou un timeout
+
+Un PDF n'est enregistré dans le manifeste que lorsque tous les points qu'il
+référence (y compris les représentants dédupliqués d'autres PDFs) sont écrits.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import PointIdsList, PointStruct
+
+from metrics import count_tokens, stage as measure
+from qdrant_collection import point_vectors
+from upload_control import UPLOAD_BATCH_MIN, AdaptiveBatchSize, acall_with_retry, awrite_with_split
+
+# Configuration
+EMBED_BATCH_SIZE = 256       # Chunks par requête d'embeddings
+EMBED_CONCURRENCY = 4        # Requêtes d'embeddings simultanées
+EMBED_RPM = 3000             # Requêtes par minute autorisées
+EMBED_TPM = 1_000_000        # Tokens par minute autorisés
+UPSERT_CONCURRENCY = 2       # Upserts Qdrant simultanés
+QUEUE_SIZE = 8               # Batches en attente entre deux étapes
+PROGRESS_INTERVAL = 10.0     # Secondes entre deux rapports de progression
+
+_END = object()  # Marqueur de fin de file
+
+
+class RateLimiter:
+    """
+    Limiteur à fenêtre glissante d'une minute (requêtes et tokens).
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._events: deque = deque()  # (horodatage, tokens)
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+        self.wait_time = 0.0
+
+    async def acquire(self, tokens: int):
+        """
+        Attend que la requête (et ses tokens) tienne dans la fenêtre d'une minute.
+        """
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    self._tokens -= self._events.popleft()[1]
+                if len(self._events) < self.rpm and self._tokens + tokens <= self.tpm:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                delay = 60 - (now - self._events[0][0])
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+
+
+@dataclass
+class StageMetrics:
+    """
+    Compteurs d'une étape : éléments traités, temps actif et temps bloqué.
+    """
+    name: str
+    items: int = 0
+    chunks: int = 0
+    errors: int = 0
+    busy_time: float = 0.0
+    blocked_time: float = 0.0   # Temps passé à attendre de la place dans la file suivante
+    max_queue_depth: int = 0
+
+    def report(self, elapsed: float) -> str:
+        busy_pct = 100 * self.busy_time / elapsed if elapsed else 0.0
+        return (f"{self.name:<10} {self.items:>6} batches {self.chunks:>8} chunks "
+                f"actif {busy_pct:5.1f}%  bloqué {self.blocked_time:7.1f}s  "
+                f"file max {self.max_queue_depth}  erreurs {self.errors}")
+
+
+@dataclass
+class EmbedBatch:
+    """
+    Batch de chunks à embedder puis upserter.
+    """
+    chunks: list
+    ids: List[str]
+    number: int = 0
+    vectors: Optional[List[List[float]]] = None
+
+    def sources(self) -> List[str]:
+        return sorted({chunk.metadata["source"] for chunk in self.chunks})
+
+
+@dataclass
+class PipelineState:
+    """
+    Suivi des PDFs en attente de confirmation de leurs points.
+    """
+    pending_ids: Dict[str, set] = field(default_factory=dict)       # source -> IDs non confirmés
+    waiting_files: Dict[str, set] = field(default_factory=dict)     # ID non confirmé -> sources
+    files: Dict[str, Tuple] = field(default_factory=dict)            # source -> (hash, référencés, obsolètes)
+    failed_ids: set = field(default_factory=set)
+    failed_sources: set = field(default_factory=set)
+    total_chunks: int = 0
+
+
+async def _put(queue: asyncio.Queue, item, metrics: StageMetrics):
+    """
+    Ajoute un élément à une file en mesurant le temps bloqué (backpressure).
+    """
+    start = time.perf_counter()
+    await queue.put(item)
+    metrics.blocked_time += time.perf_counter() - start
+    metrics.max_queue_depth = max(metrics.max_queue_depth, queue.qsize())
+
+
+async def run_ingestion_pipeline(
+    prepared_files: Iterator[Tuple],
+    embeddings,
+    client: AsyncQdrantClient,
+    collection_name: str,
+    manifest,
+    dedup,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    embed_concurrency: int = EMBED_CONCURRENCY,
+    requests_per_minute: int = EMBED_RPM,
+    tokens_per_minute: int = EMBED_TPM,
+    upsert_concurrency: int = UPSERT_CONCURRENCY,
+    queue_size: int = QUEUE_SIZE,
+    lexical_index=None,
+    reduced_dim: int = 0,
+    local_store=None,
+    journal=None
+) -> Tuple[int, List[str]]:
+    """
+    Exécute le pipeline parsing -> embeddings -> upsert.
+
+    Args:
+        prepared_files: Itérateur bloquant de PDFs préparés
+            (source, hash, chunks, ids, IDs référencés, IDs obsolètes)
+        embeddings: Modèle d'embeddings (aembed_documents)
+        client: Client Qdrant asynchrone (None = base locale seulement)
+        collection_name: Collection cible
+        manifest: Manifeste d'indexation
+        dedup: Index de déduplication des chunks
+        lexical_index: Index BM25 à tenir à jour avec les mêmes points (optionnel)
+        reduced_dim: Dimension du vecteur de recherche des collections deux étapes (0 = vecteur unique)
+        local_store: Base vectorielle locale écrite avec les mêmes points (optionnel)
+        journal: Journal d'indexation (IndexJournal) où tracer chaque batch (optionnel)
+
+    Returns:
+        tuple: (nombre de chunks indexés, sources en échec)
+    """
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    metrics = {name: StageMetrics(name) for name in ("parsing", "embedding", "upsert")}
+    state = PipelineState()
+    # Bornée par embed_batch_size : réduite après une limite de débit ou un timeout, puis rétablie
+    sizer = AdaptiveBatchSize(initial=embed_batch_size, minimum=min(UPLOAD_BATCH_MIN, embed_batch_size),
+                              maximum=embed_batch_size)
+    start_time = time.perf_counter()
+
+    def fail_batch(batch: EmbedBatch, error: Exception):
+        state.failed_ids.update(batch.ids)
+        for pid in batch.ids:
+            state.failed_sources.update(state.waiting_files.pop(pid, ()))
+        if journal is not None:
+            journal.batch_failed(batch.number, batch.sources(), len(batch.ids), f"{type(error).__name__}: {error}")
+
+    async def record_files(sources):
+        """
+        Enregistre des PDFs dans le manifeste et supprime leurs anciens points.
+        """
+        stale_ids = []
+        for source in sources:
+            file_hash, referenced_ids, stale = state.files.pop(source)
+            manifest.record(source, file_hash, referenced_ids)
+            stale_ids.extend(stale)
+        stale_ids = manifest.unreferenced(stale_ids)
+        if stale_ids:
+            if client is not None:
+                await acall_with_retry(
+                    lambda: client.delete(collection_name, points_selector=PointIdsList(points=stale_ids)),
+                    "suppression des chunks obsolètes"
+                )
+            if local_store is not None:
+                local_store.delete(stale_ids)
+            if lexical_index is not None:
+                lexical_index.delete(stale_ids)
+        # Index BM25 validé avec les PDFs, avant le manifeste
+        if lexical_index is not None:
+            lexical_index.save()
+        manifest.save()
+
+    async def commit_ready(confirmed_ids) -> List[str]:
+        """
+        Enregistre les PDFs dont tous les points sont confirmés.
+
+        Returns:
+            list: Sources enregistrées dans le manifeste
+        """
+        ready = []
+        for pid in confirmed_ids:
+            for source in state.waiting_files.pop(pid, ()):
+                pending = state.pending_ids[source]
+                pending.discard(pid)
+                if not pending and source not in state.failed_sources:
+                    ready.append(source)
+        if ready:
+            await record_files(ready)
+        return ready
+
+    async def parse_stage():
+        """
+        Lit les PDFs préparés (dans un thread) et forme les batches d'embeddings.
+        """
+        stage = metrics["parsing"]
+        batch = EmbedBatch(chunks=[], ids=[])
+        while True:
+            busy_start = time.perf_counter()
+            item = await asyncio.to_thread(next, prepared_files, None)
+            stage.busy_time += time.perf_counter() - busy_start
+            if item is None:
+                break
+            source, file_hash, chunks, ids, referenced_ids, stale_ids = item
+            stage.chunks += len(chunks)
+            state.files[source] = (file_hash, referenced_ids, stale_ids)
+
+            # Le PDF attend ses nouveaux points et ceux, encore en vol, d'autres PDFs
+            if state.failed_ids.intersection(referenced_ids):
+                state.failed_sources.add(source)
+            pending = set(ids) | {pid for pid in referenced_ids if pid in state.waiting_files}
+            state.pending_ids[source] = pending
+            for pid in pending:
+                state.waiting_files.setdefault(pid, set()).add(source)
+            if not pending and source not in state.failed_sources:
+                await record_files([source])
+
+            for chunk, pid in zip(chunks, ids):
+                batch.chunks.append(chunk)
+                batch.ids.append(pid)
+                if len(batch.chunks) >= sizer.size:
+                    stage.items += 1
+                    batch.number = stage.items
+                    await _put(embed_queue, batch, stage)
+                    batch = EmbedBatch(chunks=[], ids=[])
+        if batch.chunks:
+            stage.items += 1
+            batch.number = stage.items
+            await _put(embed_queue, batch, stage)
+
+    async def embed_worker():
+        stage = metrics["embedding"]
+        while True:
+            batch = await embed_queue.get()
+            if batch is _END:
+                return
+            tokens = {pid: count_tokens(chunk.page_content) for chunk, pid in zip(batch.chunks, batch.ids)}
+            await limiter.acquire(sum(tokens.values()))
+            vectors = {}
+            calls = 0
+
+            async def embed(chunks, ids):
+                nonlocal calls
+                calls += 1
+                if calls > 1:
+                    # Nouvel essai ou moitié de batch : une requête de plus pour la limite de débit
+                    await limiter.acquire(sum(tokens[pid] for pid in ids))
+                texts = [chunk.page_content for chunk in chunks]
+                vectors.update(zip(ids, await embeddings.aembed_documents(texts)))
+
+            busy_start = time.perf_counter()
+            try:
+                with measure("index_embedding", trace=False) as measured:
+                    embed_stats = await awrite_with_split(embed, batch.chunks, batch.ids, sizer)
+                    batch.vectors = [vectors[pid] for pid in batch.ids]
+                    measured.record(chunks=len(batch.ids), embedding_tokens=sum(tokens.values()), **embed_stats)
+            except Exception as e:
+                print(f"\n❌ Erreur d'embedding ({len(batch.ids)} chunks) : {e}")
+                stage.errors += 1
+                fail_batch(batch, e)
+                continue
+            finally:
+                stage.busy_time += time.perf_counter() - busy_start
+            stage.items += 1
+            stage.chunks += len(batch.ids)
+            await _put(upsert_queue, batch, stage)
+
+    async def upsert_worker():
+        stage = metrics["upsert"]
+        while True:
+            batch = await upsert_queue.get()
+            if batch is _END:
+                return
+            # Liste complète des PDFs contenant chaque chunk, et leurs métadonnées filtrées
+            points = []
+            for chunk, pid, vector in zip(batch.chunks, batch.ids, batch.vectors):
+                metadata = dict(chunk.metadata)
+                if pid in dedup.sources:
+                    metadata.update(dedup.payload(pid))
+                else:
+                    metadata["sources"] = [metadata["source"]]
+                points.append(PointStruct(id=pid, vector=point_vectors(vector, reduced_dim), payload={
+                    QdrantVectorStore.CONTENT_KEY: chunk.page_content,
+                    QdrantVectorStore.METADATA_KEY: metadata,
+                }))
+            vectors = dict(zip(batch.ids, batch.vectors))
+
+            async def write(batch_points, point_ids):
+                if client is not None:
+                    await client.upsert(collection_name, points=batch_points)
+                if local_store is not None:
+                    await asyncio.to_thread(
+                        local_store.add_vectors, point_ids, [vectors[pid] for pid in point_ids],
+                        [point.payload[QdrantVectorStore.CONTENT_KEY] for point in batch_points],
+                        [point.payload[QdrantVectorStore.METADATA_KEY] for point in batch_points]
+                    )
+
+            busy_start = time.perf_counter()
+            try:
+                with measure("index_upsert", trace=False) as measured:
+                    upsert_stats = await awrite_with_split(write, points, batch.ids, sizer)
+                    measured.record(chunks=len(points), **upsert_stats)
+                stage.items += 1
+                stage.chunks += len(points)
+                state.total_chunks += len(points)
+                if lexical_index is not None:
+                    lexical_index.upsert(batch.ids, [
+                        Document(page_content=point.payload[QdrantVectorStore.CONTENT_KEY],
+                                 metadata=point.payload[QdrantVectorStore.METADATA_KEY])
+                        for point in points
+                    ])
+                committed = await commit_ready(batch.ids)
+                if journal is not None:
+                    journal.batch_committed(batch.number, committed, len(points), **upsert_stats)
+            except Exception as e:
+                print(f"\n❌ Erreur d'upsert ({len(points)} points) : {e}")
+                stage.errors += 1
+                fail_batch(batch, e)
+            finally:
+                stage.busy_time += time.perf_counter() - busy_start
+
+    async def progress_reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            elapsed = time.perf_counter() - start_time
+            print(f"\n⏱️ {elapsed:.0f}s — file embed {embed_queue.qsize()}/{queue_size}, "
+                  f"file upsert {upsert_queue.qsize()}/{queue_size}, "
+                  f"attente rate limit {limiter.wait_time:.1f}s")
+            for stage in metrics.values():
+                print(f"   {stage.report(elapsed)}")
+
+    reporter = asyncio.create_task(progress_reporter())
+    embedders = [asyncio.create_task(embed_worker()) for _ in range(embed_concurrency)]
+    upserters = [asyncio.create_task(upsert_worker()) for _ in range(upsert_concurrency)]
+    try:
+        await parse_stage()
+        for _ in embedders:
+            await embed_queue.put(_END)
+        await asyncio.gather(*embedders)
+        for _ in upserters:
+            await upsert_queue.put(_END)
+        await asyncio.gather(*upserters)
+    finally:
+        reporter.cancel()
+
+    # Annuler les PDFs en échec, puis mettre à jour les sources des points déjà stockés
+    failed_sources = sorted(state.failed_sources | set(state.files))
+    for source in failed_sources:
+        dedup.remove_source(source)
+    payload_updates = dedup.pop_payload_updates()
+    if payload_updates:
+        if client is not None:
+            await acall_with_retry(
+                lambda: client.batch_update_points(collection_name, update_operations=payload_updates),
+                "mise à jour des sources"
+            )
+        if local_store is not None:
+            local_store.apply_payload_updates(payload_updates)
+        if lexical_index is not None:
+            lexical_index.apply_payload_updates(payload_updates)
+            lexical_index.save()
+    dedup.save()
+    manifest.save()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n📊 Pipeline terminé en {elapsed:.1f}s (attente rate limit {limiter.wait_time:.1f}s)")
+    for stage in metrics.values():
+        print(f"   {stage.report(elapsed)}")
+
+    return state.total_chunks, failed_sources
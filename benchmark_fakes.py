@@ -0,0 +1,205 @@
+"""
+Substituts locaux d'OpenAI et de Qdrant Cloud pour les benchmarks hors ligne.
+
+- HashingFakeEmbeddings : embeddings déterministes (hachage des tokens du texte),
+  assez proches du sens pour que la recherche renvoie des chunks pertinents
+- ScriptedChatModel : modèle de chat scripté, avec latence configurable
+- load_local_vectorstore : collection Qdrant en mémoire (ou en mode local sur disque)
+  remplie à partir des PDFs d'un dossier
+- load_mmap_vectorstore : même corpus dans la base locale de local_vectorstore.py
+- git_revision, results_path, save_results : enregistrement des résultats de tous
+  les benchmarks (RESULTS_DIR/<préfixe>_<commit>.json)
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, VectorParams
+
+from index_manifest import chunk_point_ids
+from lexical_index import tokenize
+from local_vectorstore import LocalVectorStore
+from pdf_processing import iter_parsed_pdfs, deserialize_chunks
+
+# Configuration
+RESULTS_DIR = "benchmark_results"
+FAKE_EMBEDDING_DIM = 1536  # Même dimension que text-embedding-3-small
+DEFAULT_ANSWER = (
+    "D'après les documents fournis, la proposition de loi prévoit plusieurs mesures. "
+    "Elle modifie le code concerné et précise les conditions d'application. "
+    "Source : document cité ci-dessous."
+)
+REFORMULATION_SYSTEM_PREFIX = "Tu es un assistant qui reformule"
+
+
+class HashingFakeEmbeddings(Embeddings):
+    """
+    Embeddings déterministes : chaque token (tokenisation BM25) est haché vers une
+    dimension avec un signe, puis le vecteur est normalisé.
+    """
+
+    def __init__(self, dim: int = FAKE_EMBEDDING_DIM, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Modèle de chat scripté : reformulations lues dans un dictionnaire, réponse fixe.
+
+    La latence simule le temps jusqu'au premier token (latency_ms), puis le débit
+    de génération (tokens_per_second, 0 = instantané).
+    """
+
+    answer: str = DEFAULT_ANSWER
+    reformulations: Dict[str, str] = {}
+    latency_ms: float = 0.0
+    tokens_per_second: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    @staticmethod
+    def is_reformulation(messages) -> bool:
+        return bool(messages) and str(messages[0].content).startswith(REFORMULATION_SYSTEM_PREFIX)
+
+    def _reply(self, messages) -> str:
+        if not self.is_reformulation(messages):
+            return self.answer
+        prompt = str(messages[-1].content)
+        query = prompt.split("Question actuelle : ", 1)[-1].split("\n", 1)[0].strip()
+        return self.reformulations.get(query, query)
+
+    def _tokens(self, text: str) -> List[str]:
+        words = text.split(" ")
+        return [word + (" " if idx < len(words) - 1 else "") for idx, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        delay = self.latency_ms / 1000
+        if self.tokens_per_second:
+            delay += len(self._tokens(reply)) / self.tokens_per_second
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        for token in self._tokens(self._reply(messages)):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def load_local_vectorstore(pdf_folder: str, embeddings: Embeddings, collection_name: str,
+                           qdrant_path: Optional[str] = None, chunk_size: int = 1000,
+                           chunk_overlap: int = 200) -> QdrantVectorStore:
+    """
+    Crée une collection Qdrant locale et y indexe les PDFs du dossier.
+
+    Args:
+        pdf_folder: Dossier des PDFs (ex: "data")
+        embeddings: Modèle d'embeddings (HashingFakeEmbeddings pour rester hors ligne)
+        collection_name: Nom de la collection
+        qdrant_path: Dossier du mode local de Qdrant (None = en mémoire)
+
+    Returns:
+        QdrantVectorStore: Vectorstore prêt pour la recherche
+    """
+    client = QdrantClient(path=qdrant_path) if qdrant_path else QdrantClient(location=":memory:")
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    dim = len(embeddings.embed_query("dimension"))
+    client.create_collection(collection_name, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+    vectorstore = QdrantVectorStore(client=client, collection_name=collection_name, embedding=embeddings)
+
+    _add_pdf_chunks(vectorstore, pdf_folder, chunk_size, chunk_overlap)
+    return vectorstore
+
+
+def load_mmap_vectorstore(pdf_folder: str, embeddings: Embeddings, directory: str,
+                          chunk_size: int = 1000, chunk_overlap: int = 200) -> LocalVectorStore:
+    """
+    Crée une base vectorielle locale (vidée au préalable) et y indexe les PDFs du dossier.
+    """
+    if Path(directory).exists():
+        for path in Path(directory).iterdir():
+            path.unlink()
+    vectorstore = LocalVectorStore(directory, embeddings)
+    _add_pdf_chunks(vectorstore, pdf_folder, chunk_size, chunk_overlap)
+    return vectorstore
+
+
+def _add_pdf_chunks(vectorstore, pdf_folder: str, chunk_size: int, chunk_overlap: int):
+    pdf_files = sorted(Path(pdf_folder).glob("*.pdf"))
+    for pdf_path, serialized, error in iter_parsed_pdfs(pdf_files, chunk_size, chunk_overlap, num_workers=1):
+        if error:
+            print(f"⚠️ {pdf_path} ignoré : {error}")
+            continue
+        chunks = deserialize_chunks(serialized)
+        source = Path(pdf_path).name
+        vectorstore.add_documents(chunks, ids=chunk_point_ids(source, [c.page_content for c in chunks]))
+
+
+def git_revision() -> dict:
+    """
+    Commit courant et présence de modifications non commitées, enregistrés avec les résultats.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", False
+    return {"commit": commit, "dirty": dirty}
+
+
+def results_path(prefix: str, git: dict, output: Optional[str] = None) -> Path:
+    """
+    Fichier de résultats d'un benchmark : output, ou RESULTS_DIR/<prefix>_<commit>.json.
+    """
+    return Path(output or os.path.join(RESULTS_DIR, f"{prefix}_{git['commit']}.json"))
+
+
+def save_results(results: dict, output: Path):
+    """
+    Écrit les résultats d'un benchmark en JSON (dossier créé au besoin).
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Résultats : {output}")
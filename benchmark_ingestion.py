@@ -0,0 +1,490 @@
+"""
+Benchmark hors ligne de l'indexation (index_to_qdrant_cloud.py).
+
+L'indexation synchrone complète (manifeste, cache de pages, découpage, déduplication,
+embeddings, upserts par batches adaptatifs, index BM25, journal) est exécutée dans un
+dossier de travail temporaire, avec les substituts de benchmark_fakes.py : embeddings
+déterministes (latence configurable) et Qdrant en mode local (ou base locale).
+
+Le corpus est celui de data/, répliqué jusqu'à --pdfs fichiers. Chaque réplique a un
+contenu binaire distinct (hash, donc extraction réelle) et un texte brouillé par une
+permutation de lettres propre à la réplique (même longueur, mais aucun chunk dédupliqué
+avec l'original) ; le brouillage est mesuré à part et exclu des débits.
+
+Le rapport donne pages/s, chunks/s, le pic de RSS (processus principal et workers) et
+la part du temps de chaque étape. Les durées sont exclusives : une étape imbriquée
+suspend celle qui l'englobe (l'embedding n'est pas compté dans l'upsert), et la somme
+des étapes et de "other" donne la durée totale. Avec plusieurs workers, l'extraction
+et le découpage ont lieu dans les workers : "parsing" est alors l'attente de leurs
+résultats par le processus principal.
+
+Les résultats sont écrits en JSON (avec le commit git) dans benchmark_results/ ;
+--compare compare à un résultat précédent. --profile ajoute un profil du processus
+principal : cProfile (.prof, pour pstats ou snakeviz) ou piles échantillonnées au
+format replié (.folded, pour flamegraph.pl, inferno ou speedscope).
+
+Usage :
+    python benchmark_ingestion.py --pdfs 200 --workers 4
+    python benchmark_ingestion.py --pdfs 200 --embedding-latency-ms 300 --backend local
+    python benchmark_ingestion.py --profile stacks --compare benchmark_results/ingestion_<commit>.json
+"""
+
+import argparse
+import contextlib
+import cProfile
+import functools
+import importlib
+import io
+import json
+import os
+import pstats
+import random
+import resource
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Configuration
+PDF_FOLDER = "data"
+STAGES = [
+    "planning", "extraction", "page_cache_write", "page_cache_read", "chunking", "parsing",
+    "prepare", "dedup", "embedding_cache", "embedding", "upsert", "bookkeeping", "lexical_index", "other",
+]
+REPLICA_SUFFIX = "_r"            # l17b2108_proposition-loi_r0003.pdf
+SAMPLE_INTERVAL_MS = 5.0         # Période d'échantillonnage des piles (--profile stacks)
+REGRESSION_TOLERANCE = 0.10      # Baisse relative de pages/s au-delà de laquelle --compare échoue
+
+# config.py (importé par index_to_qdrant_cloud.py) exige les clés des services : valeurs
+# factices, aucun service distant n'est appelé pendant la mesure
+PLACEHOLDER_ENV = [
+    "OPENAI_API_KEY", "R2_ENDPOINT_URL", "R2_ACCESS_KEY_ID", "R2_SECRET_ACCESS_KEY", "BUCKET_NAME",
+    "QDRANT_CLOUD_URL", "QDRANT_API_KEY", "LANGFUSE_PUBLIC_KEY", "LANGFUSE_SECRET_KEY", "LANGFUSE_BASE_URL",
+]
+
+
+class StageClock:
+    """
+    Temps exclusif par étape, mesuré dans le thread principal.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = Counter()
+        self.calls: Dict[str, int] = Counter()
+        self._stack = []  # [[étape, début de la période en cours]]
+        self._thread = threading.get_ident()
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        if threading.get_ident() != self._thread:
+            yield
+            return
+        now = time.perf_counter()
+        if self._stack:
+            self.seconds[self._stack[-1][0]] += now - self._stack[-1][1]
+        self._stack.append([name, now])
+        self.calls[name] += 1
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.seconds[name] += now - self._stack.pop()[1]
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def iterate(self, name: str, iterator):
+        """
+        Mesure chaque élément produit par un itérateur (le travail du producteur).
+        """
+        iterator = iter(iterator)
+        while True:
+            with self.measure(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+
+class StackSampler:
+    """
+    Échantillonne la pile du thread principal et compte les piles repliées
+    ("module:fonction;module:fonction..." -> nombre d'échantillons).
+    """
+
+    def __init__(self, interval_ms: float = SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="stack_sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._sampler.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _replica_translation(replica: int) -> dict:
+    """
+    Permutation des lettres ASCII propre à une réplique (majuscules et minuscules).
+    """
+    letters = list(string.ascii_lowercase)
+    shuffled = random.Random(replica).sample(letters, len(letters))
+    mapping = dict(zip(letters, shuffled))
+    mapping.update({upper.upper(): shuffled_upper.upper() for upper, shuffled_upper in mapping.items()})
+    return str.maketrans(mapping)
+
+
+def _replica_number(pdf_path: str) -> int:
+    stem = Path(pdf_path).stem
+    suffix = stem.rsplit(REPLICA_SUFFIX, 1)[-1] if REPLICA_SUFFIX in stem else ""
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def build_corpus(source_folder: str, target_folder: Path, nb_pdfs: int) -> int:
+    """
+    Réplique les PDFs du dossier source jusqu'à nb_pdfs fichiers (la première
+    série garde les fichiers d'origine).
+
+    Returns:
+        int: Taille du corpus en octets
+    """
+    sources = sorted(Path(source_folder).glob("*.pdf"))
+    if not sources:
+        raise FileNotFoundError(f"Aucun PDF trouvé dans '{source_folder}'")
+    target_folder.mkdir(parents=True, exist_ok=True)
+    total_bytes = 0
+    for i in range(nb_pdfs):
+        source = sources[i % len(sources)]
+        replica = i // len(sources)
+        content = source.read_bytes()
+        if replica:
+            # Octets ajoutés après %%EOF : ignorés par les lecteurs, mais le hash change
+            content += f"\n%replica {replica}\n".encode("ascii")
+            name = f"{source.stem}{REPLICA_SUFFIX}{replica:04d}.pdf"
+        else:
+            name = source.name
+        (target_folder / name).write_bytes(content)
+        total_bytes += len(content)
+    return total_bytes
+
+
+def _wrap(clock: StageClock, owner, attribute: str, stage: str, generator: bool = False):
+    """
+    Remplace owner.attribute par une version mesurée dans l'étape donnée.
+    """
+    original = getattr(owner, attribute)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        if generator:
+            return clock.iterate(stage, original(*args, **kwargs))
+        with clock.measure(stage):
+            return original(*args, **kwargs)
+
+    setattr(owner, attribute, wrapper)
+
+
+def instrument(clock: StageClock, args, totals: dict):
+    """
+    Substituts (embeddings, Qdrant) et mesure des étapes de index_to_qdrant_cloud.py.
+
+    Les fonctions s'appellent via les globales de leurs modules : ce sont elles qui
+    sont enveloppées, avant la création des workers (qui héritent des mêmes fonctions).
+    """
+    import index_to_qdrant_cloud as indexer
+    import pdf_processing
+    from qdrant_client import QdrantClient
+    from langchain_qdrant import QdrantVectorStore
+
+    from benchmark_fakes import HashingFakeEmbeddings
+    from chunk_dedup import ChunkDeduplicator
+    from embedding_cache import CachedEmbeddings
+    from index_manifest import TargetManifests
+    from lexical_index import LexicalIndexWriter
+    from local_vectorstore import LocalVectorStore
+    from page_cache import PageCache
+    from qdrant_collection import VECTOR_SIZE
+
+    class TimedEmbeddings(HashingFakeEmbeddings):
+        def embed_documents(self, texts):
+            with clock.measure("embedding"):
+                totals["embedded_chunks"] += len(texts)
+                return super().embed_documents(texts)
+
+    qdrant_client = QdrantClient(path=args.qdrant_path) if args.qdrant_path else QdrantClient(location=":memory:")
+    indexer.PDF_FOLDER = str(args.corpus_folder)
+    indexer.NUM_WORKERS = args.workers
+    indexer.INDEX_PIPELINE = "sync"
+    indexer.INDEX_TARGETS = [args.backend]
+    indexer.OpenAIEmbeddings = lambda **kwargs: TimedEmbeddings(dim=VECTOR_SIZE, latency_ms=args.embedding_latency_ms)
+    indexer.QdrantClient = lambda **kwargs: qdrant_client
+
+    _wrap(clock, TargetManifests, "plan", "planning")
+    _wrap(clock, pdf_processing, "load_pdf_pages", "extraction")
+    _wrap(clock, pdf_processing, "chunk_pages", "chunking")
+    _wrap(clock, PageCache, "add", "page_cache_write")
+    _wrap(clock, PageCache, "read_pages", "page_cache_read")
+    _wrap(clock, ChunkDeduplicator, "add", "dedup")
+    _wrap(clock, CachedEmbeddings, "embed_documents", "embedding_cache")
+    _wrap(clock, QdrantVectorStore, "add_documents", "upsert")
+    _wrap(clock, LocalVectorStore, "add_documents", "upsert")
+    _wrap(clock, indexer, "upload_batch", "bookkeeping")
+    _wrap(clock, LexicalIndexWriter, "upsert", "lexical_index")
+    _wrap(clock, LexicalIndexWriter, "save", "lexical_index")
+    _wrap(clock, indexer, "iter_prepared_pdfs", "prepare", generator=True)
+
+    iter_parsed_pdfs = indexer.iter_parsed_pdfs
+    translations = {}
+
+    def parsed_replicas(*parse_args, **parse_kwargs):
+        for pdf_path, chunks, error in clock.iterate("parsing", iter_parsed_pdfs(*parse_args, **parse_kwargs)):
+            with clock.measure("replication"):
+                replica = _replica_number(pdf_path)
+                if replica:
+                    translation = translations.setdefault(replica, _replica_translation(replica))
+                    for chunk in chunks:
+                        chunk["page_content"] = chunk["page_content"].translate(translation)
+                totals["chunks"] += len(chunks)
+                totals["pages"] += max((chunk["metadata"].get("total_pages", 0) for chunk in chunks), default=0)
+            yield pdf_path, chunks, error
+
+    indexer.iter_parsed_pdfs = parsed_replicas
+    return indexer
+
+
+def _peak_rss_mib(who: int) -> float:
+    # ru_maxrss est en Kio sous Linux (en octets sous macOS)
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def run_ingestion(args) -> tuple:
+    """
+    Indexe le corpus répliqué (depuis le dossier de travail courant) et mesure chaque étape.
+
+    Returns:
+        tuple: (débits, mémoire et durée exclusive de chaque étape ; profileur ; échantillonneur)
+    """
+    # Préchargement explicite du chargeur PDF (import lourd, fait sinon au premier PDF
+    # extrait) : son coût reste hors mesure. L'avertissement d'abandon de
+    # langchain-community, émis à l'import, est masqué
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        importlib.import_module("langchain_community.document_loaders.pdf")
+
+    clock = StageClock()
+    totals = Counter()
+    indexer = instrument(clock, args, totals)
+
+    profiler = cProfile.Profile() if args.profile == "cprofile" else None
+    sampler = StackSampler(args.sample_interval_ms) if args.profile == "stacks" else None
+    rss_before = _peak_rss_mib(resource.RUSAGE_SELF)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        with sampler or contextlib.nullcontext():
+            if profiler is not None:
+                profiler.enable()
+            try:
+                indexer.index_pdfs_to_cloud()
+            except SystemExit as e:
+                totals["failed_run"] = 1 if e.code else 0
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    wall_s = time.perf_counter() - start
+
+    # Le brouillage des répliques n'appartient pas à l'indexation
+    replication_s = clock.seconds.pop("replication", 0.0)
+    ingestion_s = wall_s - replication_s
+    stages = {stage: clock.seconds.get(stage, 0.0) for stage in STAGES if stage != "other"}
+    stages["other"] = max(ingestion_s - sum(stages.values()), 0.0)
+    return {
+        "wall_s": round(wall_s, 3),
+        "ingestion_s": round(ingestion_s, 3),
+        "replication_s": round(replication_s, 3),
+        "failed_run": bool(totals["failed_run"]),
+        "pages": totals["pages"],
+        "chunks": totals["chunks"],
+        "embedded_chunks": totals["embedded_chunks"],
+        "pdfs_per_s": round(args.pdfs / ingestion_s, 2),
+        "pages_per_s": round(totals["pages"] / ingestion_s, 2),
+        "chunks_per_s": round(totals["chunks"] / ingestion_s, 2),
+        "peak_rss_mib": _peak_rss_mib(resource.RUSAGE_SELF),
+        "rss_before_mib": rss_before,
+        "peak_rss_workers_mib": _peak_rss_mib(resource.RUSAGE_CHILDREN),
+        "stages": {
+            stage: {"s": round(seconds, 4), "share": round(seconds / ingestion_s, 4), "calls": clock.calls.get(stage, 0)}
+            for stage, seconds in stages.items()
+        },
+    }, profiler, sampler
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+    """
+    Compare débits, mémoire et durées des étapes à un résultat précédent.
+
+    Returns:
+        bool: True si le débit en pages/s a baissé au-delà de la tolérance
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\n📊 Comparaison avec {baseline['git']['commit']} ({baseline_path})")
+    before, after = baseline["results"], results["results"]
+    print(f"{'':<22}{'avant':>12}{'après':>12}{'Δ':>9}")
+    for key in ("pages_per_s", "chunks_per_s", "peak_rss_mib", "peak_rss_workers_mib"):
+        delta = (after[key] - before[key]) / before[key] if before[key] else 0.0
+        print(f"{key:<22}{before[key]:>12.1f}{after[key]:>12.1f}{delta:>+9.0%}")
+    for stage in STAGES:
+        old, new = before["stages"].get(stage, {}).get("s", 0.0), after["stages"][stage]["s"]
+        if old or new:
+            # Pas d'écart relatif pour une étape quasi absente d'un des deux lancements
+            delta = f"{(new - old) / old:>+9.0%}" if old >= 0.01 else f"{'-':>9}"
+            print(f"{stage:<22}{old:>11.2f}s{new:>11.2f}s{delta}")
+    if baseline["config"] != results["config"]:
+        print("⚠️ Configurations différentes : comparaison indicative")
+    drop = 1 - after["pages_per_s"] / before["pages_per_s"] if before["pages_per_s"] else 0.0
+    return drop > tolerance
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de l'indexation")
+    parser.add_argument("--pdfs", type=int, default=100, help="Taille du corpus (PDFs de data/ répliqués)")
+    parser.add_argument("--pdf-folder", default=PDF_FOLDER)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus de parsing")
+    parser.add_argument("--backend", default="qdrant", choices=["qdrant", "local"],
+                        help="Qdrant en mode local, ou base mappée en mémoire (local_vectorstore.py)")
+    parser.add_argument("--qdrant-path", default=None, help="Mode local de Qdrant sur disque (défaut : en mémoire)")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0, help="Latence par requête d'embeddings")
+    parser.add_argument("--chunk-strategy", default=None, choices=["recursive", "legislative"])
+    parser.add_argument("--no-page-cache", action="store_true", help="PyPDFLoader sur chaque PDF, sans cache de pages")
+    parser.add_argument("--profile", default=None, choices=["cprofile", "stacks"],
+                        help="Profil du processus principal : .prof (cProfile) ou .folded (flamegraph)")
+    parser.add_argument("--sample-interval-ms", type=float, default=SAMPLE_INTERVAL_MS)
+    parser.add_argument("--workdir", default=None, help="Dossier de travail conservé (défaut : temporaire, supprimé)")
+    parser.add_argument("--verbose", action="store_true", help="Afficher les logs de l'indexeur")
+    parser.add_argument("--output", default=None, help="Fichier JSON (défaut : benchmark_results/ingestion_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Résultat JSON précédent à comparer")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    # Lues à l'import des modules de l'indexeur
+    for variable in PLACEHOLDER_ENV:
+        os.environ.setdefault(variable, "benchmark")
+    os.environ["LANGFUSE_TRACING_ENABLED"] = "false"
+    os.environ["PAGE_CACHE_ENABLED"] = "false" if args.no_page_cache else "true"
+    if args.chunk_strategy:
+        os.environ["CHUNK_STRATEGY"] = args.chunk_strategy
+    # Le mode local de Qdrant ignore quantization et HNSW : avertissements attendus
+    warnings.filterwarnings("ignore", module="qdrant_client")
+
+    # Importé après la configuration de l'environnement (constantes lues à l'import)
+    from benchmark_fakes import git_revision, results_path, save_results
+
+    git = git_revision()
+    output = results_path("ingestion", git, args.output).resolve()
+    compare_path = Path(args.compare).resolve() if args.compare else None
+    pdf_folder = Path(args.pdf_folder).resolve()
+    if args.qdrant_path:
+        args.qdrant_path = str(Path(args.qdrant_path).resolve())
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix="luxas_ingestion_"))
+    args.corpus_folder = workdir / "pdfs"
+
+    cwd = os.getcwd()
+    try:
+        corpus_bytes = build_corpus(str(pdf_folder), args.corpus_folder, args.pdfs)
+        print(f"🔧 Corpus : {args.pdfs} PDFs ({corpus_bytes / 2 ** 20:.1f} Mo) dans {workdir}")
+        print(f"⏱️ Indexation ({args.workers} workers, base {args.backend}, "
+              f"latence d'embeddings {args.embedding_latency_ms:.0f} ms)...")
+        # Manifeste, caches, journal et index BM25 sont créés dans le dossier de travail
+        os.chdir(workdir)
+        measures, profiler, sampler = run_ingestion(args)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    from pdf_processing import CHUNK_STRATEGY
+
+    results = {
+        "benchmark": "ingestion",
+        "git": git,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": {
+            "pdfs": args.pdfs,
+            "source_pdfs": len(list(pdf_folder.glob("*.pdf"))),
+            "corpus_mib": round(corpus_bytes / 2 ** 20, 1),
+            "workers": args.workers,
+            "backend": args.backend,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "chunk_strategy": CHUNK_STRATEGY,
+            "page_cache": not args.no_page_cache,
+            "profile": args.profile,
+        },
+        "results": measures,
+    }
+
+    print(f"\n{'Étape':<20}{'durée (s)':>12}{'part':>8}{'appels':>9}")
+    for stage, s in measures["stages"].items():
+        if s["s"]:
+            print(f"{stage:<20}{s['s']:>12.3f}{s['share']:>8.1%}{s['calls']:>9}")
+    print(f"\n📄 {args.pdfs} PDFs, {measures['pages']} pages, {measures['chunks']} chunks "
+          f"({measures['embedded_chunks']} embeddés) en {measures['ingestion_s']:.1f} s : "
+          f"{measures['pages_per_s']:.1f} pages/s, {measures['chunks_per_s']:.1f} chunks/s")
+    print(f"🧠 Pic de RSS : {measures['peak_rss_mib']:.0f} Mio (processus principal, "
+          f"{measures['rss_before_mib']:.0f} Mio avant l'indexation), {measures['peak_rss_workers_mib']:.0f} Mio (workers)")
+    if measures["failed_run"]:
+        print("⚠️ L'indexation a signalé des échecs (relancer avec --verbose)")
+    if args.profile:
+        print("⚠️ Profil actif : durées surestimées, à ne pas comparer avec un lancement sans profil")
+
+    save_results(results, output)
+
+    if profiler is not None:
+        profile_path = output.with_suffix(".prof")
+        profiler.dump_stats(str(profile_path))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        print(f"🔬 Profil cProfile : {profile_path} (snakeviz {profile_path.name})")
+    if sampler is not None:
+        profile_path = output.with_suffix(".folded")
+        sampler.write(str(profile_path))
+        print(f"🔬 Piles échantillonnées ({sum(sampler.stacks.values())}) : {profile_path} "
+              f"(flamegraph.pl {profile_path.name} > flamegraph.svg)")
+
+    if compare_path is not None:
+        if compare(results, str(compare_path), args.tolerance):
+            print(f"\n❌ Débit en baisse de plus de {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\n✅ Pas de régression du débit")
+
+
+if __name__ == "__main__":
+    main()
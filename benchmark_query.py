@@ -0,0 +1,402 @@
+"""
+Benchmark hors ligne du chemin de requête (rag_agent_with_sources_conversational).
+
+OpenAI et Qdrant Cloud sont remplacés par des substituts locaux (benchmark_fakes.py) :
+embeddings déterministes, modèle de chat scripté à latence configurable, collection
+Qdrant en mémoire construite à partir des PDFs de data/.
+
+Un corpus de conversations (une ou plusieurs questions) est rejoué plusieurs fois ;
+le rapport donne p50/p95/p99 par étape :
+reformulation, embedding, search, rerank, prompt_assembly, generation,
+sources_formatting et total. Une seconde passe, sous tracemalloc, mesure les
+allocations (pic par question, mémoire retenue après la passe).
+
+Les résultats sont écrits en JSON (avec le commit git) dans benchmark_results/ ;
+--compare compare à un résultat précédent et signale les régressions.
+--batch-concurrency mesure en plus le débit du corpus traité en lot (rag_batch.py)
+face au traitement question par question.
+
+Usage :
+    python benchmark_query.py --repeat 20
+    python benchmark_query.py --llm-latency-ms 800 --compare benchmark_results/query_<commit>.json
+    python benchmark_query.py --llm-latency-ms 800 --embedding-latency-ms 50 --batch-concurrency 16
+"""
+
+import argparse
+import contextlib
+import contextvars
+import functools
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Pas d'export des traces Langfuse pendant la mesure (surcharge réseau non représentative)
+os.environ.setdefault("LANGFUSE_TRACING_ENABLED", "false")
+
+import rag
+import rag_batch
+from benchmark_fakes import (
+    RESULTS_DIR, HashingFakeEmbeddings, ScriptedChatModel, git_revision, load_local_vectorstore,
+    load_mmap_vectorstore, results_path, save_results
+)
+from reranking import load_reranker
+
+# Sans clés Langfuse, chaque span afficherait un avertissement d'authentification
+logging.getLogger("langfuse").setLevel(logging.CRITICAL)
+# Le mode local de Qdrant ignore search_params (recherche exacte) : avertissement attendu
+warnings.filterwarnings("ignore", message="Local mode performs exact")
+
+# Configuration
+PDF_FOLDER = "data"
+STAGES = [
+    "reformulation", "embedding", "search", "rerank",
+    "prompt_assembly", "generation", "sources_formatting", "total",
+]
+REGRESSION_TOLERANCE = 0.10  # Écart relatif (p50/p95) au-delà duquel une étape est signalée
+MIN_REGRESSION_MS = 0.5      # Écart absolu minimal, pour ignorer le bruit des étapes très courtes
+
+# Conversations rejouées : chaque tour donne la question et, pour les questions de
+# suivi, la reformulation renvoyée par le modèle scripté
+CONVERSATIONS = [
+    [{"query": "Que propose la loi contre la vie chère dans les territoires d'outre-mer ?"}],
+    [{"query": "Quelles sanctions sont prévues contre la maltraitance des animaux domestiques ?"}],
+    [{"query": "Comment la proposition de loi modifie-t-elle les délais de prescription en droit pénal ?"}],
+    [{"query": "Les médecins diplômés au Royaume-Uni avant le Brexit peuvent-ils exercer en France ?"}],
+    [
+        {"query": "Quelle proposition de loi concerne les animaux de compagnie ?"},
+        {"query": "Et quelles sont les peines prévues ?",
+         "reformulation": "Quelles peines prévoit la proposition de loi sur la maltraitance des animaux de compagnie ?"},
+        {"query": "Peux-tu préciser l'article 1 ?",
+         "reformulation": "Que contient l'article 1 de la proposition de loi sur la maltraitance animale ?"},
+    ],
+    [
+        {"query": "Que dit le texte sur la prescription des crimes ?"},
+        {"query": "Et pour les délits ?",
+         "reformulation": "Que dit la proposition de loi sur la prescription des délits ?"},
+    ],
+    [
+        {"query": "Quelles mesures contre la vie chère sont proposées en outre-mer ?"},
+        {"query": "Quel est le rôle de l'observatoire des prix dans cette proposition ?",
+         "reformulation": "Quel est le rôle de l'observatoire des prix dans la proposition de loi sur la vie chère en outre-mer ?"},
+    ],
+]
+
+# Mesures de la question en cours : dictionnaire partagé par les threads de recherche
+# (le contexte est copié, le dictionnaire reste le même objet)
+_current_record = contextvars.ContextVar("benchmark_record", default=None)
+
+
+def _add_time(stage: str, elapsed_ms: float):
+    record = _current_record.get()
+    if record is not None:
+        record[stage] = record.get(stage, 0.0) + elapsed_ms
+
+
+def _timed(stage: str, func):
+    """
+    Enveloppe une fonction pour ajouter sa durée à l'étape donnée.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add_time(stage, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+class TimedEmbeddings(HashingFakeEmbeddings):
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        try:
+            return super().embed_documents(texts)
+        finally:
+            _add_time("embedding", (time.perf_counter() - start) * 1000)
+
+
+class TimedChatModel(ScriptedChatModel):
+    """
+    Modèle scripté qui mesure la génération de la réponse (hors reformulation,
+    mesurée par _reformulate).
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        finally:
+            if not self.is_reformulation(messages):
+                _add_time("generation", (time.perf_counter() - start) * 1000)
+
+
+def setup(args) -> int:
+    """
+    Remplace les composants de rag.py par les substituts locaux et instrumente les étapes.
+
+    Returns:
+        int: Nombre de chunks indexés
+    """
+    reformulations = {turn["query"]: turn["reformulation"]
+                      for conversation in CONVERSATIONS for turn in conversation if "reformulation" in turn}
+
+    rag.embeddings = TimedEmbeddings(dim=args.embedding_dim, latency_ms=args.embedding_latency_ms)
+    rag.llm = TimedChatModel(
+        reformulations=reformulations,
+        latency_ms=args.llm_latency_ms,
+        tokens_per_second=args.tokens_per_second
+    )
+    rag.reformulation_llm = None
+    rag.reranker = load_reranker()
+
+    # L'indexation n'est pas mesurée : pas d'enregistrement actif pendant le chargement
+    if args.backend == "local":
+        rag.vectorstore = load_mmap_vectorstore(
+            args.pdf_folder, rag.embeddings, os.path.join(RESULTS_DIR, "query_local_vectors")
+        )
+    else:
+        rag.vectorstore = load_local_vectorstore(
+            args.pdf_folder, rag.embeddings, rag.collection_name, qdrant_path=args.qdrant_path
+        )
+    rag._components_ready = True
+
+    # Les fonctions de rag.py s'appellent via les globales du module : on les enveloppe
+    rag._reformulate = _timed("reformulation", rag._reformulate)
+    rag._vector_search = _timed("search", rag._vector_search)
+    rag._rerank = _timed("rerank", rag._rerank)
+    rag._build_messages = _timed("prompt_assembly", rag._build_messages)
+    rag._format_sources_section = _timed("sources_formatting", rag._format_sources_section)
+
+    if args.backend == "local":
+        return len(rag.vectorstore)
+    return rag.vectorstore.client.count(rag.collection_name).count
+
+
+def replay_corpus(measure_allocations: bool = False, verbose: bool = False) -> list:
+    """
+    Rejoue toutes les conversations une fois (sorties de rag.py masquées sauf si verbose).
+
+    Returns:
+        list: Un dictionnaire {étape: ms} par question (+ "peak_kib" sous tracemalloc)
+    """
+    records = []
+    for conversation in CONVERSATIONS:
+        chat_history = []
+        for turn in conversation:
+            record = {}
+            token = _current_record.set(record)
+            if measure_allocations:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                    answer = rag.rag_agent_with_sources_conversational(turn["query"], chat_history)
+            finally:
+                _current_record.reset(token)
+            record["total"] = (time.perf_counter() - start) * 1000
+            if measure_allocations:
+                record["peak_kib"] = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+            # La recherche inclut l'appel d'embedding : on ne garde que la part Qdrant
+            record["search"] = max(record.get("search", 0.0) - record.get("embedding", 0.0), 0.0)
+            records.append(record)
+            chat_history += [
+                {"role": "user", "content": turn["query"]},
+                {"role": "assistant", "content": answer.answer},
+            ]
+    return records
+
+
+def measure_batch(concurrency: int, verbose: bool = False) -> dict:
+    """
+    Débit du corpus question par question, puis en un seul lot (rag_batch.py), avec
+    les mêmes historiques.
+
+    Returns:
+        dict: Durées et questions par seconde des deux modes
+    """
+    items = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        for conversation in CONVERSATIONS:
+            chat_history = []
+            for turn in conversation:
+                items.append((turn["query"], list(chat_history)))
+                answer = rag.rag_agent_with_sources_conversational(turn["query"], chat_history)
+                chat_history += [
+                    {"role": "user", "content": turn["query"]},
+                    {"role": "assistant", "content": answer.answer},
+                ]
+    sequential_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        results = rag_batch.rag_agent_batch(items, concurrency=concurrency)
+    batch_s = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "nb_questions": len(items),
+        "errors": sum(1 for result in results if result.error is not None),
+        "sequential_s": round(sequential_s, 3),
+        "batch_s": round(batch_s, 3),
+        "sequential_qps": round(len(items) / sequential_s, 2),
+        "batch_qps": round(len(items) / batch_s, 2),
+        "speedup": round(sequential_s / batch_s, 2),
+    }
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"n": 0}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "n": len(values),
+        "mean": round(float(array.mean()), 4),
+        "p50": round(float(np.percentile(array, 50)), 4),
+        "p95": round(float(np.percentile(array, 95)), 4),
+        "p99": round(float(np.percentile(array, 99)), 4),
+    }
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> list:
+    """
+    Compare les percentiles à un résultat précédent.
+
+    Returns:
+        list: Étapes en régression (p50 ou p95 au-delà de la tolérance)
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\n📊 Comparaison avec {baseline['git']['commit']} ({baseline_path})")
+    print(f"{'Étape':<20}{'p50 avant':>12}{'p50 après':>12}{'Δ p50':>9}{'p95 avant':>12}{'p95 après':>12}{'Δ p95':>9}")
+    regressions = []
+    for stage in STAGES:
+        before = baseline["stages"].get(stage, {})
+        after = results["stages"].get(stage, {})
+        if not before.get("n") or not after.get("n"):
+            continue
+        deltas = {}
+        for key in ("p50", "p95"):
+            diff = after[key] - before[key]
+            deltas[key] = diff / before[key] if before[key] else 0.0
+            if deltas[key] > tolerance and diff > MIN_REGRESSION_MS:
+                regressions.append(stage)
+        flag = " ⚠️" if stage in regressions else ""
+        print(f"{stage:<20}{before['p50']:>12.2f}{after['p50']:>12.2f}{deltas['p50']:>+9.0%}"
+              f"{before['p95']:>12.2f}{after['p95']:>12.2f}{deltas['p95']:>+9.0%}{flag}")
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne du chemin de requête RAG")
+    parser.add_argument("--repeat", type=int, default=10, help="Passes mesurées sur le corpus")
+    parser.add_argument("--warmup", type=int, default=1, help="Passes de chauffe non mesurées")
+    parser.add_argument("--pdf-folder", default=PDF_FOLDER)
+    parser.add_argument("--qdrant-path", default=None, help="Mode local de Qdrant sur disque (défaut : en mémoire)")
+    parser.add_argument("--backend", default="qdrant", choices=["qdrant", "local"],
+                        help="Qdrant en mode local, ou base mappée en mémoire (local_vectorstore.py)")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Latence jusqu'au premier token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Débit simulé (0 = instantané)")
+    parser.add_argument("--verbose", action="store_true", help="Afficher les logs de rag.py")
+    parser.add_argument("--no-allocations", action="store_true", help="Sauter la passe tracemalloc")
+    parser.add_argument("--output", default=None, help="Fichier JSON (défaut : benchmark_results/query_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Résultat JSON précédent à comparer")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--batch-concurrency", type=int, default=0,
+                        help="Mesurer aussi le débit en lot avec cette concurrence (0 = non)")
+    args = parser.parse_args()
+
+    print("🔧 Préparation des substituts locaux...")
+    nb_chunks = setup(args)
+    nb_questions = sum(len(conversation) for conversation in CONVERSATIONS)
+    print(f"✅ {nb_chunks} chunks indexés en mémoire, {len(CONVERSATIONS)} conversations "
+          f"({nb_questions} questions)")
+
+    for _ in range(args.warmup):
+        replay_corpus(verbose=args.verbose)
+
+    print(f"⏱️ {args.repeat} passes mesurées...")
+    records = []
+    for _ in range(args.repeat):
+        records.extend(replay_corpus(verbose=args.verbose))
+
+    stages = {stage: percentiles([r[stage] for r in records if stage in r]) for stage in STAGES}
+
+    allocations = None
+    if not args.no_allocations:
+        print("🧠 Passe d'allocations (tracemalloc)...")
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        alloc_records = replay_corpus(measure_allocations=True)
+        retained_kib = (tracemalloc.get_traced_memory()[0] - before) / 1024
+        tracemalloc.stop()
+        allocations = {
+            "peak_kib_per_query": percentiles([r["peak_kib"] for r in alloc_records]),
+            "retained_kib_after_pass": round(retained_kib, 1),
+        }
+
+    batch = None
+    if args.batch_concurrency:
+        print(f"📦 Débit en lot ({args.batch_concurrency} appels LLM simultanés)...")
+        batch = measure_batch(args.batch_concurrency, verbose=args.verbose)
+
+    results = {
+        "benchmark": "query_path",
+        "git": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": {
+            "repeat": args.repeat,
+            "nb_chunks": nb_chunks,
+            "nb_questions": nb_questions,
+            "embedding_dim": args.embedding_dim,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+            "tokens_per_second": args.tokens_per_second,
+            "reformulation_mode": rag.REFORMULATION_MODE,
+            "hybrid_search": rag.HYBRID_SEARCH,
+            "reranker": rag.reranker.scorer.name if rag.reranker else "none",
+            "backend": args.backend,
+        },
+        "stages": stages,
+        "allocations": allocations,
+        "batch": batch,
+    }
+
+    print(f"\n{'Étape':<20}{'n':>6}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}")
+    for stage in STAGES:
+        s = stages[stage]
+        if s["n"]:
+            print(f"{stage:<20}{s['n']:>6}{s['p50']:>12.3f}{s['p95']:>12.3f}{s['p99']:>12.3f}")
+    if allocations:
+        peak = allocations["peak_kib_per_query"]
+        print(f"\n🧠 Pic d'allocation par question : p50 {peak['p50']:.0f} KiB, p99 {peak['p99']:.0f} KiB ; "
+              f"retenu après la passe : {allocations['retained_kib_after_pass']:.0f} KiB")
+
+    if batch:
+        print(f"\n📦 {batch['nb_questions']} questions : {batch['sequential_qps']:.1f} questions/s une par une, "
+              f"{batch['batch_qps']:.1f} questions/s en lot (x{batch['speedup']:.1f})")
+
+    save_results(results, results_path("query", results["git"], args.output))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n❌ Régressions : {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ Pas de régression")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
+import json
 from typing import List, Dict
-from rag import rag_agent_with_sources_conversational, initialize_components, embeddings
+import httpx
+from rag import (
+    RAGAnswer,
+    rag_agent_with_sources_conversational,
+    rag_agent_with_sources_conversational_stream,
+    initialize_components,
+    stream_to_string,
+)
 from langfuse import observe
 
 @observe()
@@ -12,13 +20,11 @@ def interact_with_chatbot(user_message: str, chat_history: List[Dict[str, str]]
         chat_history: Historique des messages [{"role": "user/assistant", "content": "..."}]
     
     Returns:
-        str: Réponse du chatbot avec sources
+        RAGAnswer: Réponse, sources et chunks utilisés (seul .answer va dans l'historique)
     """
-    # Initialiser les composants si ce n'est pas encore fait (lazy loading)
-    if embeddings is None:
-        print("🔧 Initialisation des composants RAG...")
-        initialize_components()
-        print("✅ Composants prêts!")
+    # Initialiser les composants si ce n'est pas encore fait (lazy loading) :
+    # sans coût une fois le processus initialisé
+    initialize_components()
     
     if chat_history is None:
         chat_history = []
@@ -26,4 +32,79 @@ def interact_with_chatbot(user_message: str, chat_history: List[Dict[str, str]]
     # Appeler le RAG conversationnel qui gère tout
     response = rag_agent_with_sources_conversational(user_message, chat_history)
     
-    return response
\ No newline at end of file
+    return response
+
+@observe(transform_to_string=stream_to_string)
+def interact_with_chatbot_stream(user_message: str, chat_history: List[Dict[str, str]] = None):
+    """
+    Interagit avec le chatbot RAG conversationnel en streaming.
+    
+    Args:
+        user_message: Question de l'utilisateur
+        chat_history: Historique des messages [{"role": "user/assistant", "content": "..."}]
+    
+    Yields:
+        str: Morceaux de la réponse au fil de la génération, puis un RAGAnswer
+    """
+    # Initialiser les composants si ce n'est pas encore fait (lazy loading) :
+    # sans coût une fois le processus initialisé
+    initialize_components()
+    
+    if chat_history is None:
+        chat_history = []
+    
+    yield from rag_agent_with_sources_conversational_stream(user_message, chat_history)
+
+def interact_with_api_stream(api_url: str, user_message: str, chat_history: List[Dict[str, str]] = None):
+    """
+    Client léger : interroge l'API HTTP (api.py) en streaming SSE au lieu du RAG local.
+    
+    Args:
+        api_url: URL de base de l'API (ex: "http://localhost:8000")
+        user_message: Question de l'utilisateur
+        chat_history: Historique des messages [{"role": "user/assistant", "content": "..."}]
+    
+    Yields:
+        str: Morceaux de la réponse au fil de la génération, puis un RAGAnswer
+    """
+    payload = {"query": user_message, "chat_history": chat_history or []}
+    answer_parts = []
+    sources = {}
+    with httpx.stream("POST", f"{api_url.rstrip('/')}/chat/stream", json=payload, timeout=120) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    answer_parts.append(f"⚠️ Erreur de l'API : {data['error']}")
+                    yield answer_parts[-1]
+                elif event == "sources":
+                    sources = data
+                elif event == "message":
+                    answer_parts.append(data["token"])
+                    yield data["token"]
+            elif not line:
+                event = "message"
+    yield RAGAnswer(answer="".join(answer_parts), **sources)
+
+def summarize_with_api(api_url: str, summary: str, messages: List[Dict[str, str]]) -> str:
+    """
+    Client léger : fait calculer le résumé glissant de la conversation par l'API
+    (route /summary), à passer à ConversationMemory.update_summary(summarize=...).
+    
+    Args:
+        api_url: URL de base de l'API (ex: "http://localhost:8000")
+        summary: Résumé actuel ("" au premier résumé)
+        messages: Messages à intégrer au résumé
+    
+    Returns:
+        str: Nouveau résumé
+    """
+    response = httpx.post(
+        f"{api_url.rstrip('/')}/summary", json={"summary": summary, "messages": messages}, timeout=120
+    )
+    response.raise_for_status()
+    return response.json()["summary"]
@@ -0,0 +1,243 @@
+"""
+Déduplication des chunks avant embedding (doublons exacts et quasi-doublons).
+
+Les propositions de loi répètent les mêmes passages (page de garde, en-tête de
+législature, modèles d'exposé des motifs, listes de signataires). Chaque passage
+répété n'est stocké qu'une fois : le premier chunk rencontré devient le
+représentant, et les PDFs suivants sont ajoutés à sa liste `sources`. Les
+métadonnées de chaque PDF (numéro, législature, dépôt, auteurs, articles) sont
+gardées par source : le payload du représentant réunit celles de toutes ses
+sources (legal_metadata.filter_fields), pour que les filtres le trouvent depuis
+chacune d'elles.
+
+Détection :
+- doublons exacts : hash du texte normalisé
+- quasi-doublons : MinHash sur des shingles de mots + LSH par bandes, avec
+  vérification de la similarité de Jaccard estimée
+"""
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client.models import SetPayload, SetPayloadOperation
+
+from legal_metadata import SOURCE_FIELDS, filter_fields
+
+# Configuration
+DEDUP_INDEX_PATH = "dedup_index.npz"
+SHINGLE_SIZE = 5          # Mots par shingle
+NUM_PERM = 64             # Taille de la signature MinHash
+LSH_BANDS = 16            # NUM_PERM = LSH_BANDS * LSH_ROWS
+LSH_ROWS = 4
+JACCARD_THRESHOLD = 0.85  # Similarité estimée minimale pour un quasi-doublon
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalise un chunk : minuscules, sans accents ni ponctuation, espaces réduits.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def minhash_signature(normalized: str) -> np.ndarray:
+    """
+    Signature MinHash (NUM_PERM valeurs uint32) des shingles de mots du texte.
+    """
+    words = normalized.split()
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """
+    Index des chunks représentants, persisté entre deux exécutions de l'indexeur.
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH, threshold: float = JACCARD_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.sources: Dict[str, List[str]] = {}
+        self.fields: Dict[str, Dict[str, dict]] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._exact: Dict[str, str] = {}
+        self._exact_of: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[str]] = defaultdict(list)
+        self._dirty = set()
+        self.duplicates = 0
+        if os.path.exists(path):
+            self._load()
+
+    def _register(self, point_id: str, exact_hash: str, signature: np.ndarray, sources: List[str],
+                  fields: Dict[str, dict]):
+        self.sources[point_id] = sources
+        self.fields[point_id] = fields
+        self._signatures[point_id] = signature
+        self._exact[exact_hash] = point_id
+        self._exact_of[point_id] = exact_hash
+        for band in range(LSH_BANDS):
+            self._buckets[(band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())].append(point_id)
+
+    def _find(self, exact_hash: str, signature: np.ndarray) -> Optional[str]:
+        """
+        Cherche un représentant identique ou quasi identique.
+        """
+        if exact_hash in self._exact:
+            return self._exact[exact_hash]
+        candidates = set()
+        for band in range(LSH_BANDS):
+            candidates.update(self._buckets.get((band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()), ()))
+        best_id, best_score = None, self.threshold
+        for candidate in sorted(candidates):
+            score = float(np.mean(self._signatures[candidate] == signature))
+            if score >= best_score:
+                best_id, best_score = candidate, score
+        return best_id
+
+    def add(self, point_id: str, source: str, text: str, metadata: Optional[dict] = None) -> str:
+        """
+        Enregistre un chunk et renvoie l'ID du point qui le représente.
+
+        Args:
+            point_id: ID déterministe du chunk
+            source: PDF d'origine
+            text: Contenu du chunk
+            metadata: Métadonnées du chunk dans ce PDF (SOURCE_FIELDS conservés)
+
+        Returns:
+            str: point_id si le chunk est nouveau, sinon l'ID du représentant existant
+        """
+        normalized = normalize_text(text)
+        exact_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        signature = minhash_signature(normalized)
+
+        fields = {key: metadata[key] for key in SOURCE_FIELDS if key in metadata} if metadata else {}
+
+        representative = self._find(exact_hash, signature)
+        if representative is None:
+            self._register(point_id, exact_hash, signature, [source], {source: fields})
+            return point_id
+
+        if representative != point_id:
+            self.duplicates += 1
+        if source not in self.sources[representative]:
+            self.sources[representative].append(source)
+            self._dirty.add(representative)
+        if metadata is not None and self.fields[representative].get(source) != fields:
+            self.fields[representative][source] = fields
+            self._dirty.add(representative)
+        return representative
+
+    def remove_source(self, source: str) -> List[str]:
+        """
+        Retire un PDF de toutes les listes de sources.
+
+        Returns:
+            list: IDs des représentants qui n'ont plus aucune source
+        """
+        orphaned = []
+        for point_id, sources in list(self.sources.items()):
+            if source not in sources:
+                continue
+            sources.remove(source)
+            self.fields[point_id].pop(source, None)
+            if sources:
+                self._dirty.add(point_id)
+            else:
+                orphaned.append(point_id)
+                self._unregister(point_id)
+        return orphaned
+
+    def _unregister(self, point_id: str):
+        signature = self._signatures.pop(point_id)
+        self.sources.pop(point_id)
+        self.fields.pop(point_id)
+        self._dirty.discard(point_id)
+        self._exact.pop(self._exact_of.pop(point_id), None)
+        for band in range(LSH_BANDS):
+            key = (band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.remove(point_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def payload(self, point_id: str) -> dict:
+        """
+        Métadonnées d'un représentant qui dépendent de ses sources : `sources`, champs
+        de la première source (source, bill_number...) et champs filtrés de toutes.
+        """
+        sources = self.sources[point_id]
+        fields = self.fields[point_id]
+        payload = {"sources": list(sources), "source": sources[0]}
+        # Index écrit avant la conservation des champs par source : seules les sources sont connues
+        if sources[0] in fields:
+            payload.update({key: fields[sources[0]].get(key) for key in SOURCE_FIELDS})
+            payload.update(filter_fields([fields[source] for source in sources if source in fields]))
+        return payload
+
+    def pop_payload_updates(self, exclude: set = frozenset()) -> List[SetPayloadOperation]:
+        """
+        Opérations Qdrant mettant à jour les métadonnées dépendant des sources
+        (voir payload) des points déjà stockés.
+
+        Args:
+            exclude: IDs en cours d'upload (leurs métadonnées sont déjà à jour)
+        """
+        operations = [
+            SetPayloadOperation(set_payload=SetPayload(
+                payload=self.payload(point_id),
+                points=[point_id],
+                key="metadata"
+            ))
+            for point_id in sorted(self._dirty)
+            if point_id in self.sources and point_id not in exclude
+        ]
+        self._dirty.clear()
+        return operations
+
+    def save(self):
+        """
+        Écrit l'index de façon atomique (fichier temporaire puis renommage).
+        """
+        point_ids = list(self.sources.keys())
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            point_ids=np.array(point_ids, dtype=str),
+            exact_hashes=np.array([self._exact_of[pid] for pid in point_ids], dtype=str),
+            signatures=np.array([self._signatures[pid] for pid in point_ids], dtype=np.uint32).reshape(-1, NUM_PERM),
+            sources=np.array(json.dumps([self.sources[pid] for pid in point_ids])),
+            fields=np.array(json.dumps([self.fields[pid] for pid in point_ids], ensure_ascii=False))
+        )
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        data = np.load(self.path)
+        sources = json.loads(str(data["sources"]))
+        fields = json.loads(str(data["fields"])) if "fields" in data else [{} for _ in sources]
+        for point_id, exact_hash, signature, point_sources, point_fields in zip(
+            data["point_ids"], data["exact_hashes"], data["signatures"], sources, fields
+        ):
+            self._register(str(point_id), str(exact_hash), signature, point_sources, point_fields)
@@ -0,0 +1,203 @@
+"""
+Remplissage du prompt dans un budget de tokens.
+
+Au lieu de couper chaque chunk à 500 caractères et chaque message d'historique à
+200, le contexte est rempli par ordre de pertinence jusqu'au budget :
+
+- les chunks sont pris dans l'ordre du reranking ; un chunk qui ne tient pas en
+  entier est coupé à la dernière frontière d'article ou de phrase qui tient
+- l'historique est pris du message le plus récent au plus ancien, dans son
+  propre budget
+- le rapport donne les tokens utilisés par chaque section du prompt
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from conversation_memory import SUMMARY_ROLE, role_label, split_summary
+from metrics import count_tokens
+
+# Configuration
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3500"))    # Prompt complet (system + user)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))   # Part maximale de l'historique
+MIN_FRAGMENT_TOKENS = 40  # En dessous, un chunk tronqué n'apporte plus d'information utile
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
+
+# Frontières de découpe : début d'article, puis fin de phrase
+_ARTICLE_BOUNDARY = re.compile(r"\n(?=\s*(?:Article|ARTICLE|Art\.)\s+(?:\d|premier|unique|1er))")
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;:»])\s+(?=[A-ZÀ-Ý«(–-])")
+
+
+@dataclass
+class PackedContext:
+    """
+    Résultat du remplissage : textes des sections, chunks retenus et rapport.
+    """
+    doc_context: str
+    conversation_context: str
+    docs: List[Document]
+    sources_dict: Dict[str, List[Document]]
+    report: Dict[str, int] = field(default_factory=dict)
+
+
+def _segments(text: str) -> List[str]:
+    """
+    Découpe un texte en segments consécutifs (articles, puis phrases).
+    """
+    segments = []
+    for article in _ARTICLE_BOUNDARY.split(text):
+        segments.extend(s for s in _SENTENCE_BOUNDARY.split(article) if s)
+    return segments
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    Garde le plus long début du texte qui tient dans max_tokens, coupé à une
+    frontière d'article ou de phrase.
+
+    Returns:
+        tuple: (texte gardé, "" si aucune frontière ne tient ; True si tronqué)
+    """
+    if count_tokens(text) <= max_tokens:
+        return text, False
+    kept, used = [], 0
+    for segment in _segments(text):
+        cost = count_tokens(segment) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(segment)
+        used += cost
+    return " ".join(kept), True
+
+
+def _document_block(doc: Document, idx: int, content: str) -> str:
+    # La date de dépôt permet au LLM de répondre aux questions de chronologie
+    deposit_date = doc.metadata.get("deposit_date")
+    deposit = f" | Déposée le {deposit_date}" if deposit_date else ""
+    return f"[Document: {doc.metadata.get('source', 'Unknown')}{deposit} | Chunk {idx}]\n{content}"
+
+
+def pack_documents(docs: List[Document], budget: int) -> Tuple[List[Document], int, int]:
+    """
+    Sélectionne les chunks par ordre de pertinence jusqu'au budget.
+
+    Args:
+        docs: Chunks triés par pertinence décroissante
+        budget: Tokens disponibles pour les documents
+
+    Returns:
+        tuple: (chunks retenus, éventuellement tronqués ; nombre de chunks tronqués ;
+                tokens utilisés)
+    """
+    packed, truncated, used = [], 0, 0
+    for doc in docs:
+        header_cost = count_tokens(_document_block(doc, 0, "") + DOCUMENT_SEPARATOR)
+        content, was_truncated = truncate_to_tokens(doc.page_content, budget - used - header_cost)
+        if not content or (was_truncated and count_tokens(content) < MIN_FRAGMENT_TOKENS):
+            # Un chunk plus court, plus loin dans la liste, peut encore tenir
+            continue
+        if was_truncated:
+            truncated += 1
+            doc = Document(page_content=content + " […]", metadata=doc.metadata)
+        packed.append(doc)
+        used += header_cost + count_tokens(doc.page_content)
+    return packed, truncated, used
+
+
+def pack_history(chat_history: List[dict], budget: int) -> Tuple[str, int]:
+    """
+    Historique du plus récent au plus ancien, dans le budget (le résumé glissant
+    éventuel en tête, voir conversation_memory.py).
+
+    Chaque message est limité au quart du budget (une longue réponse n'évince pas
+    la question qui la précède) et coupé à une frontière de phrase.
+
+    Returns:
+        tuple: (texte de l'historique, nombre de messages inclus)
+    """
+    message_budget = max(budget // 4, MIN_FRAGMENT_TOKENS)
+    lines, used = [], count_tokens("Historique de conversation :\n")
+
+    # Le résumé glissant passe avant les messages récents (jusqu'à la moitié du budget)
+    summary, chat_history = split_summary(chat_history)
+    summary_line = ""
+    if summary is not None:
+        summary_prefix = f"{role_label(SUMMARY_ROLE)}: "
+        content, was_truncated = truncate_to_tokens(
+            summary["content"], budget // 2 - count_tokens(summary_prefix) - 3
+        )
+        if content:
+            summary_line = f"{summary_prefix}{content}{' […]' if was_truncated else ''}"
+            used += count_tokens(summary_line) + 1
+
+    for msg in reversed(chat_history):
+        prefix = f"{role_label(msg['role'])}: "
+        remaining = min(budget - used, message_budget) - count_tokens(prefix) - 3
+        if remaining < MIN_FRAGMENT_TOKENS // 2:
+            break
+        content, was_truncated = truncate_to_tokens(msg["content"], remaining)
+        if not content:
+            # Aucune phrase entière ne tient : les messages plus anciens sont ignorés
+            break
+        line = f"{prefix}{content}{' […]' if was_truncated else ''}"
+        lines.append(line)
+        used += count_tokens(line) + 1
+    if summary_line:
+        lines.append(summary_line)
+    if not lines:
+        return "", 0
+    return "Historique de conversation :\n" + "\n".join(reversed(lines)) + "\n\n", len(lines)
+
+
+def pack_context(docs: List[Document], chat_history: List[dict], fixed_prompt: str,
+                 budget: int = PROMPT_TOKEN_BUDGET, history_budget: int = HISTORY_TOKEN_BUDGET) -> PackedContext:
+    """
+    Remplit le prompt : historique (dans son budget), puis documents dans le reste.
+
+    Args:
+        docs: Chunks triés par pertinence décroissante
+        chat_history: Messages précédents [{"role": ..., "content": ...}]
+        fixed_prompt: Parties toujours présentes (prompt système, question, consignes)
+        budget: Budget total du prompt en tokens
+        history_budget: Budget maximal de l'historique
+
+    Returns:
+        PackedContext: Sections du prompt, chunks retenus (groupés par source) et rapport
+    """
+    fixed_tokens = count_tokens(fixed_prompt)
+    conversation_context, history_messages = pack_history(chat_history, min(history_budget, budget - fixed_tokens))
+    history_tokens = count_tokens(conversation_context)
+
+    packed_docs, truncated, _ = pack_documents(docs, budget - fixed_tokens - history_tokens)
+
+    # Regrouper par source pour l'affichage (l'ordre de pertinence est gardé dans chaque source)
+    sources_dict = {}
+    for doc in packed_docs:
+        sources_dict.setdefault(doc.metadata.get("source", "Unknown"), []).append(doc)
+    doc_context = DOCUMENT_SEPARATOR.join(
+        _document_block(doc, idx, doc.page_content)
+        for source_docs in sources_dict.values()
+        for idx, doc in enumerate(source_docs, 1)
+    )
+    document_tokens = count_tokens(doc_context)
+
+    return PackedContext(
+        doc_context=doc_context,
+        conversation_context=conversation_context,
+        docs=[doc for source_docs in sources_dict.values() for doc in source_docs],
+        sources_dict=sources_dict,
+        report={
+            "fixed_tokens": fixed_tokens,
+            "history_tokens": history_tokens,
+            "document_tokens": document_tokens,
+            "prompt_tokens_estimate": fixed_tokens + history_tokens + document_tokens,
+            "history_messages": history_messages,
+            "chunks_included": len(packed_docs),
+            "chunks_truncated": truncated,
+            "chunks_dropped": len(docs) - len(packed_docs),
+        }
+    )
@@ -0,0 +1,148 @@
+"""
+Mémoire de conversation : derniers messages bruts + résumé glissant.
+
+L'historique envoyé au RAG ne contient que le texte des réponses (jamais la
+section des sources). Au-delà de SUMMARY_TRIGGER_MESSAGES messages, les plus
+anciens sont intégrés à un résumé mis à jour de façon incrémentale (un appel LLM
+qui reçoit l'ancien résumé et les nouveaux échanges), si bien que la taille du
+prompt reste bornée sur toute la session.
+
+Le résumé est transmis comme premier message de l'historique :
+{"role": "summary", "content": "..."}. Un client léger de l'API le fait
+calculer par la route POST /summary (voir api.py).
+"""
+
+import os
+from typing import Callable, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from metrics import stage, usage_tokens
+
+# Configuration
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "8"))  # Messages bruts avant résumé
+KEEP_RECENT_MESSAGES = int(os.getenv("KEEP_RECENT_MESSAGES", "4"))          # Messages gardés tels quels
+SUMMARY_MAX_WORDS = 150
+
+SUMMARY_ROLE = "summary"
+ROLE_LABELS = {
+    "user": "Utilisateur",
+    "assistant": "Assistant",
+    SUMMARY_ROLE: "Résumé des échanges précédents",
+}
+
+
+def role_label(role: str) -> str:
+    """
+    Libellé d'un rôle dans les prompts (historique, reformulation).
+    """
+    return ROLE_LABELS.get(role, "Assistant")
+
+
+def split_summary(chat_history: List[dict]):
+    """
+    Sépare le résumé glissant des messages bruts.
+
+    Returns:
+        tuple: (message de résumé ou None, messages user/assistant)
+    """
+    summary = next((msg for msg in chat_history if msg["role"] == SUMMARY_ROLE), None)
+    return summary, [msg for msg in chat_history if msg["role"] != SUMMARY_ROLE]
+
+
+def summary_messages(summary: str, messages: List[dict]) -> list:
+    """
+    Messages de l'appel LLM qui intègre de nouveaux échanges au résumé glissant
+    (ConversationMemory.update_summary, route /summary de l'API).
+
+    Args:
+        summary: Résumé actuel ("" au premier résumé)
+        messages: Messages à intégrer [{"role": "user/assistant", "content": "..."}]
+    """
+    exchanges = "\n".join(f"{role_label(msg['role'])}: {msg['content']}" for msg in messages)
+    prompt = f"""Résumé actuel de la conversation :
+{summary or "(aucun)"}
+
+Nouveaux échanges :
+{exchanges}
+
+Mets à jour le résumé pour qu'il intègre les nouveaux échanges, en {SUMMARY_MAX_WORDS} mots maximum.
+Conserve les propositions de loi, articles, dates et sujets évoqués, ainsi que les préférences
+exprimées par l'utilisateur. Retourne UNIQUEMENT le résumé."""
+
+    return [
+        SystemMessage(content="Tu es un assistant qui résume des conversations de façon factuelle et concise."),
+        HumanMessage(content=prompt)
+    ]
+
+
+class ConversationMemory:
+    """
+    Historique d'une conversation : résumé glissant + derniers messages bruts.
+    """
+
+    def __init__(self, trigger_messages: int = SUMMARY_TRIGGER_MESSAGES,
+                 keep_recent: int = KEEP_RECENT_MESSAGES):
+        self.trigger_messages = trigger_messages
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self.recent: List[dict] = []
+        self.summarized_messages = 0
+
+    def add(self, role: str, content: str):
+        """
+        Ajoute un message (pour l'assistant : le texte de la réponse seul).
+        """
+        self.recent.append({"role": role, "content": content})
+
+    def history(self) -> List[dict]:
+        """
+        Historique à transmettre au RAG : résumé éventuel, puis messages récents.
+        """
+        if not self.summary:
+            return list(self.recent)
+        return [{"role": SUMMARY_ROLE, "content": self.summary}] + self.recent
+
+    def needs_summary(self) -> bool:
+        return len(self.recent) > self.trigger_messages
+
+    def update_summary(self, llm=None, config: Optional[dict] = None,
+                       summarize: Optional[Callable[[str, List[dict]], str]] = None) -> bool:
+        """
+        Intègre les messages les plus anciens au résumé (un appel LLM) si le seuil
+        est dépassé.
+
+        Args:
+            llm: Modèle de chat LangChain utilisé pour le résumé
+            config: Configuration de l'appel (callbacks Langfuse...)
+            summarize: À la place de llm, fonction (résumé actuel, messages) -> nouveau
+                résumé (ex: chatbot.summarize_with_api pour un client léger)
+
+        Returns:
+            bool: True si le résumé a été mis à jour
+        """
+        if not self.needs_summary():
+            return False
+        to_fold = self.recent[:-self.keep_recent] if self.keep_recent else list(self.recent)
+
+        with stage("history_summary", input={"nb_messages": len(to_fold)}, trace=False) as s:
+            if summarize is not None:
+                summary = summarize(self.summary, to_fold)
+                s.record(messages=len(to_fold))
+            else:
+                response = llm.invoke(summary_messages(self.summary, to_fold), config=config)
+                prompt_tokens, completion_tokens = usage_tokens(response)
+                s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, messages=len(to_fold))
+                summary = response.content
+
+        self.summary = summary.strip()
+        self.recent = self.recent[len(to_fold):]
+        self.summarized_messages += len(to_fold)
+        print(f"📝 Résumé de conversation mis à jour en {s.duration_ms:.0f} ms "
+              f"({self.summarized_messages} messages résumés)")
+        return True
+
+    def clear(self):
+        self.summary = ""
+        self.recent = []
+        self.summarized_messages = 0
@@ -0,0 +1,261 @@
+"""
+Cache persistant des embeddings, partagé par les indexeurs et le chemin de requête.
+
+Chaque entrée est indexée par le hash SHA-256 de (nom du modèle, texte). Les vecteurs
+sont stockés en float32 dans un fichier mappé en mémoire (une ligne par entrée), avec
+à côté le hash de la clé et un compteur d'accès par ligne. La taille du fichier est
+bornée : quand il est plein, les entrées les moins récemment utilisées sont évincées.
+
+Plusieurs processus écrivent dans les mêmes fichiers sans verrou commun : deux
+processus peuvent choisir la même ligne libre et y écrire en même temps. Chaque
+ligne stocke donc, avec le hash de la clé, une empreinte de (clé, vecteur). À la
+lecture, une empreinte qui ne correspond pas au vecteur lu (ligne réutilisée ou
+écrite à moitié par un autre processus) compte comme un défaut de cache : le cache
+peut perdre une entrée, jamais renvoyer le vecteur d'un autre texte.
+"""
+
+import atexit
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Configuration
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256"))
+EVICTION_FRACTION = 0.05  # Part des lignes libérées à chaque éviction
+
+KEY_SIZE = 32  # Octets d'un hash SHA-256
+DIGEST_SIZE = 16  # Octets de l'empreinte (clé, vecteur) stockée après la clé
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """
+    Clé de cache : hash du nom du modèle et du texte.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+def _digest(key: bytes, vector: np.ndarray) -> bytes:
+    """
+    Empreinte d'une entrée : relie le vecteur stocké à sa clé.
+    """
+    return hashlib.blake2b(key + vector.tobytes(), digest_size=DIGEST_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    Stockage borné de vecteurs float32 dans des fichiers mappés en mémoire (LRU).
+    """
+
+    def __init__(self, namespace: str, directory: str = EMBEDDING_CACHE_DIR,
+                 max_mb: int = EMBEDDING_CACHE_MAX_MB):
+        self.namespace = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.dim = None
+        self.capacity = 0
+        self._lock = threading.Lock()
+        self._slots: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._tick = 0
+
+    def _open(self, dim: int):
+        """
+        Ouvre (ou crée) les fichiers pour la dimension des vecteurs.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.dim = dim
+        self.capacity = max(1, self.max_bytes // (dim * 4))
+        prefix = os.path.join(self.directory, f"{self.namespace}-{dim}d")
+
+        def open_memmap(suffix, dtype, shape):
+            path = f"{prefix}.{suffix}"
+            expected = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) != expected:
+                # Taille maximale modifiée : on repart d'un cache vide
+                os.remove(path)
+            mode = "r+" if os.path.exists(path) else "w+"
+            return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+        self._vectors = open_memmap("vectors", np.float32, (self.capacity, dim))
+        self._keys = open_memmap("keys", np.uint8, (self.capacity, KEY_SIZE + DIGEST_SIZE))
+        self._ticks = open_memmap("ticks", np.int64, (self.capacity,))
+
+        used = np.flatnonzero(self._ticks > 0)
+        self._slots = {bytes(self._keys[slot, :KEY_SIZE]): int(slot) for slot in used}
+        self._free = np.flatnonzero(self._ticks == 0)[::-1].tolist()
+        self._tick = int(self._ticks.max()) if len(used) else 0
+
+    def _open_existing(self):
+        """
+        Ouvre le cache déjà présent sur disque pour ce namespace, s'il existe.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        pattern = re.compile(rf"^{re.escape(self.namespace)}-(\d+)d\.vectors$")
+        for filename in sorted(os.listdir(self.directory)):
+            match = pattern.match(filename)
+            if match:
+                self._open(int(match.group(1)))
+                return
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Renvoie le vecteur de chaque clé, ou None si absent.
+        """
+        results = []
+        with self._lock:
+            if self.dim is None:
+                self._open_existing()
+            if self.dim is None:
+                return [None] * len(keys)
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    results.append(None)
+                    continue
+                stored = bytes(self._keys[slot])
+                vector = np.array(self._vectors[slot])
+                if stored[:KEY_SIZE] != key or stored[KEY_SIZE:] != _digest(key, vector):
+                    # Ligne réutilisée (ou en cours d'écriture) par un autre processus
+                    results.append(None)
+                    continue
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                results.append(vector)
+        return results
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        """
+        Ajoute des vecteurs au cache, en évinçant les plus anciens si nécessaire.
+        """
+        if not keys:
+            return
+        with self._lock:
+            if self.dim is None:
+                self._open(len(vectors[0]))
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                slot = self._slots.get(key)
+                if slot is None or bytes(self._keys[slot, :KEY_SIZE]) != key:
+                    slot = self._allocate()
+                    self._slots[key] = slot
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key + _digest(key, vector), dtype=np.uint8)
+                self._tick += 1
+                self._ticks[slot] = self._tick
+
+    def _allocate(self) -> int:
+        """
+        Ligne libre pour une nouvelle entrée. Les lignes occupées entre-temps par
+        un autre processus sont sautées (et ajoutées aux entrées connues).
+        """
+        while True:
+            if not self._free:
+                self._evict()
+            slot = self._free.pop()
+            if self._ticks[slot] == 0:
+                return slot
+            self._slots[bytes(self._keys[slot, :KEY_SIZE])] = slot
+
+    def _evict(self):
+        """
+        Libère les lignes les moins récemment utilisées.
+        """
+        count = max(1, int(self.capacity * EVICTION_FRACTION))
+        oldest = np.argpartition(self._ticks, count - 1)[:count]
+        self._ticks[oldest] = 0
+        for slot in oldest:
+            key = bytes(self._keys[slot, :KEY_SIZE])
+            if self._slots.get(key) == slot:
+                del self._slots[key]
+        self._free.extend(int(slot) for slot in oldest)
+
+    def flush(self):
+        """
+        Écrit les pages modifiées sur disque.
+        """
+        with self._lock:
+            if self.dim is not None:
+                self._vectors.flush()
+                self._keys.flush()
+                self._ticks.flush()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe un modèle d'embeddings LangChain avec le cache persistant.
+
+    Args:
+        underlying: Modèle d'embeddings (ex: OpenAIEmbeddings)
+        model_name: Nom du modèle utilisé dans les clés (par défaut underlying.model)
+        directory: Dossier du cache
+        max_mb: Taille maximale des vecteurs stockés, en Mo
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str = None,
+                 directory: str = EMBEDDING_CACHE_DIR, max_mb: int = EMBEDDING_CACHE_MAX_MB):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.cache = EmbeddingCache(self.model_name, directory=directory, max_mb=max_mb)
+        self.hits = 0
+        self.misses = 0
+        atexit.register(self.cache.flush)
+
+    def _lookup(self, texts: List[str]):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Textes absents du cache, sans doublons
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+        self.hits += sum(vector is not None for vector in vectors)
+        self.misses += len(texts) - sum(vector is not None for vector in vectors)
+        return keys, vectors, missing
+
+    def _merge(self, keys, vectors, missing, computed) -> List[List[float]]:
+        self.cache.put_many(list(missing.keys()), computed)
+        computed_by_key = dict(zip(missing.keys(), computed))
+        return [
+            vector.tolist() if vector is not None else list(computed_by_key[key])
+            for key, vector in zip(keys, vectors)
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        computed = self.underlying.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, vectors, missing, computed)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        computed = await self.underlying.aembed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, vectors, missing, computed)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> Dict:
+        """
+        Compteurs du cache (hits, misses, taux de succès, entrées stockées).
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.cache),
+            "capacity": self.cache.capacity,
+        }
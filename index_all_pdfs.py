@@ -10,9 +10,12 @@ OPTIMISATIONS :
 
 from pathlib import Path
 from tqdm import tqdm
-from rag import initialize_components, vectorstore
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import rag
+from index_manifest import IndexManifest, chunk_point_ids, manifest_path
+from lexical_index import LexicalIndexWriter
+from metrics import METRICS_ENABLED, count_tokens, stage
+from page_cache import PAGE_CACHE_ENABLED, PageCache
+from pdf_processing import chunking_config, deserialize_chunks, iter_parsed_pdfs
 
 # Configuration
 PDF_FOLDER = "db_local_pdfs"
@@ -30,7 +33,8 @@ def index_all_pdfs_in_batches():
     
     # 1. Vérifier l'initialisation
     print("\n📦 Initialisation des composants...")
-    initialize_components()
+    rag.initialize_components()
+    vectorstore = rag.vectorstore
     
     # 2. Lister tous les PDFs
     pdf_folder = Path(PDF_FOLDER)
@@ -38,21 +42,36 @@ def index_all_pdfs_in_batches():
         print(f"❌ Le dossier '{PDF_FOLDER}' n'existe pas!")
         return
     
-    pdf_files = list(pdf_folder.glob("*.pdf"))
+    pdf_files = sorted(pdf_folder.glob("*.pdf"))
     total_pdfs = len(pdf_files)
     
     if total_pdfs == 0:
         print(f"❌ Aucun PDF trouvé dans '{PDF_FOLDER}'")
         return
     
-    print(f"✅ {total_pdfs} PDFs trouvés")
+    # Ne ré-indexer que les PDFs nouveaux ou modifiés (tous si le découpage a changé)
+    manifest = IndexManifest(manifest_path(rag.VECTOR_BACKEND), chunking_config(CHUNK_SIZE, CHUNK_OVERLAP))
+    lexical_index = LexicalIndexWriter()
+    to_index, file_hashes, removed_sources = manifest.plan(pdf_files)
+    print(f"✅ {total_pdfs} PDFs trouvés : {len(to_index)} nouveaux ou modifiés, "
+          f"{len(removed_sources)} supprimés")
     
-    # 3. Initialiser le text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
+    # Supprimer les points des PDFs retirés du dossier
+    if removed_sources:
+        removed_ids = manifest.unreferenced(
+            [pid for source in removed_sources for pid in manifest.forget(source)]
+        )
+        if removed_ids:
+            vectorstore.delete(ids=removed_ids)
+            lexical_index.delete(removed_ids)
+        lexical_index.save()
+        manifest.save()
+        print(f"🗑️ {len(removed_ids)} chunks supprimés")
+    pdf_files = to_index
+    total_pdfs = len(pdf_files)
+    
+    # 3. Cache des pages extraites (le découpage repart du texte déjà extrait)
+    page_cache = PageCache() if PAGE_CACHE_ENABLED else None
     
     # 4. Traiter par batches
     total_chunks = 0
@@ -70,37 +89,62 @@ def index_all_pdfs_in_batches():
         
         print(f"\n🔄 Batch {batch_num}/{total_batches} ({len(batch_files)} PDFs)")
         
-        batch_documents = []
+        chunks = []
+        chunk_ids = []
+        batch_entries = []
         
-        # Charger les PDFs du batch
-        for pdf_file in tqdm(batch_files, desc="Chargement", unit="PDF"):
-            try:
-                loader = PyPDFLoader(str(pdf_file))
-                docs = loader.load()
-                
-                # Ajouter les métadonnées
-                for doc in docs:
-                    doc.metadata["source"] = pdf_file.name
-                    doc.metadata["batch"] = batch_num
-                
-                batch_documents.extend(docs)
-                
-            except Exception as e:
-                print(f"⚠️ Erreur avec {pdf_file.name}: {e}")
-                failed_files.append(str(pdf_file))
+        # Charger (ou relire du cache) et découper les PDFs du batch
+        parsed_pdfs = iter_parsed_pdfs(
+            batch_files, CHUNK_SIZE, CHUNK_OVERLAP, num_workers=1,
+            page_cache=page_cache, file_hashes=file_hashes
+        )
+        for pdf_path, serialized_chunks, error in tqdm(parsed_pdfs, total=len(batch_files), desc="Chargement", unit="PDF"):
+            if error is not None:
+                print(f"⚠️ Erreur avec {Path(pdf_path).name}: {error}")
+                failed_files.append(pdf_path)
+                continue
+            
+            # Découper en chunks (IDs déterministes par PDF)
+            source = Path(pdf_path).name
+            pdf_chunks = deserialize_chunks(serialized_chunks)
+            for chunk in pdf_chunks:
+                chunk.metadata["batch"] = batch_num
+            pdf_ids = chunk_point_ids(source, [chunk.page_content for chunk in pdf_chunks])
+            chunks.extend(pdf_chunks)
+            chunk_ids.extend(pdf_ids)
+            batch_entries.append((source, pdf_ids))
         
-        # Découper en chunks
-        print(f"✂️ Découpage en chunks...")
-        chunks = text_splitter.split_documents(batch_documents)
         print(f"   → {len(chunks)} chunks créés")
         
-        # Ajouter au vectorstore
+        # Ajouter au vectorstore (upsert sur les IDs existants)
         if chunks:
             print(f"💾 Indexation dans Qdrant...")
             try:
-                vectorstore.add_documents(chunks)
+                with stage("index_upload", trace=False) as s:
+                    vectorstore.add_documents(chunks, ids=chunk_ids)
+                    s.record(
+                        chunks=len(chunks),
+                        embedding_tokens=sum(count_tokens(c.page_content) for c in chunks) if METRICS_ENABLED else 0
+                    )
+                lexical_index.upsert(chunk_ids, chunks)
+                
+                # Supprimer les anciens chunks des PDFs modifiés (sauf s'ils restent partagés)
+                stale_ids = [
+                    pid for source, pdf_ids in batch_entries
+                    for pid in manifest.stale_point_ids(source, pdf_ids)
+                ]
+                for source, pdf_ids in batch_entries:
+                    manifest.record(source, file_hashes[source], pdf_ids)
+                stale_ids = manifest.unreferenced(stale_ids)
+                if stale_ids:
+                    vectorstore.delete(ids=stale_ids)
+                    lexical_index.delete(stale_ids)
+                # Index BM25 validé avec le batch, avant le manifeste
+                lexical_index.save()
+                manifest.save()
+                
                 total_chunks += len(chunks)
-                print(f"✅ Batch {batch_num} indexé : {len(chunks)} chunks")
+                print(f"✅ Batch {batch_num} indexé : {len(chunks)} chunks en {s.duration_ms / 1000:.1f}s")
             except Exception as e:
                 print(f"❌ Erreur lors de l'indexation du batch {batch_num}: {e}")
                 failed_files.extend([str(f) for f in batch_files])
@@ -113,6 +157,9 @@ def index_all_pdfs_in_batches():
     print("=" * 80)
     print(f"📄 PDFs traités : {total_pdfs - len(failed_files)}/{total_pdfs}")
     print(f"📦 Chunks indexés : {total_chunks}")
+    cache_stats = rag.embeddings.stats()
+    print(f"🗄️ Cache d'embeddings : {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"({cache_stats['hit_rate']:.0%})")
     print(f"💾 Base vectorielle : data/qdrant_db/")
     
     if failed_files:
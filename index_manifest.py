@@ -0,0 +1,234 @@
+"""
+Manifeste local pour l'indexation incrémentale.
+
+Le manifeste associe chaque PDF indexé au hash de son contenu et aux IDs des
+points Qdrant qu'il a produits. Les IDs sont déterministes (source, index du
+chunk, hash du texte) : une ré-indexation écrase les points existants au lieu
+de les dupliquer.
+
+Chaque base cible (Qdrant Cloud, base locale) a son propre manifeste : indexer
+l'une ne marque pas les PDFs comme présents dans l'autre.
+
+Le manifeste enregistre aussi la configuration du découpage (stratégie, tailles,
+version des métadonnées, voir pdf_processing.chunking_config). Si elle change, tous
+les PDFs sont ré-indexés : un PDF inchangé garderait sinon ses anciens chunks à côté
+des nouveaux.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Configuration
+MANIFEST_PATH = "index_manifest.json"
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2a3e-8d4b-5e7f-9a0b-1c2d3e4f5a6b")
+
+
+def manifest_path(target: str) -> str:
+    """
+    Chemin du manifeste d'une base cible ("qdrant" garde index_manifest.json).
+
+    Args:
+        target: Base cible ("qdrant" ou "local", voir INDEX_TARGETS)
+    """
+    if target == "qdrant":
+        return MANIFEST_PATH
+    root, extension = os.path.splitext(MANIFEST_PATH)
+    return f"{root}_{target}{extension}"
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Calcule le hash SHA-256 du contenu d'un fichier.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def point_id(source: str, chunk_index: int, text: str) -> str:
+    """
+    Calcule l'ID déterministe d'un point Qdrant (UUID accepté par Qdrant).
+
+    Args:
+        source: Nom du PDF
+        chunk_index: Position du chunk dans le PDF
+        text: Contenu du chunk
+    """
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{source}|{chunk_index}|{text_hash}"))
+
+
+def chunk_point_ids(source: str, texts: Iterable[str]) -> List[str]:
+    """
+    Calcule les IDs des chunks d'un PDF, dans l'ordre du découpage.
+    """
+    return [point_id(source, idx, text) for idx, text in enumerate(texts)]
+
+
+class IndexManifest:
+    """
+    Manifeste {"config": {...}, "entries": {source: {"hash": ..., "point_ids": [...]}}}
+    persisté en JSON.
+
+    Args:
+        path: Chemin du fichier
+        config: Configuration du découpage de cette exécution (None : pas de vérification)
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH, config: Optional[Dict] = None):
+        self.path = path
+        self.config = config
+        self.entries: Dict[str, Dict] = {}
+        stored_config = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # Ancien format : les entrées seules, sans configuration
+            stored_config, self.entries = (data.get("config"), data["entries"]) if "entries" in data else (None, data)
+        if config is None:
+            self.config = stored_config
+        elif self.entries and stored_config != config:
+            # Les IDs des points restent connus : les anciens chunks sont supprimés à la ré-indexation
+            print(f"⚠️ Configuration de découpage modifiée dans {path} ({stored_config} → {config}) : "
+                  f"les {len(self.entries)} PDFs indexés seront ré-indexés")
+            for entry in self.entries.values():
+                entry["hash"] = None
+
+    def plan(self, pdf_files: List[Path]) -> Tuple[List[Path], Dict[str, str], List[str]]:
+        """
+        Compare le dossier au manifeste.
+
+        Returns:
+            tuple: (PDFs nouveaux ou modifiés, {source: hash} de ces PDFs,
+                    sources supprimées du dossier)
+        """
+        to_index = []
+        hashes = {}
+        present = set()
+        for pdf_file in pdf_files:
+            present.add(pdf_file.name)
+            file_hash = file_sha256(pdf_file)
+            if not self.is_current(pdf_file.name, file_hash):
+                to_index.append(pdf_file)
+                hashes[pdf_file.name] = file_hash
+        removed = sorted(source for source in self.entries if source not in present)
+        return to_index, hashes, removed
+
+    def is_current(self, source: str, file_hash: str) -> bool:
+        """
+        Le PDF est-il déjà indexé dans cette version ?
+        """
+        entry = self.entries.get(source)
+        return entry is not None and entry["hash"] == file_hash
+
+    def stale_point_ids(self, source: str, new_point_ids: Iterable[str]) -> List[str]:
+        """
+        IDs produits précédemment par un PDF qui ne font plus partie de son découpage.
+        """
+        entry = self.entries.get(source)
+        if entry is None:
+            return []
+        new_point_ids = set(new_point_ids)
+        return [pid for pid in entry["point_ids"] if pid not in new_point_ids]
+
+    def record(self, source: str, file_hash: str, point_ids: List[str]):
+        """
+        Enregistre un PDF indexé avec succès.
+        """
+        self.entries[source] = {"hash": file_hash, "point_ids": point_ids}
+
+    def forget(self, source: str) -> List[str]:
+        """
+        Retire un PDF du manifeste et renvoie les IDs de ses points.
+        """
+        entry = self.entries.pop(source, None)
+        return entry["point_ids"] if entry else []
+
+    def unreferenced(self, point_ids: Iterable[str]) -> List[str]:
+        """
+        Filtre les IDs qui ne sont plus référencés par aucun PDF du manifeste.
+
+        Un point dédupliqué peut être partagé par plusieurs PDFs : il ne doit être
+        supprimé que lorsque plus aucun d'entre eux ne le référence.
+        """
+        referenced = {pid for entry in self.entries.values() for pid in entry["point_ids"]}
+        return list(dict.fromkeys(pid for pid in point_ids if pid not in referenced))
+
+    def save(self):
+        """
+        Écrit le manifeste de façon atomique (fichier temporaire puis renommage).
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"config": self.config, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+
+class TargetManifests:
+    """
+    Manifestes de plusieurs bases cibles (un fichier par cible), tenus ensemble.
+
+    Même interface qu'IndexManifest. Un PDF est ré-indexé dès qu'une des cibles
+    n'a pas sa version actuelle : ses points sont alors écrits dans toutes les
+    cibles (upserts idempotents, vecteurs relus du cache d'embeddings) et
+    enregistrés dans chaque manifeste.
+    """
+
+    def __init__(self, targets: Iterable[str], config: Optional[Dict] = None):
+        self.manifests = {target: IndexManifest(manifest_path(target), config) for target in targets}
+
+    def plan(self, pdf_files: List[Path]) -> Tuple[List[Path], Dict[str, str], List[str]]:
+        """
+        Compare le dossier aux manifestes de toutes les cibles.
+
+        Returns:
+            tuple: (PDFs nouveaux ou modifiés pour au moins une cible, {source: hash}
+                    de ces PDFs, sources supprimées du dossier)
+        """
+        to_index = []
+        hashes = {}
+        present = set()
+        for pdf_file in pdf_files:
+            present.add(pdf_file.name)
+            file_hash = file_sha256(pdf_file)
+            if not all(manifest.is_current(pdf_file.name, file_hash) for manifest in self.manifests.values()):
+                to_index.append(pdf_file)
+                hashes[pdf_file.name] = file_hash
+        removed = sorted({
+            source for manifest in self.manifests.values() for source in manifest.entries if source not in present
+        })
+        return to_index, hashes, removed
+
+    def stale_point_ids(self, source: str, new_point_ids: Iterable[str]) -> List[str]:
+        new_point_ids = list(new_point_ids)
+        return list(dict.fromkeys(
+            pid for manifest in self.manifests.values() for pid in manifest.stale_point_ids(source, new_point_ids)
+        ))
+
+    def record(self, source: str, file_hash: str, point_ids: List[str]):
+        for manifest in self.manifests.values():
+            manifest.record(source, file_hash, point_ids)
+
+    def forget(self, source: str) -> List[str]:
+        return list(dict.fromkeys(
+            pid for manifest in self.manifests.values() for pid in manifest.forget(source)
+        ))
+
+    def unreferenced(self, point_ids: Iterable[str]) -> List[str]:
+        """
+        IDs référencés par aucun PDF, dans aucun des manifestes.
+        """
+        point_ids = list(point_ids)
+        for manifest in self.manifests.values():
+            point_ids = manifest.unreferenced(point_ids)
+        return point_ids
+
+    def save(self):
+        for manifest in self.manifests.values():
+            manifest.save()
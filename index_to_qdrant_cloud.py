@@ -7,156 +7,372 @@ Permet de migrer votre base locale vers le cloud pour :
 - Performance optimale
 """
 
+import asyncio
+import os
+import sys
+import time
 from pathlib import Path
+from dotenv import load_dotenv
 from tqdm import tqdm
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
-from config import QDRANT_API_KEY, QDRANT_CLOUD_URL
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from pdf_processing import chunking_config, iter_parsed_pdfs, deserialize_chunks
+from index_manifest import TargetManifests, chunk_point_ids
+from embedding_cache import CachedEmbeddings
+from chunk_dedup import ChunkDeduplicator
+from lexical_index import LexicalIndexWriter
+from async_ingestion import run_ingestion_pipeline, EMBED_CONCURRENCY, UPSERT_CONCURRENCY
+from metrics import METRICS_ENABLED, count_tokens, stage, start_exporters
+from qdrant_collection import create_collection, ensure_payload_indexes, open_vectorstore
+from local_vectorstore import LOCAL_VECTOR_DIR, VECTOR_BACKEND, LocalVectorStore
+from page_cache import PAGE_CACHE_DIR, PAGE_CACHE_ENABLED, PageCache
+from upload_control import AdaptiveBatchSize, IndexJournal, call_with_retry, write_with_split
 
 # Configuration Qdrant Cloud
 COLLECTION_NAME = "rag_documents"
 
 # Configuration
 PDF_FOLDER = "db_local_pdfs"
-MAX_CHUNKS_PER_BATCH = 5000  # Limite par nombre de chunks au lieu de PDFs
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+NUM_WORKERS = int(os.getenv("INDEX_NUM_WORKERS", os.cpu_count() or 1))  # Processus de parsing
+INDEX_PIPELINE = os.getenv("INDEX_PIPELINE", "sync")  # "sync" (batches séquentiels) ou "async" (étapes en parallèle)
+# Bases écrites : "qdrant", "local" (local_vectorstore.py) ou "qdrant,local"
+INDEX_TARGETS = [target.strip() for target in os.getenv("INDEX_TARGETS", VECTOR_BACKEND).split(",")]
+
+# Clés lues depuis .env ; celles de Qdrant ne sont exigées que pour la cible "qdrant" (voir config.py)
+load_dotenv()
+
+def apply_payload_updates(vectorstore, payload_updates):
+    """
+    Met à jour les sources des points déjà stockés (Qdrant ou base locale).
+    """
+    if isinstance(vectorstore, LocalVectorStore):
+        vectorstore.apply_payload_updates(payload_updates)
+    else:
+        vectorstore.client.batch_update_points(COLLECTION_NAME, update_operations=payload_updates)
+
+def upload_batch(vectorstores, manifest, dedup, lexical_index, chunks, ids, pending_files, batch_num,
+                 sizer, journal):
+    """
+    Upserte un batch de chunks puis met à jour le manifeste et l'index de déduplication.
+
+    Les fichiers du batch ne sont enregistrés dans le manifeste qu'une fois
+    leurs points écrits : un batch en échec sera retraité au prochain lancement.
+    Les écritures sont réessayées (et le batch coupé en deux sur un payload trop
+    gros ou un timeout) avant d'abandonner, voir upload_control.py.
+
+    Args:
+        vectorstores: Bases cibles (QdrantVectorStore et/ou LocalVectorStore)
+        manifest: Manifeste d'indexation
+        dedup: Index de déduplication des chunks
+        lexical_index: Index BM25 tenu à jour avec les mêmes points
+        chunks: Documents du batch (représentants uniquement)
+        ids: IDs déterministes des chunks (même ordre que chunks)
+        pending_files: [(source, hash, point_ids, stale_ids)] des PDFs du batch
+        batch_num: Numéro du batch (affichage)
+        sizer: Taille de batch adaptative, informée des durées et des erreurs
+        journal: Journal des batches validés ou en échec
+
+    Returns:
+        int: Nombre de chunks indexés, ou None en cas d'échec
+    """
+    # Liste complète des PDFs contenant chaque chunk, et leurs métadonnées filtrées
+    for chunk, pid in zip(chunks, ids):
+        if pid in dedup.sources:
+            chunk.metadata.update(dedup.payload(pid))
+        else:
+            chunk.metadata["sources"] = [chunk.metadata["source"]]
+
+    sources = [source for source, _, _, _ in pending_files]
+    start = time.perf_counter()
+    try:
+        if chunks:
+            with stage("index_upload", trace=False) as s:
+                # Le cache d'embeddings évite de recalculer les vecteurs pour la seconde base
+                # (et pour les moitiés d'un batch réécrites après une erreur)
+                def write(batch_chunks, batch_ids):
+                    for vectorstore in vectorstores:
+                        vectorstore.add_documents(batch_chunks, ids=batch_ids)
+
+                upload_stats = write_with_split(write, chunks, ids, sizer)
+                s.record(
+                    chunks=len(chunks),
+                    embedding_tokens=sum(count_tokens(c.page_content) for c in chunks) if METRICS_ENABLED else 0,
+                    **upload_stats
+                )
+        # Sources ajoutées à des points déjà stockés
+        payload_updates = dedup.pop_payload_updates(exclude=set(ids))
+        if payload_updates:
+            for vectorstore in vectorstores:
+                call_with_retry(lambda: apply_payload_updates(vectorstore, payload_updates), "mise à jour des sources")
+            lexical_index.apply_payload_updates(payload_updates)
+    except Exception as e:
+        print(f"❌ Erreur lors de l'indexation du batch {batch_num}: {e}")
+        # Annuler les représentants créés par ce batch : ils n'existent pas dans la base
+        for source in sources:
+            dedup.remove_source(source)
+        journal.batch_failed(batch_num, sources, len(chunks), f"{type(e).__name__}: {e}")
+        return None
+
+    lexical_index.upsert(ids, chunks)
+    for source, file_hash, point_ids, _ in pending_files:
+        manifest.record(source, file_hash, point_ids)
+
+    # Supprimer les anciens chunks des PDFs modifiés qui ne sont plus partagés
+    stale_ids = manifest.unreferenced(pid for _, _, _, stale in pending_files for pid in stale)
+    if stale_ids:
+        for vectorstore in vectorstores:
+            call_with_retry(lambda: vectorstore.delete(ids=stale_ids), "suppression des chunks obsolètes")
+        lexical_index.delete(stale_ids)
+
+    # Index BM25 validé avec le batch, avant le manifeste (un batch non enregistré est refait)
+    lexical_index.save()
+    manifest.save()
+    dedup.save()
+    journal.batch_committed(
+        batch_num, sources, len(chunks), duration_s=round(time.perf_counter() - start, 2), next_batch_size=sizer.size
+    )
+
+    print(f"✅ Batch {batch_num} indexé avec succès ({time.perf_counter() - start:.1f}s, "
+          f"prochain batch : {sizer.size} chunks)")
+    return len(chunks)
+
+def iter_prepared_pdfs(parsed_pdfs, file_hashes, manifest, dedup, failed_files):
+    """
+    Associe les IDs déterministes aux chunks de chaque PDF parsé et les déduplique.
+
+    Un chunk déjà vu (exact ou quasi identique) n'est pas ré-embeddé :
+    le PDF référence simplement le point représentant.
+
+    Yields:
+        tuple: (source, hash, nouveaux chunks, leurs IDs, IDs référencés, IDs obsolètes)
+    """
+    for pdf_path, serialized_chunks, error in parsed_pdfs:
+        if error is not None:
+            print(f"\n⚠️ Erreur avec {Path(pdf_path).name}: {error}")
+            failed_files.append(pdf_path)
+            continue
+        
+        source = Path(pdf_path).name
+        pdf_chunks = deserialize_chunks(serialized_chunks)
+        pdf_ids = chunk_point_ids(source, [chunk.page_content for chunk in pdf_chunks])
+        new_chunks = []
+        new_ids = []
+        referenced_ids = []
+        for chunk, pid in zip(pdf_chunks, pdf_ids):
+            representative = dedup.add(pid, source, chunk.page_content, chunk.metadata)
+            if representative == pid and pid not in referenced_ids:
+                new_chunks.append(chunk)
+                new_ids.append(pid)
+            referenced_ids.append(representative)
+        referenced_ids = list(dict.fromkeys(referenced_ids))
+        yield (
+            source, file_hashes[source], new_chunks, new_ids,
+            referenced_ids, manifest.stale_point_ids(source, referenced_ids)
+        )
 
 def index_pdfs_to_cloud():
     """
-    Indexe tous les PDFs du dossier local vers Qdrant Cloud.
+    Indexe tous les PDFs du dossier local vers Qdrant Cloud et/ou la base
+    locale (INDEX_TARGETS).
     """
     print("=" * 80)
-    print("🚀 INDEXATION VERS QDRANT CLOUD")
+    print(f"🚀 INDEXATION VERS {' + '.join(target.upper() for target in INDEX_TARGETS)}")
     print("=" * 80)
+    start_exporters()
     
-    
-    # 1. Créer le client Qdrant Cloud
-    print(f"\n🌐 Connexion à Qdrant Cloud : {QDRANT_CLOUD_URL}")
-    client = QdrantClient(
-        url=QDRANT_CLOUD_URL,
-        api_key=QDRANT_API_KEY,
-    )
-    
-    # 2. Créer les embeddings
+    # 1. Créer les embeddings (avec cache disque : les chunks déjà vus ne sont pas ré-embeddés)
     print("🔧 Initialisation des embeddings OpenAI...")
-    embeddings = OpenAIEmbeddings(
+    embeddings = CachedEmbeddings(OpenAIEmbeddings(
         model="text-embedding-3-small",
-    )
+    ))
     
-    # 3. Créer ou récupérer la collection
-    try:
-        client.get_collection(COLLECTION_NAME)
-        print(f"✅ Collection '{COLLECTION_NAME}' existante trouvée")
-    except Exception:
-        print(f"📦 Création de la collection '{COLLECTION_NAME}'...")
-        client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(
-                size=1536,
-                distance=Distance.COSINE
-            )
+    vectorstore = None
+    if "qdrant" in INDEX_TARGETS:
+        from config import QDRANT_API_KEY, QDRANT_CLOUD_URL
+
+        # 2. Créer le client Qdrant Cloud
+        print(f"\n🌐 Connexion à Qdrant Cloud : {QDRANT_CLOUD_URL}")
+        client = QdrantClient(
+            url=QDRANT_CLOUD_URL,
+            api_key=QDRANT_API_KEY,
         )
-        print(f"✅ Collection créée")
+        
+        # 3. Créer ou récupérer la collection
+        try:
+            client.get_collection(COLLECTION_NAME)
+            print(f"✅ Collection '{COLLECTION_NAME}' existante trouvée")
+            ensure_payload_indexes(client, COLLECTION_NAME)
+        except Exception:
+            # Quantization, HNSW, stockage sur disque et index de payload : voir qdrant_collection.py
+            print(f"📦 Création de la collection '{COLLECTION_NAME}'...")
+            create_collection(client, COLLECTION_NAME)
+            print(f"✅ Collection créée")
+        
+        # 4. Créer le vectorstore
+        # (deux vecteurs par point si la collection est en recherche deux étapes)
+        vectorstore = open_vectorstore(client, COLLECTION_NAME, embeddings)
     
-    # 4. Créer le vectorstore
-    vectorstore = QdrantVectorStore(
-        client=client,
-        collection_name=COLLECTION_NAME,
-        embedding=embeddings
-    )
+    # Base locale mappée en mémoire, écrite avec les mêmes points et IDs
+    local_store = LocalVectorStore(LOCAL_VECTOR_DIR, embeddings) if "local" in INDEX_TARGETS else None
+    if local_store is not None:
+        print(f"💽 Base locale : {LOCAL_VECTOR_DIR} ({len(local_store)} chunks)")
+    vectorstores = [store for store in (vectorstore, local_store) if store is not None]
     
-    # 5. Lister les PDFs
+    # 5. Lister les PDFs et comparer au manifeste
     pdf_folder = Path(PDF_FOLDER)
     if not pdf_folder.exists():
         print(f"❌ Le dossier '{PDF_FOLDER}' n'existe pas!")
         return
     
-    pdf_files = list(pdf_folder.glob("*.pdf"))
+    # Tri pour un ordre (et donc des chunks) identique d'une exécution à l'autre
+    pdf_files = sorted(pdf_folder.glob("*.pdf"))
     total_pdfs = len(pdf_files)
     
     if total_pdfs == 0:
         print(f"❌ Aucun PDF trouvé dans '{PDF_FOLDER}'")
         return
     
-    print(f"\n📚 {total_pdfs} PDFs à indexer")
+    # Un manifeste par base cible : une cible ajoutée plus tard est indexée entièrement,
+    # et tout est ré-indexé si la configuration du découpage a changé
+    manifest = TargetManifests(INDEX_TARGETS, chunking_config(CHUNK_SIZE, CHUNK_OVERLAP))
+    to_index, file_hashes, removed_sources = manifest.plan(pdf_files)
+    print(f"\n📚 {total_pdfs} PDFs trouvés : {len(to_index)} nouveaux ou modifiés, "
+          f"{total_pdfs - len(to_index)} inchangés, {len(removed_sources)} supprimés")
     
-    # 6. Initialiser le text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
+    # Retirer les PDFs supprimés ou à ré-indexer des listes de sources des chunks partagés
+    dedup = ChunkDeduplicator()
+    lexical_index = LexicalIndexWriter()
+    for source in removed_sources + [pdf_file.name for pdf_file in to_index]:
+        dedup.remove_source(source)
+    
+    # Supprimer les points des PDFs retirés du dossier (sauf s'ils restent partagés)
+    if removed_sources:
+        removed_ids = manifest.unreferenced(
+            [pid for source in removed_sources for pid in manifest.forget(source)]
+        )
+        if removed_ids:
+            for store in vectorstores:
+                call_with_retry(lambda: store.delete(ids=removed_ids), "suppression des PDFs retirés")
+            lexical_index.delete(removed_ids)
+        lexical_index.save()
+        manifest.save()
+        print(f"🗑️ {len(removed_ids)} chunks supprimés ({len(removed_sources)} PDFs retirés)")
     
-    # 7. Traiter PDF par PDF, grouper les chunks par batches
+    # 6. Parser en parallèle, grouper les chunks par batches
     total_chunks_indexed = 0
     failed_files = []
     current_batch_chunks = []
+    current_batch_ids = []
+    current_batch_files = []
     batch_num = 1
-    pdfs_processed = 0
     
-    print(f"\n📊 Stratégie : batches de maximum {MAX_CHUNKS_PER_BATCH} chunks")
+    # Journal des batches : signale un lancement précédent interrompu ou incomplet
+    journal = IndexJournal()
+    previous_run = journal.start_run(pipeline=INDEX_PIPELINE, targets=INDEX_TARGETS, pdfs_to_index=len(to_index))
+    if previous_run and (previous_run["interrupted"] or previous_run["failed_sources"]):
+        state = "interrompu" if previous_run["interrupted"] else "terminé avec des échecs"
+        print(f"⏯️ Lancement précédent ({previous_run['started']}) {state} : "
+              f"{previous_run['committed_batches']} batches validés ({previous_run['committed_pdfs']} PDFs), "
+              f"{len(previous_run['failed_sources'])} PDFs en échec, repris maintenant")
+    sizer = AdaptiveBatchSize()
     
-    for pdf_file in tqdm(pdf_files, desc="Indexation", unit="PDF"):
-        try:
-            # Charger le PDF
-            loader = PyPDFLoader(str(pdf_file))
-            docs = loader.load()
-            
-            # Ajouter les métadonnées
-            for doc in docs:
-                doc.metadata["source"] = pdf_file.name
-            
-            # Découper en chunks
-            pdf_chunks = text_splitter.split_documents(docs)
-            
+    if INDEX_PIPELINE == "async":
+        print(f"\n📊 Stratégie : pipeline asynchrone, {NUM_WORKERS} processus de parsing")
+    else:
+        print(f"\n📊 Stratégie : batches adaptatifs (départ à {sizer.size} chunks, entre {sizer.minimum} et "
+              f"{sizer.maximum}), {NUM_WORKERS} processus de parsing")
+    
+    # Texte des pages relu du cache : seuls les PDFs jamais extraits passent par PyPDFLoader
+    page_cache = PageCache() if PAGE_CACHE_ENABLED else None
+    if page_cache is not None:
+        print(f"📑 Cache de pages : {PAGE_CACHE_DIR} ({len(page_cache.cached_hashes())} PDFs déjà extraits)")
+    
+    parsed_pdfs = iter_parsed_pdfs(
+        to_index,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        num_workers=NUM_WORKERS,
+        page_cache=page_cache,
+        file_hashes=file_hashes
+    )
+    prepared_pdfs = iter_prepared_pdfs(
+        tqdm(parsed_pdfs, total=len(to_index), desc="Indexation", unit="PDF"),
+        file_hashes, manifest, dedup, failed_files
+    )
+    
+    if INDEX_PIPELINE == "async":
+        # Parsing, embeddings et upserts se chevauchent (files bornées entre les étapes)
+        print(f"⚡ Pipeline asynchrone : {EMBED_CONCURRENCY} requêtes d'embeddings, {UPSERT_CONCURRENCY} upserts en parallèle")
+        total_chunks_indexed, failed_sources = asyncio.run(run_ingestion_pipeline(
+            prepared_pdfs,
+            embeddings,
+            AsyncQdrantClient(url=QDRANT_CLOUD_URL, api_key=QDRANT_API_KEY) if vectorstore is not None else None,
+            COLLECTION_NAME,
+            manifest,
+            dedup,
+            lexical_index=lexical_index,
+            reduced_dim=getattr(vectorstore, "reduced_dim", 0),
+            local_store=local_store,
+            journal=journal
+        ))
+        failed_files.extend(failed_sources)
+    else:
+        for source, file_hash, new_chunks, new_ids, referenced_ids, stale_ids in prepared_pdfs:
             # Ajouter les chunks au batch actuel
-            current_batch_chunks.extend(pdf_chunks)
-            pdfs_processed += 1
+            current_batch_chunks.extend(new_chunks)
+            current_batch_ids.extend(new_ids)
+            current_batch_files.append((source, file_hash, referenced_ids, stale_ids))
+        
+            # Si on dépasse la taille courante (adaptée au débit observé), uploader le batch
+            if len(current_batch_chunks) >= sizer.size:
+                print(f"\n☁️ Upload batch {batch_num} : {len(current_batch_chunks)} chunks ({len(current_batch_files)} PDFs)")
+                indexed = upload_batch(
+                    vectorstores, manifest, dedup, lexical_index, current_batch_chunks, current_batch_ids, current_batch_files, batch_num,
+                    sizer, journal
+                )
+                if indexed is None:
+                    failed_files.extend(source for source, _, _, _ in current_batch_files)
+                else:
+                    total_chunks_indexed += indexed
             
-            # Si on dépasse la limite, uploader le batch
-            if len(current_batch_chunks) >= MAX_CHUNKS_PER_BATCH:
-                print(f"\n☁️ Upload batch {batch_num} : {len(current_batch_chunks)} chunks ({pdfs_processed} PDFs)")
-                try:
-                    vectorstore.add_documents(current_batch_chunks)
-                    total_chunks_indexed += len(current_batch_chunks)
-                    print(f"✅ Batch {batch_num} indexé avec succès")
-                except Exception as e:
-                    print(f"❌ Erreur lors de l'indexation du batch {batch_num}: {e}")
-                
                 # Réinitialiser pour le prochain batch
                 current_batch_chunks = []
+                current_batch_ids = []
+                current_batch_files = []
                 batch_num += 1
-                pdfs_processed = 0
-                
-        except Exception as e:
-            print(f"\n⚠️ Erreur avec {pdf_file.name}: {e}")
-            failed_files.append(str(pdf_file))
-    
-    # Uploader le dernier batch s'il reste des chunks
-    if current_batch_chunks:
-        print(f"\n☁️ Upload batch final {batch_num} : {len(current_batch_chunks)} chunks ({pdfs_processed} PDFs)")
-        try:
-            vectorstore.add_documents(current_batch_chunks)
-            total_chunks_indexed += len(current_batch_chunks)
-            print(f"✅ Batch {batch_num} indexé avec succès")
-        except Exception as e:
-            print(f"❌ Erreur lors de l'indexation du batch final {batch_num}: {e}")
+    
+        # Uploader le dernier batch s'il reste des chunks (ou des PDFs entièrement dédupliqués)
+        if current_batch_files or removed_sources:
+            print(f"\n☁️ Upload batch final {batch_num} : {len(current_batch_chunks)} chunks ({len(current_batch_files)} PDFs)")
+            indexed = upload_batch(
+                vectorstores, manifest, dedup, lexical_index, current_batch_chunks, current_batch_ids, current_batch_files, batch_num,
+                sizer, journal
+            )
+            if indexed is None:
+                failed_files.extend(source for source, _, _, _ in current_batch_files)
+            else:
+                total_chunks_indexed += indexed
     
     total_chunks = total_chunks_indexed
     
-    # 8. Résumé final
+    journal.end_run(chunks=total_chunks, failed_sources=[Path(failed).name for failed in failed_files])
+    
+    # 7. Résumé final
     print("\n" + "=" * 80)
-    print("✅ INDEXATION TERMINÉE")
+    print("✅ INDEXATION TERMINÉE" if not failed_files else "⚠️ INDEXATION INCOMPLÈTE")
     print("=" * 80)
-    print(f"📄 PDFs traités : {total_pdfs - len(failed_files)}/{total_pdfs}")
-    print(f"📦 Chunks indexés : {total_chunks}")
-    print(f"☁️ Base vectorielle : Qdrant Cloud")
-    print(f"🌐 URL : {QDRANT_CLOUD_URL}")
+    print(f"📄 PDFs traités : {len(to_index) - len(failed_files)}/{len(to_index)} ({total_pdfs - len(to_index)} inchangés)")
+    print(f"📦 Chunks indexés : {total_chunks} ({dedup.duplicates} doublons non ré-indexés)")
+    cache_stats = embeddings.stats()
+    print(f"🗄️ Cache d'embeddings : {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"({cache_stats['hit_rate']:.0%})")
+    if vectorstore is not None:
+        print(f"☁️ Base vectorielle : Qdrant Cloud")
+        print(f"🌐 URL : {QDRANT_CLOUD_URL}")
+    if local_store is not None:
+        print(f"💽 Base locale : {LOCAL_VECTOR_DIR} ({local_store.describe()['vectors_mib']} Mio de vecteurs)")
     
     if failed_files:
         print(f"\n⚠️ {len(failed_files)} fichiers ont échoué :")
@@ -164,6 +380,9 @@ def index_pdfs_to_cloud():
             print(f"   - {failed}")
         if len(failed_files) > 10:
             print(f"   ... et {len(failed_files) - 10} autres")
+        print("   Relancer le script pour les retraiter (les batches validés ne sont pas refaits)")
+        print("=" * 80)
+        sys.exit(1)
     
     print("\n🎉 Votre système RAG est maintenant dans le cloud !")
     print("=" * 80)
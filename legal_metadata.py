@@ -0,0 +1,359 @@
+"""
+Métadonnées structurées des propositions de loi, à l'indexation et à la requête.
+
+Indexation (payload Qdrant, champs indexés dans qdrant_collection.PAYLOAD_INDEXES) :
+- nom de fichier "l17b2112_proposition-loi.pdf" : législature (17), numéro (2112), type
+- première page : date de dépôt ("Enregistré à la Présidence ... le 18 novembre 2025"),
+  auteurs ("présentée par M. ..., Mme ..., députés"), titre
+- chaque chunk : numéros des articles du dispositif qu'il couvre ("Article 1er", "Article 2"...)
+
+Un chunk dédupliqué (chunk_dedup.py) appartient à plusieurs propositions : les champs
+filtrés sont des listes sur toutes ses sources (filter_fields), les champs simples
+(bill_number, deposit_date...) décrivent sa première source.
+
+Requête : les contraintes détectées dans la question (numéro de proposition,
+législature, auteur, période de dépôt, article d'une proposition donnée) deviennent
+un filtre Qdrant ; "la dernière proposition..." trie les chunks retenus par date de dépôt.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from qdrant_client import models
+
+# Configuration
+FILENAME_PATTERN = re.compile(r"^l(\d{1,2})b(\d{1,5})(?:_([\w-]+))?", re.IGNORECASE)
+DEPOSIT_PATTERN = re.compile(
+    r"Enregistré à la Présidence de l[’']Assemblée nationale le\s+(1er|\d{1,2})\s+(\w+)\s+(\d{4})", re.IGNORECASE
+)
+AUTHORS_PATTERN = re.compile(
+    r"présentée\s+par\s+(.+?),?\s*(?:députés|députées|député|députée|sénateurs|sénatrices|sénateur|sénatrice)\b",
+    re.IGNORECASE | re.DOTALL
+)
+TITLE_PATTERN = re.compile(r"PROPOSITION DE LOI\s+(.+?)\s*(?:\(Renvoyée|présentée par)", re.DOTALL)
+ARTICLE_HEADER_PATTERN = re.compile(r"(?m)^\s*Article\s+(1er|premier|unique|\d+)\s*$")
+
+MONTHS = {
+    "janvier": 1, "février": 2, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7,
+    "août": 8, "aout": 8, "septembre": 9, "octobre": 10, "novembre": 11, "décembre": 12, "decembre": 12,
+}
+# Champs propres au PDF d'origine d'un chunk (gardés par source par chunk_dedup.py)
+SOURCE_FIELDS = ("legislature", "bill_number", "document_type", "deposit_date", "authors",
+                 "author_surnames", "title", "articles")
+# À incrémenter quand les métadonnées des chunks changent (ré-indexation complète, voir index_manifest.py)
+METADATA_VERSION = 2
+
+ORDINAL_LEGISLATURES = {
+    "quatorzième": 14, "quinzième": 15, "seizième": 16, "dix-septième": 17, "dix-huitième": 18,
+}
+
+# Détection des contraintes dans les questions
+_MONTHS_ALTERNATION = "|".join(MONTHS)
+_QUERY_DATE_PATTERN = re.compile(
+    rf"\b(depuis|après|apres|à partir d[eu]|avant|en)?\s*(?:le\s+)?(?:(1er|\d{{1,2}})\s+)?"
+    rf"({_MONTHS_ALTERNATION})?\s*\b(19[5-9]\d|20\d\d)\b",
+    re.IGNORECASE
+)
+# Le numéro ne doit pas être l'année d'une référence de loi ou de décret ("n° 2016-297")
+_QUERY_BILL_PATTERNS = [
+    re.compile(r"\bl(\d{1,2})b(\d{1,5})\b", re.IGNORECASE),
+    re.compile(r"(?:\bn[°o]\s*|\bproposition(?:\s+de\s+loi)?\s+(?:n[°o]\s*)?|\bPPL\s*)(\d{3,5})\b(?![-‑–/]\d)",
+               re.IGNORECASE),
+]
+_LAW_REFERENCE_PATTERN = re.compile(r"\b\d{4}[-‑–]\d+\b")
+# Une date ne filtre le dépôt que si la question porte sur le dépôt d'une proposition :
+# "déposée(s) en 2024", "dépôt depuis mars 2023" ou "la proposition de loi du 5 mars 2024"
+_QUERY_DEPOSIT_PATTERN = re.compile(r"\b(?:d[ée]pos[ée]e?s?|d[ée]p[ôo]ts?|enregistr[ée]e?s?)\b", re.IGNORECASE)
+_BILL_DATE_CONTEXT = re.compile(
+    r"\b(?:propositions?(?:\s+de\s+loi)?|PPL)(?:\s+n[°o]\s*\d+)?\s+du$", re.IGNORECASE
+)
+# "la loi du 5 mars 2007", "le décret n° 2016-297 du 14 mars 2016" : date d'un texte en vigueur
+_LAW_DATE_CONTEXT = re.compile(
+    r"\b(?:lois?|d[ée]crets?|ordonnances?|arr[êe]t[ée]s?|directives?|r[èe]glements?)"
+    r"(?:\s+(?:organique|constitutionnelle))?(?:\s+n[°o]\s*[\d\s‑–-]+)?\s+du$",
+    re.IGNORECASE
+)
+_QUERY_LEGISLATURE_PATTERN = re.compile(
+    r"\b(\d{1,2})\s*(?:e|è|ème|eme)\s+législature|\b(" + "|".join(ORDINAL_LEGISLATURES) + r")\s+législature",
+    re.IGNORECASE
+)
+_QUERY_ARTICLE_PATTERN = re.compile(r"\barticles?\s+(1er|premier|unique|\d+)\b", re.IGNORECASE)
+_QUERY_AUTHOR_PATTERN = re.compile(
+    r"\b(?:M\.|Mme|Monsieur|Madame|député|députée)\s+((?:[A-ZÀ-Ý][\w'’/-]*\s*){1,3})"
+)
+_QUERY_RECENCY_PATTERN = re.compile(
+    r"\b(derni[eè]re?s?|plus\s+r[ée]cente?s?|r[ée]cemment|la\s+plus\s+r[ée]cente)\b", re.IGNORECASE
+)
+
+
+def article_number(label: str) -> int:
+    """
+    Numéro d'un article à partir de son libellé ("1er", "premier", "unique" -> 1).
+    """
+    return 1 if label.lower() in ("1er", "premier", "unique") else int(label)
+
+
+def _is_surname_token(token: str) -> bool:
+    letters = [c for c in token if c.isalpha()]
+    return bool(letters) and all(c.isupper() for c in letters)
+
+
+def parse_filename(filename: str) -> Dict:
+    """
+    Législature, numéro et type de document à partir du nom de fichier
+    ("l17b2112_proposition-loi.pdf" -> 17, 2112, "proposition-loi").
+    """
+    match = FILENAME_PATTERN.match(filename)
+    if not match:
+        return {}
+    fields = {"legislature": int(match.group(1)), "bill_number": int(match.group(2))}
+    if match.group(3):
+        fields["document_type"] = match.group(3)
+    return fields
+
+
+def parse_first_page(text: str) -> Dict:
+    """
+    Date de dépôt, auteurs et titre à partir de la première page.
+    """
+    fields = {}
+    text = text.replace(" ", " ")
+
+    deposit = DEPOSIT_PATTERN.search(text)
+    if deposit and deposit.group(2).lower() in MONTHS:
+        day = 1 if deposit.group(1) == "1er" else int(deposit.group(1))
+        try:
+            fields["deposit_date"] = date(int(deposit.group(3)), MONTHS[deposit.group(2).lower()], day).isoformat()
+        except ValueError:
+            pass
+
+    authors_match = AUTHORS_PATTERN.search(text)
+    if authors_match:
+        authors = []
+        for raw in " ".join(authors_match.group(1).split()).split(","):
+            name = re.sub(r"^(?:M\.|Mme|MM\.|Mmes)\s+", "", raw.strip())
+            if name:
+                authors.append(name)
+        fields["authors"] = authors
+        fields["author_surnames"] = [
+            " ".join(token for token in name.split() if _is_surname_token(token)) or name.split()[-1].upper()
+            for name in authors
+        ]
+
+    title = TITLE_PATTERN.search(text)
+    if title:
+        fields["title"] = " ".join(title.group(1).split()).rstrip(",")
+    return fields
+
+
+def extract_document_metadata(filename: str, first_page_text: str) -> Dict:
+    """
+    Métadonnées d'un PDF : nom de fichier puis première page.
+    """
+    return {**parse_filename(filename), **parse_first_page(first_page_text)}
+
+
+def annotate_articles(chunks: List) -> None:
+    """
+    Ajoute à chaque chunk (dans l'ordre du document) la liste `articles` des
+    articles du dispositif qu'il couvre : l'article en cours au début du chunk
+    et ceux dont l'en-tête apparaît dans le chunk. L'exposé des motifs n'en a pas.
+    """
+    current = None
+    for chunk in chunks:
+        articles = []
+        headers = list(ARTICLE_HEADER_PATTERN.finditer(chunk.page_content))
+        if current is not None and not (headers and headers[0].start() == 0):
+            articles.append(current)
+        for header in headers:
+            number = article_number(header.group(1))
+            if number not in articles:
+                articles.append(number)
+        # Un article déjà vu (chevauchement entre chunks) ne fait pas reculer l'article en cours
+        if headers:
+            current = max(current or 0, article_number(headers[-1].group(1)))
+        chunk.metadata["articles"] = articles
+
+
+def filter_fields(entries: List[Dict]) -> Dict:
+    """
+    Champs filtrés d'un chunk, réunis sur toutes les propositions qui le contiennent.
+
+    Args:
+        entries: Champs SOURCE_FIELDS de chaque source du chunk
+
+    Returns:
+        dict: bill_numbers, legislatures, deposit_dates, all_author_surnames et
+        bill_articles ("2110:2" : article 2 de la proposition 2110)
+    """
+    def union(values):
+        return list(dict.fromkeys(value for value in values if value is not None))
+
+    return {
+        "bill_numbers": union(entry.get("bill_number") for entry in entries),
+        "legislatures": union(entry.get("legislature") for entry in entries),
+        "deposit_dates": union(entry.get("deposit_date") for entry in entries),
+        "all_author_surnames": union(name for entry in entries for name in entry.get("author_surnames") or []),
+        "bill_articles": union(
+            f"{entry['bill_number']}:{article}"
+            for entry in entries if entry.get("bill_number") is not None
+            for article in entry.get("articles") or []
+        ),
+    }
+
+
+@dataclass
+class QueryConstraints:
+    """
+    Contraintes détectées dans une question.
+    """
+    bill_numbers: List[int] = field(default_factory=list)
+    legislature: Optional[int] = None
+    author_surnames: List[str] = field(default_factory=list)
+    deposit_range: Optional[Tuple[Optional[str], Optional[str]]] = None  # (début inclus, fin exclue), ISO
+    articles: List[int] = field(default_factory=list)
+    recent: bool = False
+
+    def __bool__(self):
+        return bool(self.bill_numbers or self.legislature or self.author_surnames or self.deposit_range)
+
+    def to_filter(self) -> Optional[models.Filter]:
+        """
+        Filtre Qdrant sur les champs indexés (None sans contrainte).
+
+        Les champs sont des listes (filter_fields) : un chunk partagé par plusieurs
+        propositions correspond si l'une d'elles satisfait la contrainte.
+        """
+        conditions = []
+        if self.bill_numbers:
+            if self.articles:
+                conditions.append(models.FieldCondition(key="metadata.bill_articles",
+                                                        match=models.MatchAny(any=self._bill_articles())))
+            else:
+                conditions.append(models.FieldCondition(key="metadata.bill_numbers",
+                                                        match=models.MatchAny(any=self.bill_numbers)))
+        if self.legislature:
+            conditions.append(models.FieldCondition(key="metadata.legislatures",
+                                                    match=models.MatchValue(value=self.legislature)))
+        if self.author_surnames:
+            conditions.append(models.FieldCondition(key="metadata.all_author_surnames",
+                                                    match=models.MatchAny(any=self.author_surnames)))
+        if self.deposit_range:
+            start, end = self.deposit_range
+            conditions.append(models.FieldCondition(key="metadata.deposit_dates",
+                                                    range=models.DatetimeRange(gte=start, lt=end)))
+        return models.Filter(must=conditions) if conditions else None
+
+    def _bill_articles(self) -> List[str]:
+        return [f"{bill}:{article}" for bill in self.bill_numbers for article in self.articles]
+
+    def matches(self, metadata: Dict) -> bool:
+        """
+        Même contrainte que to_filter, évaluée localement (résultats de l'index BM25).
+        """
+        if self.bill_numbers and not set(self.bill_numbers) & set(metadata.get("bill_numbers") or []):
+            return False
+        if self.bill_numbers and self.articles \
+                and not set(self._bill_articles()) & set(metadata.get("bill_articles") or []):
+            return False
+        if self.legislature and self.legislature not in (metadata.get("legislatures") or []):
+            return False
+        if self.author_surnames and not set(self.author_surnames) & set(metadata.get("all_author_surnames") or []):
+            return False
+        if self.deposit_range:
+            start, end = self.deposit_range
+            if not any((not start or deposit_date >= start) and (not end or deposit_date < end)
+                       for deposit_date in metadata.get("deposit_dates") or []):
+                return False
+        return True
+
+    def describe(self) -> Dict:
+        return {key: value for key, value in self.__dict__.items() if value}
+
+
+def _date_range(prep: Optional[str], day: Optional[str], month: Optional[str], year: str):
+    year = int(year)
+    if month:
+        month_number = MONTHS[month.lower()]
+        if day:
+            start = date(year, month_number, 1 if day == "1er" else int(day))
+            end = date.fromordinal(start.toordinal() + 1)
+        else:
+            start = date(year, month_number, 1)
+            end = date(year + (month_number == 12), month_number % 12 + 1, 1)
+    else:
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+
+    prep = (prep or "").lower()
+    if prep in ("depuis",) or prep.startswith("à partir"):
+        return start.isoformat(), None
+    if prep in ("après", "apres"):
+        return end.isoformat(), None
+    if prep == "avant":
+        return None, start.isoformat()
+    if prep == "en" or month:
+        return start.isoformat(), end.isoformat()
+    return None  # Année seule sans préposition : trop ambigu
+
+
+@lru_cache(maxsize=1024)
+def detect_constraints(query: str) -> QueryConstraints:
+    """
+    Contraintes explicites d'une question (regex, sans appel LLM).
+
+    Un numéro d'article n'est retenu qu'avec un numéro de proposition : seul,
+    "l'article 2" est ambigu entre propositions (et souvent un article de code).
+    Une date ne devient une plage de dépôt que si la question porte sur le dépôt
+    ("déposées en 2024", "la proposition de loi du 5 mars 2024"), jamais pour la
+    date d'une loi ou d'un décret ("la loi du 5 mars 2007") ou un simple contexte
+    ("l'impact du Brexit en 2020").
+    """
+    constraints = QueryConstraints()
+
+    for pattern in _QUERY_BILL_PATTERNS:
+        for match in pattern.finditer(query):
+            if match.lastindex == 2:
+                constraints.legislature = int(match.group(1))
+            number = int(match.group(match.lastindex))
+            if number not in constraints.bill_numbers:
+                constraints.bill_numbers.append(number)
+
+    legislature = _QUERY_LEGISLATURE_PATTERN.search(query)
+    if legislature:
+        constraints.legislature = int(legislature.group(1)) if legislature.group(1) \
+            else ORDINAL_LEGISLATURES[legislature.group(2).lower()]
+
+    for match in _QUERY_AUTHOR_PATTERN.finditer(query):
+        tokens = [unicodedata.normalize("NFC", t).upper() for t in match.group(1).split()]
+        for candidate in (tokens[-1], " ".join(tokens[-2:])):
+            if candidate not in constraints.author_surnames:
+                constraints.author_surnames.append(candidate)
+
+    # Références de lois ("2016-297") masquées : leur année n'est pas une date de dépôt
+    masked_query = _LAW_REFERENCE_PATTERN.sub(lambda m: " " * len(m.group()), query)
+    deposit_question = bool(_QUERY_DEPOSIT_PATTERN.search(query))
+    for match in _QUERY_DATE_PATTERN.finditer(masked_query):
+        before = masked_query[:match.start()].rstrip()
+        bill_date = bool(_BILL_DATE_CONTEXT.search(before))
+        if not bill_date and (_LAW_DATE_CONTEXT.search(before) or not deposit_question):
+            continue
+        deposit_range = _date_range(*match.groups())
+        if deposit_range:
+            constraints.deposit_range = deposit_range
+            break
+
+    constraints.articles = [article_number(m.group(1)) for m in _QUERY_ARTICLE_PATTERN.finditer(query)]
+    constraints.recent = bool(_QUERY_RECENCY_PATTERN.search(query))
+    return constraints
+
+
+def sort_by_recency(docs: List) -> List:
+    """
+    Chunks triés du dépôt le plus récent au plus ancien (ordre de pertinence
+    conservé à date égale ; chunks sans date en dernier).
+    """
+    return sorted(docs, key=lambda doc: doc.metadata.get("deposit_date") or "", reverse=True)
@@ -0,0 +1,303 @@
+"""
+Découpage structurel des propositions de loi.
+
+Le découpage générique (RecursiveCharacterTextSplitter, 1000 caractères, 200 de
+chevauchement) coupe au milieu des articles et duplique un cinquième du texte.
+Ici, les pages d'un document sont parcourues une seule fois, ligne par ligne, en
+repérant les frontières du texte :
+
+- la page de titre (numéro, dépôt, auteurs), jusqu'à "EXPOSÉ DES MOTIFS"
+- l'exposé des motifs, jusqu'au second "PROPOSITION DE LOI" (début du dispositif)
+- chaque article du dispositif ("Article 1er", "Article 2"...), précédé des
+  intitulés de titre ou de chapitre qui l'annoncent
+
+Chaque section donne un chunk, sans chevauchement. Seules les sections plus longues
+que chunk_size sont subdivisées, aux fins d'alinéa, puis de phrase. Les numéros de
+page ("– 3 –") et les glyphes du logo sont retirés, les retours à la ligne de mise
+en page recollés. Chaque chunk porte sa section et la liste `articles` (même convention que
+legal_metadata.annotate_articles).
+
+Usage :
+    python legislative_splitter.py benchmark --pdf-folder data   # comparaison avec le découpage générique
+"""
+
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from legal_metadata import ARTICLE_HEADER_PATTERN, article_number
+
+# Configuration
+LEGISLATIVE_CHUNK_SIZE = int(os.getenv("LEGISLATIVE_CHUNK_SIZE", "2000"))  # Taille maximale d'un chunk (caractères)
+
+SECTION_TITLE = "titre"
+SECTION_MOTIFS = "exposé des motifs"
+SECTION_DISPOSITIF = "dispositif"  # Texte du dispositif hors articles
+SECTION_ARTICLE = "article"
+
+_PAGE_NUMBER_LINE = re.compile(r"^\s*[–-]\s*\d+\s*[–-]\s*$")
+_GLYPH_LINE = re.compile(r"^[\s\ue000-\uf8ff]*$")  # Ligne vide ou faite de glyphes du logo (zone privée Unicode)
+_MOTIFS_HEADER = re.compile(r"^\s*EXPOS[ÉE] DES MOTIFS\s*$", re.IGNORECASE)
+_DISPOSITIF_HEADER = re.compile(r"^\s*PROPOSITION DE LOI(?: ORGANIQUE| CONSTITUTIONNELLE)?\s*$", re.IGNORECASE)
+_DIVISION_HEADER = re.compile(
+    r"^\s*(?:TITRE|CHAPITRE|SECTION|Titre|Chapitre|Section)\s+(?:[IVXLC]+|\d+|PREMIER|premier|Ier|IER|préliminaire|PRÉLIMINAIRE)\b"
+)
+_PARAGRAPH_END = re.compile(r"[.:;!?»]\s*$")
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;:»])\s+(?=[A-ZÀ-Ý«(–-])")
+
+
+class _Section:
+    """
+    Section en cours de lecture : type, article, et lignes avec leur page.
+    """
+
+    def __init__(self, kind: str, article: Optional[int] = None):
+        self.kind = kind
+        self.article = article
+        self.lines: List[Tuple[str, int]] = []
+
+
+def _paragraphs(lines: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    """
+    Recolle les lignes de mise en page en alinéas : une ligne termine un alinéa
+    si elle finit par une ponctuation forte, ou si c'est un en-tête (article, titre).
+
+    Returns:
+        list: [(texte de l'alinéa, index de la page où il commence)]
+    """
+    paragraphs = []
+    current = ""
+    page_idx = 0
+    for line, line_page in lines:
+        line = line.strip()
+        if not line:
+            continue
+        is_header = bool(ARTICLE_HEADER_PATTERN.match(line) or _DIVISION_HEADER.match(line))
+        if is_header and current:
+            paragraphs.append((current, page_idx))
+            current = ""
+        if not current:
+            current, page_idx = line, line_page
+        elif current.endswith("-") and not current.endswith(" -"):
+            current += line  # Mot coupé en fin de ligne (tiret gardé : "outre-mer")
+        else:
+            current += " " + line
+        if is_header or _PARAGRAPH_END.search(line):
+            paragraphs.append((current, page_idx))
+            current = ""
+    if current:
+        paragraphs.append((current, page_idx))
+    return paragraphs
+
+
+def _split_oversized(text: str, chunk_size: int) -> List[str]:
+    """
+    Coupe un alinéa trop long aux fins de phrase, puis entre les mots.
+    """
+    pieces = []
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(" ", 0, chunk_size)
+            cut = cut if cut > 0 else chunk_size
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+
+    parts = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > chunk_size:
+            parts.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+class LegislativeTextSplitter:
+    """
+    Découpe les pages d'une proposition de loi en un chunk par section ou article.
+    """
+
+    def __init__(self, chunk_size: int = LEGISLATIVE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def _section_chunks(self, section: _Section, pages: List[Document]) -> List[Document]:
+        """
+        Transforme une section en un ou plusieurs chunks (alinéas regroupés jusqu'à chunk_size).
+        """
+        groups: List[Tuple[List[str], int]] = []
+        length = 0
+        for paragraph, page_idx in _paragraphs(section.lines):
+            for part in (_split_oversized(paragraph, self.chunk_size)
+                         if len(paragraph) > self.chunk_size else [paragraph]):
+                if not groups or length + 1 + len(part) > self.chunk_size:
+                    groups.append(([], page_idx))
+                    length = -1
+                groups[-1][0].append(part)
+                length += 1 + len(part)
+
+        chunks = []
+        for parts, page_idx in groups:
+            metadata = dict(pages[page_idx].metadata)
+            metadata["section"] = section.kind
+            metadata["articles"] = [section.article] if section.article is not None else []
+            chunks.append(Document(page_content="\n".join(parts), metadata=metadata))
+        return chunks
+
+    def split_documents(self, pages: List[Document]) -> List[Document]:
+        """
+        Découpe un document en une seule passe sur ses lignes.
+
+        Args:
+            pages: Pages d'un même PDF, dans l'ordre (métadonnées de page conservées)
+
+        Returns:
+            list: Chunks du document, dans l'ordre du texte
+        """
+        chunks = []
+        section = _Section(SECTION_TITLE)
+        seen_motifs = False
+        in_dispositif = False
+        pending_division = []  # Intitulés (titre, chapitre) rattachés à l'article suivant
+
+        def flush(next_section: _Section):
+            nonlocal section
+            if any(line.strip() for line, _ in section.lines):
+                chunks.extend(self._section_chunks(section, pages))
+            section = next_section
+
+        for page_idx, page in enumerate(pages):
+            for line in page.page_content.split("\n"):
+                if _PAGE_NUMBER_LINE.match(line) or _GLYPH_LINE.match(line):
+                    continue
+                if not seen_motifs and _MOTIFS_HEADER.match(line):
+                    seen_motifs = True
+                    flush(_Section(SECTION_MOTIFS))
+                elif seen_motifs and not in_dispositif and _DISPOSITIF_HEADER.match(line):
+                    in_dispositif = True
+                    flush(_Section(SECTION_DISPOSITIF))
+                    continue
+                elif in_dispositif and (_DIVISION_HEADER.match(line) or (
+                        pending_division and not ARTICLE_HEADER_PATTERN.match(line))):
+                    pending_division.append((line, page_idx))  # Intitulé et son libellé
+                    continue
+                elif (in_dispositif or not seen_motifs) and ARTICLE_HEADER_PATTERN.match(line):
+                    flush(_Section(SECTION_ARTICLE, article_number(ARTICLE_HEADER_PATTERN.match(line).group(1))))
+                    section.lines.extend(pending_division)
+                    pending_division = []
+                section.lines.append((line, page_idx))
+
+        section.lines.extend(pending_division)
+        flush(section)
+        return chunks
+
+
+def run_benchmark(args):
+    """
+    Compare le découpage générique et le découpage structurel sur les mêmes pages
+    (lues dans le cache de pages : l'extraction n'est pas mesurée).
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from legal_metadata import annotate_articles
+    from metrics import count_tokens
+    from page_cache import PAGE_CACHE_DIR, PageCache
+    from pdf_processing import SEPARATORS, deserialize_chunks, extract_missing_pages
+    from index_manifest import file_sha256
+
+    pdf_files = sorted(Path(args.pdf_folder).glob("*.pdf"))
+    if not pdf_files:
+        print(f"❌ Aucun PDF trouvé dans '{args.pdf_folder}'")
+        return
+    page_cache = PageCache(args.page_cache or PAGE_CACHE_DIR)
+    hashes = {pdf_file: file_sha256(pdf_file) for pdf_file in pdf_files}
+    extract_missing_pages(page_cache, pdf_files, file_hashes={pdf_file.name: h for pdf_file, h in hashes.items()})
+    cached_pages = page_cache.read_pages(hashes.values())
+    documents = [deserialize_chunks(cached_pages.get(hashes[pdf_file], [])) for pdf_file in pdf_files]
+    text_chars = sum(len(page.page_content) for pages in documents for page in pages)
+    print(f"📄 {len(pdf_files)} PDFs, {sum(len(pages) for pages in documents)} pages, {text_chars / 1e6:.2f} M caractères")
+
+    def recursive_split(pages):
+        chunks = recursive.split_documents(pages)
+        annotate_articles(chunks)
+        return chunks
+
+    recursive = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, separators=SEPARATORS
+    )
+    strategies = {
+        f"recursive_{args.chunk_size}_{args.chunk_overlap}": recursive_split,
+        f"legislative_{args.legislative_chunk_size}": LegislativeTextSplitter(args.legislative_chunk_size).split_documents,
+    }
+
+    results = {}
+    for name, split in strategies.items():
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            chunks = [chunk for pages in documents for chunk in split(pages)]
+            durations.append(time.perf_counter() - start)
+        best = min(durations)
+        sizes = [len(chunk.page_content) for chunk in chunks]
+        results[name] = {
+            "chunks": len(chunks),
+            "chunk_chars_total": sum(sizes),
+            "duplication_ratio": round(sum(sizes) / text_chars, 3) if text_chars else 0.0,
+            "mean_chunk_chars": round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            "max_chunk_chars": max(sizes, default=0),
+            "embedding_tokens": sum(count_tokens(chunk.page_content) for chunk in chunks),
+            "single_article_chunks": sum(1 for chunk in chunks if len(chunk.metadata.get("articles", [])) == 1),
+            "multi_article_chunks": sum(1 for chunk in chunks if len(chunk.metadata.get("articles", [])) > 1),
+            "split_s": round(best, 4),
+            "mb_per_s": round(text_chars / 1e6 / best, 2) if best else 0.0,
+        }
+
+    print(f"\n{'Découpage':<24}{'chunks':>8}{'tokens':>10}{'dupl.':>7}{'moy.':>7}{'1 art.':>8}{'multi':>7}{'Mo/s':>8}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['chunks']:>8}{r['embedding_tokens']:>10}{r['duplication_ratio']:>7.2f}"
+              f"{r['mean_chunk_chars']:>7.0f}{r['single_article_chunks']:>8}{r['multi_article_chunks']:>7}"
+              f"{r['mb_per_s']:>8.2f}")
+
+    from benchmark_fakes import git_revision, results_path, save_results
+
+    git = git_revision()
+    save_results({
+        "benchmark": "chunking",
+        "git": git,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"pdf_folder": args.pdf_folder, "nb_pdfs": len(pdf_files), "text_chars": text_chars,
+                   "repeat": args.repeat},
+        "results": results,
+    }, results_path("chunking", git, args.output))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Découpage structurel des propositions de loi")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Comparer avec le découpage générique")
+    benchmark_parser.add_argument("--pdf-folder", default="data")
+    benchmark_parser.add_argument("--page-cache", default=None, help="Dossier du cache de pages")
+    benchmark_parser.add_argument("--chunk-size", type=int, default=1000)
+    benchmark_parser.add_argument("--chunk-overlap", type=int, default=200)
+    benchmark_parser.add_argument("--legislative-chunk-size", type=int, default=LEGISLATIVE_CHUNK_SIZE)
+    benchmark_parser.add_argument("--repeat", type=int, default=5, help="Passes mesurées (la meilleure est gardée)")
+    benchmark_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "benchmark":
+        run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,581 @@
+"""
+Index lexical BM25 local, utilisé en complément de la recherche dense Qdrant.
+
+Les questions juridiques reposent souvent sur des tokens exacts (numéros d'articles,
+"l17b2112", "code de la sécurité sociale") que la recherche vectorielle classe mal.
+L'index est tenu à jour par les indexeurs avec les mêmes chunks que Qdrant (mêmes
+IDs de points), par segments : chaque batch validé écrit un nouveau segment, avant
+le manifeste d'indexation, sans relire ni recompiler l'index existant. Les processus de
+recherche rechargent l'index dès que segments.json change (get_lexical_index).
+
+- segments.json      segments valides (écrit par renommage atomique : point de validation)
+- seg_<n>/           un segment, fichiers .npy ouverts en mmap :
+  - terms.npy          vocabulaire trié (recherche par dichotomie)
+  - term_offsets.npy   début des postings de chaque terme (format CSR)
+  - doc_ids.npy / tfs.npy   postings : document et fréquence du terme
+  - doc_lengths.npy    longueur (en tokens) de chaque document
+  - point_ids.npy      ID Qdrant de chaque document (trié)
+  - docs.bin / doc_offsets.npy   métadonnées (JSON) de chaque document
+  - deleted_<n>.npy    documents remplacés ou supprimés depuis l'écriture du segment
+
+Le texte des chunks n'est pas recopié : celui des résultats lexicaux est relu dans
+la base vectorielle (rag._fetch_texts). Un segment est fusionné avec le précédent
+dès que celui-ci n'est pas plus de LEXICAL_MERGE_FACTOR fois plus gros, à partir des
+postings (sans re-tokeniser) : le nombre de segments reste logarithmique.
+
+Tokenisation française : minuscules, suppression des accents, mots vides retirés,
+racinisation légère (les tokens contenant des chiffres sont conservés tels quels).
+Le nom des PDFs sources est indexé avec le texte de chaque chunk.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Configuration
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # Constante de la reciprocal rank fusion
+LEXICAL_MERGE_FACTOR = int(os.getenv("LEXICAL_MERGE_FACTOR", "4"))  # Fusion si le segment précédent est <= 4x plus gros
+
+STOPWORDS = set("""
+a au aux avec ce ces cet cette dans de des du elle en et eux il ils je la le les leur lui ma
+mais me meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta
+te tes toi ton tu un une vos votre vous c d j l m n s t y ete etre est sont ont a avait
+sera seront etait fait comme plus ainsi dont cela ceci tout tous toute toutes
+""".split())
+
+# Suffixes retirés par la racinisation légère, du plus long au plus court
+SUFFIXES = (
+    "issements", "issement", "atrices", "atrice", "ateurs", "ateur", "ations", "ation",
+    "ements", "ement", "ments", "ment", "ances", "ance", "ences", "ence", "ites", "ite",
+    "iques", "ique", "ismes", "isme", "istes", "iste", "ables", "able", "ibles", "ible",
+    "euses", "euse", "eux", "ives", "ive", "ifs", "if", "ees", "ee", "es", "er", "ez",
+    "e", "s", "x",
+)
+MIN_STEM_LENGTH = 3
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text: str) -> str:
+    """
+    Minuscules et suppression des accents ("Sécurité" -> "securite").
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """
+    Racinisation légère du français (suppression du suffixe le plus long).
+    """
+    if any(c.isdigit() for c in token):
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Découpe un texte en tokens normalisés pour BM25.
+    """
+    return [
+        stem(token) for token in _TOKEN_PATTERN.findall(fold_accents(text))
+        if token not in STOPWORDS
+    ]
+
+
+def _count_tokens(tokens: Iterable[str]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def _source_tokens(metadata: dict) -> List[str]:
+    """
+    Tokens des noms de fichiers sources (ex: "l17b2112"), indexés avec le texte.
+    """
+    sources = metadata.get("sources") or [metadata.get("source", "")]
+    return tokenize(" ".join(os.path.splitext(source)[0] for source in sources))
+
+
+def _write_segment_files(path: str, terms, term_offsets, doc_ids, tfs, doc_lengths, point_ids, blobs: List[bytes]):
+    """
+    Écrit un segment dans un dossier temporaire puis le renomme (jamais de segment partiel).
+    """
+    doc_offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    doc_offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "terms.npy"), np.asarray(terms, dtype=str))
+    np.save(os.path.join(tmp_path, "term_offsets.npy"), np.asarray(term_offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "doc_ids.npy"), np.asarray(doc_ids, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "tfs.npy"), np.asarray(tfs, dtype=np.uint16))
+    np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "point_ids.npy"), np.asarray(point_ids, dtype=str))
+    np.save(os.path.join(tmp_path, "doc_offsets.npy"), doc_offsets)
+    with open(os.path.join(tmp_path, "docs.bin"), "wb") as f:
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _build_segment(path: str, documents: Dict[str, Tuple[Dict[str, int], dict]]):
+    """
+    Compile des documents {ID: (tokens du texte, métadonnées)} en segment BM25.
+    """
+    point_ids = sorted(documents)
+    posting_terms, posting_docs, posting_tfs = [], [], []
+    doc_lengths = np.zeros(len(point_ids), dtype=np.int32)
+    blobs = []
+    for doc_id, point_id in enumerate(point_ids):
+        text_counts, metadata = documents[point_id]
+        counts = dict(text_counts)
+        for token in _source_tokens(metadata):
+            counts[token] = counts.get(token, 0) + 1
+        doc_lengths[doc_id] = sum(counts.values())
+        posting_terms.extend(counts)
+        posting_docs.extend([doc_id] * len(counts))
+        posting_tfs.extend(counts.values())
+        blobs.append(json.dumps({"metadata": metadata}, ensure_ascii=False).encode("utf-8"))
+
+    # Postings triés par terme puis document (format CSR)
+    terms, term_indexes = np.unique(np.array(posting_terms, dtype=str), return_inverse=True)
+    doc_ids = np.array(posting_docs, dtype=np.int32)
+    order = np.lexsort((doc_ids, term_indexes))
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum(np.bincount(term_indexes, minlength=len(terms)))
+    tfs = np.minimum(np.array(posting_tfs, dtype=np.int64), np.iinfo(np.uint16).max)[order]
+    doc_ids = doc_ids[order]
+    _write_segment_files(path, terms, term_offsets, doc_ids, tfs, doc_lengths, point_ids, blobs)
+
+
+class _Segment:
+    """
+    Segment en lecture seule (mmap), avec son masque de documents encore valides.
+    """
+
+    def __init__(self, directory: str, name: str, deleted: Optional[str] = None):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.deleted = deleted
+
+        def load(array_name):
+            return np.load(os.path.join(self.path, f"{array_name}.npy"), mmap_mode="r")
+
+        self.terms = load("terms")
+        self.term_offsets = load("term_offsets")
+        self.doc_ids = load("doc_ids")
+        self.tfs = load("tfs")
+        self.doc_lengths = load("doc_lengths")
+        self.point_ids = load("point_ids")
+        self.doc_offsets = load("doc_offsets")
+        self.docs = np.memmap(os.path.join(self.path, "docs.bin"), dtype=np.uint8, mode="r") \
+            if self.doc_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        self.live = np.ones(len(self.doc_lengths), dtype=bool)
+        if deleted:
+            self.live &= ~np.load(os.path.join(self.path, deleted))
+
+    @property
+    def num_live(self) -> int:
+        return int(self.live.sum())
+
+    def blob(self, position: int) -> bytes:
+        return bytes(self.docs[self.doc_offsets[position]:self.doc_offsets[position + 1]])
+
+    def document(self, position: int) -> Tuple[str, dict]:
+        """
+        Texte (vide, sauf ancien format) et métadonnées du document à une position.
+        """
+        payload = json.loads(self.blob(position).decode("utf-8"))
+        return payload.get("page_content", ""), payload["metadata"]
+
+    def positions(self, point_ids: np.ndarray) -> np.ndarray:
+        """
+        Position des documents valides de ces IDs dans le segment (-1 si absent).
+        """
+        if len(self.point_ids) == 0 or len(point_ids) == 0:
+            return np.full(len(point_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.point_ids, point_ids), len(self.point_ids) - 1)
+        found = (self.point_ids[positions] == point_ids) & self.live[positions]
+        return np.where(found, positions, -1)
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        position = int(np.searchsorted(self.terms, term))
+        if position >= len(self.terms) or self.terms[position] != term:
+            return None
+        start, end = self.term_offsets[position], self.term_offsets[position + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def token_counts(self, positions: List[int]) -> Dict[int, Dict[str, int]]:
+        """
+        Tokens de quelques documents, reconstitués à partir des postings (un seul parcours).
+        """
+        counts: Dict[int, Dict[str, int]] = {position: {} for position in positions}
+        entries = np.flatnonzero(np.isin(self.doc_ids, positions))
+        term_indexes = np.searchsorted(self.term_offsets, entries, side="right") - 1
+        for entry, term_index in zip(entries, term_indexes):
+            counts[int(self.doc_ids[entry])][str(self.terms[term_index])] = int(self.tfs[entry])
+        return counts
+
+
+def _merge_segments(segments: List[_Segment], path: str):
+    """
+    Fusionne des segments (documents valides uniquement) à partir de leurs postings.
+    """
+    vocabulary = np.unique(np.concatenate([np.asarray(segment.terms) for segment in segments]))
+    point_ids, doc_lengths, blobs = [], [], []
+    posting_terms, posting_docs, posting_tfs = [], [], []
+    base = 0
+    for segment in segments:
+        live_positions = np.flatnonzero(segment.live)
+        merged_doc = np.full(len(segment.live), -1, dtype=np.int64)
+        merged_doc[live_positions] = base + np.arange(len(live_positions))
+        terms = np.repeat(np.searchsorted(vocabulary, segment.terms), np.diff(segment.term_offsets))
+        docs = merged_doc[segment.doc_ids]
+        keep = docs >= 0
+        posting_terms.append(terms[keep])
+        posting_docs.append(docs[keep])
+        posting_tfs.append(np.asarray(segment.tfs)[keep])
+        point_ids.append(np.asarray(segment.point_ids)[live_positions])
+        doc_lengths.append(np.asarray(segment.doc_lengths)[live_positions])
+        blobs.extend(segment.blob(position) for position in live_positions)
+        base += len(live_positions)
+
+    # Documents triés par ID, postings triés par terme puis document
+    point_ids = np.concatenate(point_ids)
+    order = np.argsort(point_ids, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    terms = np.concatenate(posting_terms)
+    docs = rank[np.concatenate(posting_docs)]
+    tfs = np.concatenate(posting_tfs)
+    posting_order = np.lexsort((docs, terms))
+    counts = np.bincount(terms, minlength=len(vocabulary))
+    used = counts > 0
+    term_offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum(counts[used])
+    _write_segment_files(
+        path, vocabulary[used], term_offsets, docs[posting_order], tfs[posting_order],
+        np.concatenate(doc_lengths)[order], point_ids[order], [blobs[i] for i in order]
+    )
+
+
+def _read_state(directory: str) -> dict:
+    path = os.path.join(directory, "segments.json")
+    if not os.path.exists(path):
+        return {"generation": 0, "next_segment": 1, "segments": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _open_segments(directory: str) -> List[_Segment]:
+    """
+    Segments valides du dossier (l'ancien format, un index unique à la racine, est lu tel quel).
+    """
+    state = _read_state(directory)
+    if not state["segments"] and os.path.exists(os.path.join(directory, "point_ids.npy")):
+        return [_Segment(directory, ".")]
+    return [_Segment(directory, entry["name"], entry.get("deleted")) for entry in state["segments"]]
+
+
+_LEGACY_FILES = ("terms.npy", "term_offsets.npy", "doc_ids.npy", "tfs.npy", "doc_lengths.npy",
+                 "point_ids.npy", "doc_offsets.npy", "docs.bin")
+
+
+class LexicalIndexWriter:
+    """
+    Mises à jour de l'index BM25 par les indexeurs.
+
+    Seuls les changements en attente sont gardés en mémoire ; save() les écrit
+    en un nouveau segment. Appeler save() après chaque batch validé, avant le
+    manifeste : un batch absent du manifeste est ré-indexé (et réécrit ici) au
+    prochain lancement.
+    """
+
+    def __init__(self, directory: str = LEXICAL_INDEX_DIR):
+        self.directory = directory
+        self.state = _read_state(directory)
+        self.segments = [_Segment(directory, entry["name"], entry.get("deleted"))
+                         for entry in self.state["segments"]]
+        self.pending: Dict[str, Tuple[Dict[str, int], dict]] = {}
+        self.pending_deletes = set()
+        self.migrate = not self.segments and os.path.exists(os.path.join(directory, "point_ids.npy"))
+        if self.migrate:
+            # Ancien format (index unique avec le texte) : converti au premier save()
+            legacy = _Segment(directory, ".")
+            for position, point_id in enumerate(legacy.point_ids):
+                text, metadata = legacy.document(position)
+                self.pending[str(point_id)] = (_count_tokens(tokenize(text)), metadata)
+
+    def upsert(self, point_ids: Iterable[str], chunks: Iterable[Document]):
+        """
+        Ajoute ou remplace des chunks (mêmes IDs que les points Qdrant).
+        """
+        for point_id, chunk in zip(point_ids, chunks):
+            point_id = str(point_id)
+            self.pending[point_id] = (_count_tokens(tokenize(chunk.page_content)), dict(chunk.metadata))
+            self.pending_deletes.discard(point_id)
+
+    def delete(self, point_ids: Iterable[str]):
+        """
+        Retire des chunks supprimés de Qdrant.
+        """
+        for point_id in point_ids:
+            point_id = str(point_id)
+            self.pending.pop(point_id, None)
+            self.pending_deletes.add(point_id)
+
+    def _load_committed(self, point_ids: Iterable[str]):
+        """
+        Met en attente des documents déjà écrits, pour les réécrire (métadonnées modifiées).
+        """
+        wanted = np.array(sorted({str(pid) for pid in point_ids} - set(self.pending)), dtype=str)
+        for segment in self.segments:
+            positions = segment.positions(wanted)
+            found = [int(position) for position in positions if position >= 0]
+            if not found:
+                continue
+            for position, text_counts in segment.token_counts(found).items():
+                _, metadata = segment.document(position)
+                for token in _source_tokens(metadata):
+                    text_counts[token] -= 1
+                self.pending[str(segment.point_ids[position])] = (
+                    {token: count for token, count in text_counts.items() if count > 0}, metadata
+                )
+
+    def update_metadata(self, point_id: str, payload: dict):
+        """
+        Met à jour les métadonnées d'un chunk dédupliqué (sources et champs filtrés).
+        """
+        point_id = str(point_id)
+        if point_id not in self.pending:
+            self._load_committed([point_id])
+        entry = self.pending.get(point_id)
+        if entry is not None:
+            entry[1].update(payload)
+
+    def apply_payload_updates(self, operations):
+        """
+        Reporte les mises à jour de métadonnées envoyées à Qdrant (SetPayloadOperation,
+        voir chunk_dedup.py).
+        """
+        self._load_committed(pid for operation in operations for pid in operation.set_payload.points)
+        for operation in operations:
+            for point_id in operation.set_payload.points:
+                self.update_metadata(point_id, operation.set_payload.payload)
+
+    def _segment_name(self) -> str:
+        name = f"seg_{self.state['next_segment']:06d}"
+        self.state["next_segment"] += 1
+        return name
+
+    def save(self):
+        """
+        Écrit les changements en attente : masques de suppression des anciennes
+        versions, nouveau segment, fusions éventuelles, puis segments.json
+        (renommage atomique).
+        """
+        if not self.pending and not self.pending_deletes and not self.migrate:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self.state["generation"] + 1
+        replaced = np.array(sorted(set(self.pending) | self.pending_deletes), dtype=str)
+        removed = 0
+        for segment in self.segments:
+            positions = segment.positions(replaced)
+            positions = positions[positions >= 0]
+            if len(positions):
+                segment.live[positions] = False
+                segment.deleted = f"deleted_{generation:06d}.npy"
+                np.save(os.path.join(segment.path, segment.deleted), ~segment.live)
+                removed += len(positions)
+
+        segments = [segment for segment in self.segments if segment.num_live > 0]
+        if self.pending:
+            name = self._segment_name()
+            _build_segment(os.path.join(self.directory, name), self.pending)
+            segments.append(_Segment(self.directory, name))
+        while len(segments) > 1 and segments[-2].num_live <= LEXICAL_MERGE_FACTOR * segments[-1].num_live:
+            name = self._segment_name()
+            _merge_segments(segments[-2:], os.path.join(self.directory, name))
+            segments[-2:] = [_Segment(self.directory, name)]
+
+        self.state["generation"] = generation
+        self.state["segments"] = [{"name": segment.name, "deleted": segment.deleted} for segment in segments]
+        tmp_path = os.path.join(self.directory, "segments.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, os.path.join(self.directory, "segments.json"))
+
+        # Segments fusionnés ou vides, anciens masques et ancien format : plus référencés
+        kept = {segment.name: segment.deleted for segment in segments}
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if entry.startswith("seg_") and entry not in kept:
+                shutil.rmtree(path)
+            elif entry in kept:
+                for filename in os.listdir(path):
+                    if filename.startswith("deleted_") and filename != kept[entry]:
+                        os.remove(os.path.join(path, filename))
+            elif self.migrate and entry in _LEGACY_FILES:
+                os.remove(path)
+
+        added = len(self.pending)
+        self.segments = segments
+        self.pending = {}
+        self.pending_deletes = set()
+        self.migrate = False
+        print(f"🔤 Index lexical : {added} chunks écrits, {removed} remplacés ou supprimés "
+              f"({sum(segment.num_live for segment in segments)} chunks, {len(segments)} segments)")
+
+
+class LexicalIndex:
+    """
+    Index BM25 en lecture seule (tous les segments valides), ouvert en mmap.
+    """
+
+    def __init__(self, directory: str = LEXICAL_INDEX_DIR):
+        self.segments = _open_segments(directory)
+        # Document global = base du segment + position dans le segment
+        sizes = [len(segment.live) for segment in self.segments]
+        self.bases = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.num_docs = sum(segment.num_live for segment in self.segments)
+        total_length = sum(float(np.asarray(segment.doc_lengths)[segment.live].sum()) for segment in self.segments)
+        self.avg_doc_length = total_length / self.num_docs if self.num_docs else 0.0
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Document, float]]:
+        """
+        Renvoie les k chunks les plus pertinents au sens de BM25.
+
+        Returns:
+            list: [(Document avec metadata["_id"], score)] par score décroissant ;
+                  le texte est vide, à relire dans la base vectorielle (rag._fetch_texts)
+        """
+        if self.num_docs == 0:
+            return []
+        all_doc_ids = []
+        all_scores = []
+        for term in set(tokenize(query)):
+            term_postings = []
+            for index, segment in enumerate(self.segments):
+                postings = segment.postings(term)
+                if postings is None:
+                    continue
+                doc_ids, tfs = postings
+                keep = segment.live[doc_ids]
+                if keep.any():
+                    term_postings.append((index, doc_ids[keep], tfs[keep]))
+            document_frequency = sum(len(doc_ids) for _, doc_ids, _ in term_postings)
+            if not document_frequency:
+                continue
+            idf = np.log(1 + (self.num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+            for index, doc_ids, tfs in term_postings:
+                tfs = tfs.astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.segments[index].doc_lengths[doc_ids] / self.avg_doc_length)
+                all_doc_ids.append(self.bases[index] + doc_ids.astype(np.int64))
+                all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not all_doc_ids:
+            return []
+
+        # Somme des contributions par document
+        doc_ids, inverse = np.unique(np.concatenate(all_doc_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            index = int(np.searchsorted(self.bases, doc_ids[i], side="right")) - 1
+            segment, position = self.segments[index], int(doc_ids[i] - self.bases[index])
+            text, metadata = segment.document(position)
+            metadata["_id"] = str(segment.point_ids[position])
+            results.append((Document(page_content=text, metadata=metadata), float(scores[i])))
+        return results
+
+
+_lexical_index = None
+_lexical_index_version = None
+_lexical_index_lock = threading.Lock()
+
+
+def _index_version(directory: str) -> Optional[Tuple]:
+    """
+    Version de l'index sur disque : segments.json est remplacé (renommage atomique)
+    à chaque validation, ce qui change son inode et sa date de modification.
+    """
+    for name in ("segments.json", "point_ids.npy"):
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        return name, stat.st_ino, stat.st_mtime_ns, stat.st_size
+    return None
+
+
+def get_lexical_index(directory: str = LEXICAL_INDEX_DIR) -> Optional[LexicalIndex]:
+    """
+    Charge l'index au premier appel (et non au démarrage de l'application), puis le
+    recharge quand un indexeur a validé de nouveaux segments : les processus de
+    l'application et de l'API voient les ajouts et suppressions sans redémarrer.
+
+    Returns:
+        LexicalIndex, ou None si aucun index n'a été construit
+    """
+    global _lexical_index, _lexical_index_version
+    version = _index_version(directory)
+    if version != _lexical_index_version:
+        with _lexical_index_lock:
+            version = _index_version(directory)
+            if version != _lexical_index_version:
+                _lexical_index = _open_index(directory) if version is not None else None
+                _lexical_index_version = version
+    return _lexical_index
+
+
+def _open_index(directory: str, attempts: int = 3) -> LexicalIndex:
+    """
+    Ouvre l'index, en relisant segments.json si un indexeur a supprimé entre-temps
+    les segments qu'il référençait (fusion validée pendant la lecture).
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return LexicalIndex(directory)
+        except FileNotFoundError:
+            if attempt == attempts:
+                raise
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """
+    Fusionne plusieurs classements (Reciprocal Rank Fusion) par ID de point.
+
+    Args:
+        result_lists: Listes de documents ordonnées (chaque document porte metadata["_id"])
+        k: Constante d'amortissement des rangs
+
+    Returns:
+        list: Documents uniques triés par score RRF décroissant
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = str(doc.metadata.get("_id", doc.page_content))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
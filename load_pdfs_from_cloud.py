@@ -1,69 +1,213 @@
+"""
+Téléchargement des PDFs depuis le bucket S3 (R2) vers db_local_pdfs/.
+
+- l'index db_urls.parquet est lu en lazy : seules les colonnes utiles sont chargées
+- les téléchargements partent en parallèle (DOWNLOAD_WORKERS threads, un seul
+  client S3 et son pool de connexions)
+- un fichier déjà présent avec la même taille et le même ETag (MD5) est sauté :
+  relancer le script ne télécharge que ce qui manque ou a changé
+- chaque fichier est écrit dans un fichier temporaire puis renommé (jamais de PDF tronqué)
+- une erreur sur une clé est réessayée avec backoff, sans interrompre les autres
+
+Tout service compatible S3 fonctionne (R2_ENDPOINT_URL), y compris une instance
+locale (MinIO) pour tester.
+"""
+
+import hashlib
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional, Tuple
+
 import boto3
 import polars as pl
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
-from botocore.exceptions import ClientError
+from tqdm import tqdm
 
 
 load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PDF_LOCAL = os.path.join(BASE_DIR, "db_local_pdfs") 
-DB_TEMP_PATH = os.path.join(BASE_DIR, "db_urls.parquet.tmp") 
+DB_PDF_LOCAL = os.path.join(BASE_DIR, "db_local_pdfs")
+DB_TEMP_PATH = os.path.join(BASE_DIR, "db_urls.parquet.tmp")
 DB_FILENAME = "db_urls.parquet"
+PDF_PREFIX = "pdfs/"
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 ENDPOINT_URL = os.getenv("R2_ENDPOINT_URL")
 ACCESS_KEY = os.getenv("R2_ACCESS_KEY_ID")
 SECRET_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 
+# Configuration
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "32"))  # Téléchargements simultanés
+MAX_ATTEMPTS = 4             # Tentatives par fichier
+RETRY_BASE_DELAY = 0.5       # Secondes, doublées à chaque nouvel essai (avec jitter)
+READ_CHUNK_SIZE = 1024 * 1024
+NON_RETRYABLE_ERRORS = {"NoSuchKey", "404", "AccessDenied", "403", "InvalidAccessKeyId", "SignatureDoesNotMatch"}
+
+# Un seul client (thread-safe) pour tous les threads : pool de connexions partagé.
+# Les réessais sont gérés par fichier (download_one), pas par botocore.
 s3 = boto3.client(
     's3',
     endpoint_url=ENDPOINT_URL,
     aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY
+    aws_secret_access_key=SECRET_KEY,
+    config=Config(max_pool_connections=DOWNLOAD_WORKERS, retries={"max_attempts": 1, "mode": "standard"})
 )
 
-def download_pdfs_guided_by_db():
-    
+def load_cloud_keys(parquet_path: str) -> list:
+    """
+    Clés des PDFs marqués comme téléchargés dans l'index parquet.
+
+    scan_parquet ne lit que les colonnes "downloaded" et "pdf_name".
+    """
+    return (
+        pl.scan_parquet(parquet_path)
+          .filter(pl.col("downloaded") == True)
+          .select(pl.concat_str([pl.lit(PDF_PREFIX), pl.col("pdf_name")]).alias("cloud_key"))
+          .unique(maintain_order=True)
+          .collect()
+          .get_column("cloud_key")
+          .to_list()
+    )
+
+def list_remote_objects(prefix: str = PDF_PREFIX) -> Optional[Dict[str, Tuple[int, str]]]:
+    """
+    Taille et ETag de tous les objets du préfixe (1 requête par 1000 objets).
+
+    Returns:
+        dict: {clé: (taille, etag)}, ou None si le listing est refusé
+              (les fichiers locaux sont alors vérifiés un par un avec HEAD)
+    """
+    objects = {}
+    try:
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                objects[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+    except ClientError as e:
+        print(f"⚠️ Listing du bucket impossible ({e.response['Error'].get('Code')}), vérification par HEAD")
+        return None
+    return objects
+
+def _md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def local_file_matches(local_path: str, size: int, etag: str) -> bool:
+    """
+    Le fichier local est-il identique à l'objet distant ?
+
+    La taille est comparée d'abord ; l'ETag n'est le MD5 du contenu que pour
+    les objets envoyés en une fois (sans "-"), sinon la taille suffit.
+    """
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != size:
+        return False
+    return "-" in etag or _md5(local_path) == etag
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") not in NON_RETRYABLE_ERRORS
+    return True
+
+def download_one(cloud_key: str, remote: Optional[Dict[str, Tuple[int, str]]]) -> Tuple[str, int, Optional[str]]:
+    """
+    Télécharge une clé si nécessaire (exécuté dans un thread du pool).
+
+    Returns:
+        tuple: (statut "downloaded" / "skipped" / "failed", octets téléchargés, erreur)
+    """
+    local_path = os.path.join(DB_PDF_LOCAL, os.path.basename(cloud_key))
+    tmp_path = f"{local_path}.part"
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            if remote is not None:
+                if cloud_key not in remote:
+                    return "failed", 0, "absent du bucket"
+                size, etag = remote[cloud_key]
+                if local_file_matches(local_path, size, etag):
+                    return "skipped", 0, None
+            elif os.path.exists(local_path):
+                head = s3.head_object(Bucket=BUCKET_NAME, Key=cloud_key)
+                if local_file_matches(local_path, head["ContentLength"], head["ETag"].strip('"')):
+                    return "skipped", 0, None
+
+            response = s3.get_object(Bucket=BUCKET_NAME, Key=cloud_key)
+            written = 0
+            with open(tmp_path, "wb") as f:
+                for chunk in response["Body"].iter_chunks(READ_CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            if written != response["ContentLength"]:
+                raise IOError(f"téléchargement incomplet ({written}/{response['ContentLength']} octets)")
+            os.replace(tmp_path, local_path)
+            return "downloaded", written, None
+        except (ClientError, BotoCoreError, OSError) as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if attempt == MAX_ATTEMPTS or not _retryable(e):
+                return "failed", 0, f"{type(e).__name__}: {e}"
+            time.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1) * (0.5 + random.random()))
+
+def download_pdfs_guided_by_db(workers: int = DOWNLOAD_WORKERS):
+
     if not os.path.exists(DB_PDF_LOCAL):
         os.makedirs(DB_PDF_LOCAL, exist_ok=True)
         print(f"Création du dossier local : {DB_PDF_LOCAL}")
 
     total_downloaded = 0
     total_skipped = 0
-    
+    total_bytes = 0
+    failed = []
+
     try:
         print("1. 📥 Téléchargement de la DB pour obtenir l'index des fichiers...")
         s3.download_file(BUCKET_NAME, DB_FILENAME, DB_TEMP_PATH)
-        df = pl.read_parquet(DB_TEMP_PATH)
-        
+
         print("2. ⚙️ Préparation de l'index des clés cloud...")
-        cloud_keys = (
-            df.filter(pl.col("downloaded") == True)
-              .select(pl.concat_str([pl.lit("pdfs/"), pl.col("pdf_name")]).alias("cloud_key"))
-              .get_column("cloud_key")
-              .to_list()
-        )
-        
+        cloud_keys = load_cloud_keys(DB_TEMP_PATH)
+        remote = list_remote_objects()
+
         print(f"   {len(cloud_keys)} fichiers à télécharger trouvés dans l'index.")
-        
-        print("\n3. ⬇️ Démarrage du téléchargement")
 
-        for cloud_key in cloud_keys:
-            filename = os.path.basename(cloud_key)
-            local_path = os.path.join(DB_PDF_LOCAL, filename)
-                
-            s3.download_file(BUCKET_NAME, cloud_key, local_path)
-            print(f"   [OK] {filename}")
-            total_downloaded += 1
+        print(f"\n3. ⬇️ Démarrage du téléchargement ({workers} en parallèle)")
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as executor:
+            futures = {executor.submit(download_one, cloud_key, remote): cloud_key for cloud_key in cloud_keys}
+            progress = tqdm(as_completed(futures), total=len(futures), desc="PDFs", unit="PDF")
+            for future in progress:
+                status, size, error = future.result()
+                if status == "downloaded":
+                    total_downloaded += 1
+                    total_bytes += size
+                elif status == "skipped":
+                    total_skipped += 1
+                else:
+                    failed.append((futures[future], error))
+                elapsed = time.perf_counter() - start
+                progress.set_postfix(MB_s=f"{total_bytes / 2 ** 20 / max(elapsed, 1e-9):.1f}", echecs=len(failed))
 
+        elapsed = time.perf_counter() - start
         print("\n" + "="*50)
-        print("✅ TÉLÉCHARGEMENT GUIDÉ RÉUSSI.")
-        print(f"   Fichiers téléchargés : {total_downloaded}")
+        print("✅ TÉLÉCHARGEMENT GUIDÉ TERMINÉ." if not failed else "⚠️ TÉLÉCHARGEMENT GUIDÉ INCOMPLET.")
+        print(f"   Fichiers téléchargés : {total_downloaded} ({total_bytes / 2 ** 20:.1f} Mo)")
         print(f"   Fichiers sautés : {total_skipped}")
+        print(f"   Fichiers en échec : {len(failed)}")
+        print(f"   Durée : {elapsed:.1f} s ({total_downloaded / max(elapsed, 1e-9):.1f} fichiers/s, "
+              f"{total_bytes / 2 ** 20 / max(elapsed, 1e-9):.1f} Mo/s)")
+        for cloud_key, error in failed[:10]:
+            print(f"   - {cloud_key} : {error}")
+        if len(failed) > 10:
+            print(f"   ... et {len(failed) - 10} autres (relancer le script pour les réessayer)")
         print("="*50)
-        
+
     except ClientError as e:
         print(f"\n❌ ERREUR CRITIQUE D'ACCÈS : {e}")
         print("Vérifie l'accès au bucket ou la présence de 'db_urls.parquet'.")
@@ -74,4 +218,4 @@ def download_pdfs_guided_by_db():
             os.remove(DB_TEMP_PATH)
 
 if __name__ == "__main__":
-    download_pdfs_guided_by_db()
\ No newline at end of file
+    download_pdfs_guided_by_db()
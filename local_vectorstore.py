@@ -0,0 +1,876 @@
+"""
+Base vectorielle locale embarquée, alternative à Qdrant Cloud (VECTOR_BACKEND=local).
+
+Pas de serveur ni d'appel réseau : les vecteurs sont dans une matrice mappée en
+mémoire, les payloads dans une base SQLite à côté. Dossier LOCAL_VECTOR_DIR :
+
+- meta.json          dimension, type des vecteurs (float16 ou float32), état de l'IVF
+- vectors.bin        une ligne par point, vecteurs normalisés (score = cosinus, comme Qdrant) ;
+                     vectors_<n>.bin après la n-ième compaction
+- payloads.sqlite    id, ligne dans la matrice, contenu et métadonnées (JSON) des points,
+                     valeurs des champs filtrés (table indexée point_fields), génération
+                     de la matrice
+- ivf_*.npy          index IVF optionnel (centroïdes, lignes triées par liste, offsets)
+
+L'ouverture ne lit pas les vecteurs (mmap) : seules les pages parcourues par une
+recherche sont chargées, par blocs de LOCAL_SEARCH_BLOCK_ROWS lignes (mémoire de
+travail bornée). Un point remplacé ou supprimé laisse une ligne morte dans la
+matrice, récupérée par `compact`.
+
+Plusieurs processus peuvent ouvrir la même base (un indexeur, l'app, l'API) : un
+lecteur relit l'état des lignes quand la base SQLite a été modifiée par un autre
+processus (PRAGMA data_version). `compact` écrit une nouvelle matrice sous un autre
+nom et change la génération dans la même transaction que la renumérotation des
+lignes ; une recherche commencée sur l'ancienne génération est refaite.
+
+Recherche exacte : produits scalaires vectorisés bloc par bloc, pour une ou
+plusieurs requêtes à la fois. Avec un IVF (`build-ivf`), seules les LOCAL_IVF_NPROBE
+listes les plus proches sont parcourues, plus les lignes ajoutées depuis sa
+construction. Les recherches filtrées (voir legal_metadata.py) restent exactes sur
+les lignes qui satisfont le filtre, trouvées par l'index SQLite des champs filtrés
+(FILTER_FIELDS) sans relire le JSON des métadonnées.
+
+Commandes :
+    python local_vectorstore.py info
+    python local_vectorstore.py import-qdrant            # Copier la collection Qdrant Cloud, sans ré-embedding
+    python local_vectorstore.py build-ivf --lists 256
+    python local_vectorstore.py compact
+    python local_vectorstore.py benchmark                # Recall et latence exacte / IVF
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from qdrant_client import models
+
+# Configuration
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant")  # "qdrant" (Qdrant Cloud) ou "local"
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "local_vectors")
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float16")  # "float16" (moitié moins de disque) ou "float32"
+SEARCH_BLOCK_ROWS = int(os.getenv("LOCAL_SEARCH_BLOCK_ROWS", "4096"))  # Lignes converties en float32 à la fois
+IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "8"))  # Listes parcourues (0 = recherche exacte même avec IVF)
+IVF_TRAIN_SAMPLE = 20000  # Points utilisés pour entraîner les centroïdes
+IVF_ITERATIONS = 10
+SQLITE_MAX_PARAMS = 900  # Sous la limite de paramètres par requête SQLite
+# Champs de métadonnées copiés dans la table indexée point_fields (filtres de legal_metadata.py)
+FILTER_FIELDS = ("source", "sources", "bill_numbers", "legislatures", "deposit_dates",
+                 "all_author_surnames", "bill_articles")
+FILTER_FIELDS_VERSION = 1  # À incrémenter si FILTER_FIELDS change (table reconstruite à l'ouverture)
+FILTER_SCAN_FRACTION = float(os.getenv("LOCAL_FILTER_SCAN_FRACTION", "0.25"))  # Au-delà de cette part de lignes filtrées, parcours complet avec masque
+RESULTS_DIR = "benchmark_results"
+BENCHMARK_MARKER = ".luxas_benchmark"
+
+
+def _sql_value(value):
+    # Les dates sont stockées en ISO ("2025-11-18") : comparaison lexicographique
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _field_values(point_id: str, row: int, metadata: dict):
+    """
+    Lignes (id, ligne, champ, valeur) de la table point_fields : une par élément d'un champ liste.
+    """
+    for field in FILTER_FIELDS:
+        value = metadata.get(field)
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, (str, int, float)):
+                yield point_id, row, field, item
+
+
+def _condition_rows_sql(condition) -> Tuple[str, list]:
+    """
+    Traduit une condition de filtre Qdrant en requête SQL renvoyant les lignes
+    qui la satisfont : table indexée point_fields pour les champs FILTER_FIELDS,
+    colonne JSON des métadonnées pour les autres.
+
+    Les conditions portent sur "metadata.<champ>" ; un champ liste (numéros de
+    proposition, dates de dépôt...) satisfait la condition si l'un de ses éléments
+    y correspond, comme dans Qdrant.
+    """
+    if isinstance(condition, models.Filter):
+        return _filter_rows_sql(condition)
+    if not isinstance(condition, models.FieldCondition) or not condition.key.startswith("metadata."):
+        raise ValueError(f"Condition non supportée par la base locale : {condition}")
+    field = condition.key[len("metadata."):]
+    if isinstance(condition.match, models.MatchValue):
+        clause, params = "value = ?", [condition.match.value]
+    elif isinstance(condition.match, models.MatchAny):
+        values = list(condition.match.any)
+        clause, params = f"value IN ({', '.join('?' * len(values))})", values
+    elif condition.range is not None:
+        clauses, params = [], []
+        for operator, bound in (("<", "lt"), ("<=", "lte"), (">", "gt"), (">=", "gte")):
+            value = getattr(condition.range, bound)
+            if value is not None:
+                clauses.append(f"value {operator} ?")
+                params.append(_sql_value(value))
+        clause = " AND ".join(clauses) or "1"
+    else:
+        raise ValueError(f"Condition non supportée par la base locale : {condition}")
+
+    if field in FILTER_FIELDS:
+        return f"SELECT row FROM point_fields WHERE field = ? AND {clause}", [field, *params]
+    return (
+        f"SELECT row FROM points WHERE EXISTS (SELECT 1 FROM json_each(metadata, ?) WHERE {clause})",
+        ["$." + field, *params],
+    )
+
+
+def _filter_rows_sql(query_filter: models.Filter) -> Tuple[str, list]:
+    """
+    Traduit un filtre Qdrant (must / should / must_not) en requête SQL renvoyant
+    les lignes qui le satisfont (intersection, union et différence d'ensembles).
+    """
+    def as_list(conditions):
+        if conditions is None:
+            return []
+        return conditions if isinstance(conditions, list) else [conditions]
+
+    def combine(operator, parts):
+        sql = f" {operator} ".join(f"SELECT row FROM ({part})" for part, _ in parts)
+        return sql, [p for _, part_params in parts for p in part_params]
+
+    parts = [_condition_rows_sql(condition) for condition in as_list(query_filter.must)]
+    should = [_condition_rows_sql(condition) for condition in as_list(query_filter.should)]
+    if should:
+        parts.append(combine("UNION", should))
+    must_not = [_condition_rows_sql(condition) for condition in as_list(query_filter.must_not)]
+    if not parts:
+        parts.append(("SELECT row FROM points", []))
+    sql, params = combine("INTERSECT", parts)
+    if must_not:
+        excluded, excluded_params = combine("UNION", must_not)
+        sql, params = f"{sql} EXCEPT SELECT row FROM ({excluded})", params + excluded_params
+    return sql, params
+
+
+class _GenerationChanged(Exception):
+    """
+    La matrice a été compactée par un autre processus pendant une recherche.
+    """
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    VectorStore LangChain sur une matrice mappée en mémoire et une base SQLite.
+
+    Mêmes usages que QdrantVectorStore dans le projet : add_documents(ids=...),
+    delete(ids=...), similarity_search_by_vector(filter=models.Filter), documents
+    renvoyés avec metadata["_id"].
+    """
+
+    def __init__(self, directory: str = LOCAL_VECTOR_DIR, embedding: Optional[Embeddings] = None,
+                 dtype: str = LOCAL_VECTOR_DTYPE, nprobe: int = IVF_NPROBE):
+        self.directory = directory
+        self.embedding = embedding
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._meta_path = os.path.join(directory, "meta.json")
+        self.meta = {"dim": None, "dtype": dtype, "ivf_rows": 0}
+        self._load_meta()
+        self.dtype = np.dtype(self.meta["dtype"])
+
+        self._db = sqlite3.connect(os.path.join(directory, "payloads.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS points ("
+                         "id TEXT PRIMARY KEY, row INTEGER NOT NULL, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS points_row ON points(row)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.commit()
+        self._ensure_point_fields()
+
+        self._vectors = None
+        self._count = 0
+        self._live = np.zeros(0, dtype=bool)
+        self._ivf = None
+        self._generation = 0
+        self._data_version = None
+        self._reload()
+
+    # --- Stockage ---
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.meta["dim"]
+
+    def __len__(self):
+        return int(self._live.sum())
+
+    def _load_meta(self):
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                self.meta.update(json.load(f))
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors_{generation}.bin" if generation else "vectors.bin")
+
+    def _stored_generation(self) -> int:
+        row = self._db.execute("SELECT value FROM state WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _reload(self):
+        """
+        Relit meta.json, la génération et les lignes vivantes (ouverture, ou base
+        modifiée par un autre processus).
+        """
+        with self._lock:
+            self._load_meta()
+            while True:
+                # Génération et lignes lues dans la même transaction que la matrice ouverte
+                self._db.execute("BEGIN")
+                try:
+                    self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+                    self._generation = self._stored_generation()
+                    self._open_vectors()
+                finally:
+                    self._db.execute("COMMIT")
+                # Matrice supprimée par une compaction concurrente avant son ouverture : relire
+                if self._stored_generation() == self._generation:
+                    break
+
+    def _refresh(self):
+        """
+        Recharge l'état si un autre processus a modifié la base depuis la dernière lecture.
+        """
+        with self._lock:
+            if self._db.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+                self._reload()
+
+    @contextlib.contextmanager
+    def _snapshot(self, generation: int):
+        """
+        Lectures SQLite dans une même transaction, sur la génération `generation`
+        (lève _GenerationChanged si la matrice a été compactée depuis).
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                if self._stored_generation() != generation:
+                    raise _GenerationChanged()
+                yield
+            finally:
+                self._db.execute("COMMIT")
+
+    def _save_meta(self):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _open_vectors(self):
+        """
+        (Ré)ouvre la matrice de la génération courante en mmap et recalcule les lignes vivantes.
+        """
+        path = self._vectors_path(self._generation)
+        row_bytes = (self.dim or 0) * self.dtype.itemsize
+        count, vectors = 0, None
+        if row_bytes:
+            try:
+                # Une ligne incomplète (écriture en cours ou interrompue) n'est référencée par aucun point
+                count = os.path.getsize(path) // row_bytes
+                if count:
+                    vectors = np.memmap(path, dtype=self.dtype, mode="r", shape=(count, self.dim))
+            except FileNotFoundError:
+                count = 0  # Base vide, ou matrice remplacée par une compaction (voir _reload)
+        self._vectors = vectors
+        self._count = count
+        self._live = np.zeros(count, dtype=bool)
+        rows = np.fromiter((row for (row,) in self._db.execute("SELECT row FROM points")), dtype=np.int64)
+        self._live[rows[rows < count]] = True
+        self._load_ivf()
+
+    def _load_ivf(self):
+        paths = [os.path.join(self.directory, f"ivf_{name}.npy") for name in ("centroids", "rows", "offsets")]
+        # Un IVF construit sur une autre génération désigne d'anciennes lignes
+        if self.meta.get("ivf_rows") and self.meta.get("ivf_generation", 0) == self._generation \
+                and all(os.path.exists(path) for path in paths):
+            self._ivf = tuple(np.load(path, mmap_mode="r") for path in paths)
+        else:
+            self._ivf = None
+
+    def _ensure_point_fields(self):
+        """
+        (Re)construit point_fields à partir du JSON des métadonnées si la table date
+        d'une autre version de FILTER_FIELDS (ou d'avant son introduction).
+        """
+        row = self._db.execute("SELECT value FROM state WHERE key = 'filter_fields_version'").fetchone()
+        if row and row[0] == FILTER_FIELDS_VERSION:
+            return
+        self._db.execute("DROP TABLE IF EXISTS point_fields")
+        self._db.execute("CREATE TABLE point_fields (id TEXT NOT NULL, row INTEGER NOT NULL, field TEXT NOT NULL, value)")
+        self._db.execute("CREATE INDEX point_fields_value ON point_fields(field, value, row)")
+        self._db.execute("CREATE INDEX point_fields_id ON point_fields(id)")
+        for pid, row, metadata in self._db.execute("SELECT id, row, metadata FROM points").fetchall():
+            self._db.executemany("INSERT INTO point_fields VALUES (?, ?, ?, ?)",
+                                 _field_values(pid, row, json.loads(metadata)))
+        self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('filter_fields_version', ?)",
+                         (FILTER_FIELDS_VERSION,))
+        self._db.commit()
+
+    def _delete_point_fields(self, ids: List[str]):
+        for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+            batch = ids[start:start + SQLITE_MAX_PARAMS]
+            self._db.execute(f"DELETE FROM point_fields WHERE id IN ({', '.join('?' * len(batch))})", batch)
+
+    def _rows_of(self, ids: List[str]) -> List[Tuple[str, int]]:
+        found = []
+        for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+            batch = ids[start:start + SQLITE_MAX_PARAMS]
+            found.extend(self._db.execute(
+                f"SELECT id, row FROM points WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall())
+        return found
+
+    def add_vectors(self, ids: List[str], vectors, texts: List[str], metadatas: List[dict]) -> List[str]:
+        """
+        Ajoute ou remplace des points à partir de vecteurs déjà calculés
+        (pipeline d'ingestion, import depuis Qdrant).
+        """
+        # Un ID présent deux fois dans le batch : la dernière version l'emporte
+        last = {str(pid): i for i, pid in enumerate(ids)}
+        keep = sorted(last.values())
+        ids = [str(ids[i]) for i in keep]
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32)[keep])
+        if not ids:
+            return []
+
+        with self._lock:
+            self._refresh()
+            if self.dim is None:
+                self.meta["dim"] = int(vectors.shape[1])
+                self._save_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Dimension {vectors.shape[1]} incompatible avec la base locale ({self.dim})")
+
+            # Écriture après la dernière ligne complète (une ligne incomplète est écrasée)
+            start = self._count
+            path = self._vectors_path(self._generation)
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(start * self.dim * self.dtype.itemsize)
+                f.truncate()
+                f.write(vectors.astype(self.dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            replaced_rows = [row for _, row in self._rows_of(ids)]
+            self._db.executemany(
+                "INSERT OR REPLACE INTO points (id, row, page_content, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (pid, start + i, texts[j], json.dumps(metadatas[j] or {}, ensure_ascii=False))
+                    for i, (pid, j) in enumerate(zip(ids, keep))
+                ]
+            )
+            self._delete_point_fields(ids)
+            self._db.executemany("INSERT INTO point_fields VALUES (?, ?, ?, ?)", [
+                values for i, (pid, j) in enumerate(zip(ids, keep))
+                for values in _field_values(pid, start + i, metadatas[j] or {})
+            ])
+            self._db.commit()
+
+            self._count = start + len(ids)
+            self._vectors = np.memmap(path, dtype=self.dtype, mode="r", shape=(self._count, self.dim))
+            live = np.zeros(self._count, dtype=bool)
+            live[:start] = self._live
+            live[replaced_rows] = False
+            live[start:] = True
+            self._live = live
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_vectors(list(ids), vectors, texts, metadatas or [{} for _ in texts])
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        ids = [str(pid) for pid in ids]
+        with self._lock:
+            self._refresh()
+            rows = [row for _, row in self._rows_of(ids)]
+            for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+                batch = ids[start:start + SQLITE_MAX_PARAMS]
+                self._db.execute(f"DELETE FROM points WHERE id IN ({', '.join('?' * len(batch))})", batch)
+            self._delete_point_fields(ids)
+            self._db.commit()
+            live = self._live.copy()
+            live[[row for row in rows if row < len(live)]] = False
+            self._live = live
+        return True
+
+    def get_by_ids(self, ids: Iterable[str], /) -> List[Document]:
+        """
+        Documents des IDs demandés (les IDs absents sont ignorés), comme QdrantVectorStore.
+        """
+        documents = {}
+        ids = [str(pid) for pid in ids]
+        with self._lock:
+            for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+                batch = ids[start:start + SQLITE_MAX_PARAMS]
+                for pid, page_content, metadata in self._db.execute(
+                    f"SELECT id, page_content, metadata FROM points WHERE id IN ({', '.join('?' * len(batch))})", batch
+                ):
+                    documents[pid] = Document(page_content=page_content, metadata={**json.loads(metadata), "_id": pid})
+        return [documents[pid] for pid in ids if pid in documents]
+
+    def apply_payload_updates(self, operations):
+        """
+        Reporte les mises à jour de métadonnées envoyées à Qdrant (SetPayloadOperation
+        sur la clé "metadata", voir chunk_dedup.py).
+        """
+        with self._lock:
+            for operation in operations:
+                payload = operation.set_payload.payload
+                for point_id in operation.set_payload.points:
+                    point_id = str(point_id)
+                    found = self._db.execute("SELECT row, metadata FROM points WHERE id = ?", (point_id,)).fetchone()
+                    if found is not None:
+                        metadata = {**json.loads(found[1]), **payload}
+                        self._db.execute("UPDATE points SET metadata = ? WHERE id = ?",
+                                         (json.dumps(metadata, ensure_ascii=False), point_id))
+                        self._delete_point_fields([point_id])
+                        self._db.executemany("INSERT INTO point_fields VALUES (?, ?, ?, ?)",
+                                             _field_values(point_id, found[0], metadata))
+            self._db.commit()
+
+    # --- Recherche ---
+
+    def _allowed_rows(self, query_filter: Optional[models.Filter], live: np.ndarray,
+                      generation: int) -> Optional[np.ndarray]:
+        """
+        Lignes vivantes satisfaisant le filtre (None sans filtre).
+        """
+        if query_filter is None:
+            return None
+        sql, params = _filter_rows_sql(query_filter)
+        with self._snapshot(generation):
+            rows = np.fromiter((row for (row,) in self._db.execute(sql, params)), dtype=np.int64)
+        rows = np.sort(rows[rows < len(live)])
+        return rows[live[rows]]
+
+    @staticmethod
+    def _top_k(vectors: np.memmap, live: np.ndarray, queries: np.ndarray, k: int,
+               rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k exact par requête, bloc par bloc (lignes `rows`, ou toutes les lignes vivantes).
+
+        Returns:
+            tuple: (scores, lignes), de forme (nb requêtes, k), -inf / -1 si moins de k points
+        """
+        nb_queries = len(queries)
+        best_scores = np.full((nb_queries, k), -np.inf, dtype=np.float32)
+        best_rows = np.full((nb_queries, k), -1, dtype=np.int64)
+        total = len(live) if rows is None else len(rows)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+                block = vectors[start:start + SEARCH_BLOCK_ROWS]
+            else:
+                block_rows = rows[start:start + SEARCH_BLOCK_ROWS]
+                block = vectors[block_rows]
+            scores = queries @ np.asarray(block, dtype=np.float32).T
+            if rows is None:
+                scores[:, ~live[block_rows]] = -np.inf
+
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, scores.shape)], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_rows = np.take_along_axis(merged_rows, top, axis=1)
+
+        best_rows[np.isneginf(best_scores)] = -1  # Lignes masquées retenues faute de k lignes valides
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def _ivf_rows(self, ivf: tuple, query: np.ndarray, live: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Lignes candidates de l'IVF : listes des nprobe centroïdes les plus proches,
+        plus les lignes ajoutées depuis la construction de l'index.
+        """
+        centroids, ivf_rows, offsets = ivf
+        probes = np.argpartition(-(np.asarray(centroids) @ query), min(nprobe, len(centroids)) - 1)[:nprobe]
+        candidates = [np.asarray(ivf_rows[offsets[p]:offsets[p + 1]]) for p in probes]
+        candidates.append(np.arange(self.meta["ivf_rows"], len(live)))
+        rows = np.sort(np.concatenate(candidates))
+        return rows[live[rows]]
+
+    def _documents(self, rows: List[int], generation: int) -> dict:
+        documents = {}
+        with self._snapshot(generation):
+            for start in range(0, len(rows), SQLITE_MAX_PARAMS):
+                batch = [int(row) for row in rows[start:start + SQLITE_MAX_PARAMS]]
+                for pid, row, page_content, metadata in self._db.execute(
+                    f"SELECT id, row, page_content, metadata FROM points WHERE row IN ({', '.join('?' * len(batch))})",
+                    batch
+                ):
+                    documents[row] = Document(page_content=page_content,
+                                              metadata={**json.loads(metadata), "_id": pid})
+        return documents
+
+    def search_vectors(self, queries, k: int = 4, query_filter: Optional[models.Filter] = None,
+                       nprobe: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        Recherche de plusieurs requêtes en un seul parcours de la matrice.
+
+        Args:
+            queries: Vecteurs de requête (nb requêtes x dimension)
+            k: Résultats par requête
+            query_filter: Filtre Qdrant sur les métadonnées (recherche exacte sur les lignes filtrées)
+            nprobe: Listes IVF parcourues (défaut : LOCAL_IVF_NPROBE ; 0 = exacte)
+
+        Returns:
+            list: Pour chaque requête, [(Document avec metadata["_id"], score cosinus)]
+        """
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        nprobe = self.nprobe if nprobe is None else nprobe
+        while True:
+            self._refresh()
+            with self._lock:
+                vectors, live, ivf, generation = self._vectors, self._live, self._ivf, self._generation
+            if vectors is None or k <= 0:
+                return [[] for _ in queries]
+            try:
+                allowed = self._allowed_rows(query_filter, live, generation)
+                if allowed is not None and len(allowed) > FILTER_SCAN_FRACTION * len(live):
+                    # Filtre peu sélectif : lecture séquentielle de la matrice plutôt que ligne à ligne
+                    mask = np.zeros(len(live), dtype=bool)
+                    mask[allowed] = True
+                    scores, rows = self._top_k(vectors, mask, queries, k)
+                elif allowed is not None:
+                    scores, rows = self._top_k(vectors, live, queries, k, rows=allowed)
+                elif ivf is not None and nprobe > 0:
+                    results = [self._top_k(vectors, live, query[None], k,
+                                           rows=self._ivf_rows(ivf, query, live, nprobe))
+                               for query in queries]
+                    scores = np.concatenate([s for s, _ in results])
+                    rows = np.concatenate([r for _, r in results])
+                else:
+                    scores, rows = self._top_k(vectors, live, queries, k)
+                documents = self._documents(sorted({int(row) for row in rows.ravel() if row >= 0}), generation)
+                break
+            except _GenerationChanged:
+                continue  # Compaction par un autre processus : recherche refaite sur la nouvelle matrice
+        return [
+            [(documents[int(row)], float(score))
+             for score, row in zip(query_scores, query_rows) if row >= 0 and int(row) in documents]
+            for query_scores, query_rows in zip(scores, rows)
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[models.Filter] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        # search_params (paramètres Qdrant) n'a pas d'équivalent local
+        return self.search_vectors([embedding], k, query_filter=filter, nprobe=kwargs.get("nprobe"))[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, directory: str = LOCAL_VECTOR_DIR,
+                   **kwargs: Any) -> "LocalVectorStore":
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # --- Maintenance ---
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = IVF_ITERATIONS, seed: int = 0) -> int:
+        """
+        Construit l'index IVF (k-means sphérique sur un échantillon, puis
+        affectation de toutes les lignes vivantes à leur centroïde le plus proche).
+
+        Returns:
+            int: Nombre de listes
+        """
+        with self._lock:
+            self._refresh()
+            vectors, live = self._vectors, self._live
+            live_rows = np.flatnonzero(live)
+            if not len(live_rows):
+                raise ValueError("Base locale vide : rien à indexer")
+            n_lists = min(n_lists or max(1, int(4 * np.sqrt(len(live_rows)))), len(live_rows))
+            rng = np.random.default_rng(seed)
+
+            sample_rows = np.sort(rng.choice(live_rows, size=min(len(live_rows), IVF_TRAIN_SAMPLE), replace=False))
+            sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, sample)
+                filled = np.bincount(assignments, minlength=n_lists) > 0
+                centroids[filled] = _normalize(sums[filled])
+
+            assignments = np.concatenate([
+                np.argmax(np.asarray(vectors[live_rows[start:start + SEARCH_BLOCK_ROWS]], dtype=np.float32)
+                          @ centroids.T, axis=1)
+                for start in range(0, len(live_rows), SEARCH_BLOCK_ROWS)
+            ])
+            order = np.argsort(assignments, kind="stable")
+            offsets = np.zeros(n_lists + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_lists))
+
+            np.save(os.path.join(self.directory, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(self.directory, "ivf_rows.npy"), live_rows[order])
+            np.save(os.path.join(self.directory, "ivf_offsets.npy"), offsets)
+            self.meta["ivf_rows"] = int(len(live))
+            self.meta["ivf_lists"] = int(n_lists)
+            self.meta["ivf_generation"] = self._generation
+            self._save_meta()
+            self._load_ivf()
+        return n_lists
+
+    def compact(self) -> int:
+        """
+        Réécrit la matrice sans les lignes mortes, sous le nom de la génération
+        suivante (l'IVF est à reconstruire). Les lecteurs d'autres processus gardent
+        l'ancienne matrice ouverte jusqu'à leur prochaine recherche.
+
+        Returns:
+            int: Nombre de lignes libérées
+        """
+        with self._lock:
+            self._refresh()
+            live_rows = np.flatnonzero(self._live)
+            freed = self._count - len(live_rows)
+            if not freed:
+                return 0
+            old_path = self._vectors_path(self._generation)
+            generation = self._generation + 1
+            with open(self._vectors_path(generation), "wb") as f:
+                for start in range(0, len(live_rows), SEARCH_BLOCK_ROWS):
+                    f.write(np.asarray(self._vectors[live_rows[start:start + SEARCH_BLOCK_ROWS]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # Renumérotation et génération dans la même transaction
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS remap (old INTEGER PRIMARY KEY, new INTEGER)")
+            self._db.execute("DELETE FROM remap")
+            self._db.executemany("INSERT INTO remap VALUES (?, ?)",
+                                 [(int(old), new) for new, old in enumerate(live_rows)])
+            self._db.execute("UPDATE points SET row = (SELECT new FROM remap WHERE old = points.row)")
+            self._db.execute("UPDATE point_fields SET row = (SELECT new FROM remap WHERE old = point_fields.row)")
+            self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('generation', ?)", (generation,))
+            self._db.commit()
+            self._generation = generation
+            self._vectors = None
+            os.remove(old_path)  # Les mmap déjà ouverts restent valides
+            self.meta["ivf_rows"] = 0
+            self._save_meta()
+            self._open_vectors()
+        return freed
+
+    def describe(self) -> dict:
+        self._refresh()
+        vectors_bytes = self._count * (self.dim or 0) * self.dtype.itemsize
+        return {
+            "directory": self.directory,
+            "points": len(self),
+            "rows": self._count,
+            "dead_rows": self._count - len(self),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "vectors_mib": round(vectors_bytes / 2 ** 20, 2),
+            "ivf_lists": self.meta.get("ivf_lists") if self._ivf is not None else None,
+            "rows_after_ivf": self._count - self.meta["ivf_rows"] if self._ivf is not None else None,
+        }
+
+
+def import_from_qdrant(store: LocalVectorStore, collection_name: str, batch_size: int = 256) -> int:
+    """
+    Copie les points d'une collection Qdrant Cloud (vecteurs et payloads) dans la
+    base locale, sans ré-embedding.
+    """
+    from qdrant_client import QdrantClient
+
+    from config import QDRANT_API_KEY, QDRANT_CLOUD_URL
+    from qdrant_collection import _full_vector
+
+    client = QdrantClient(url=QDRANT_CLOUD_URL, api_key=QDRANT_API_KEY, timeout=60)
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(collection_name, limit=batch_size, offset=offset,
+                                       with_payload=True, with_vectors=True)
+        if points:
+            store.add_vectors(
+                [str(p.id) for p in points],
+                [_full_vector(p.vector) for p in points],
+                [p.payload.get("page_content", "") for p in points],
+                [p.payload.get("metadata") or {} for p in points],
+            )
+            copied += len(points)
+            print(f"   → {copied} points copiés")
+        if offset is None:
+            return copied
+
+
+def run_benchmark(args):
+    """
+    Recall@k et latence de la recherche exacte et de l'IVF (plusieurs nprobe),
+    requête par requête et par lots.
+    """
+    from qdrant_collection import _benchmark_vectors
+
+    # Dossier propre au benchmark (jamais --directory) : son contenu est effacé. Un dossier
+    # non vide sans marqueur de benchmark est refusé, pour ne pas détruire une vraie base.
+    directory = args.bench_directory
+    marker = os.path.join(directory, BENCHMARK_MARKER)
+    if os.path.isdir(directory) and os.listdir(directory):
+        if not os.path.exists(marker):
+            raise SystemExit(f"❌ {directory} n'est pas une base de benchmark : choisir un autre --bench-directory")
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+    os.makedirs(directory, exist_ok=True)
+    Path(marker).touch()
+
+    print("🔧 Chargement des vecteurs...")
+    ids, vectors, payloads = _benchmark_vectors(args)
+    store = LocalVectorStore(directory, dtype=args.dtype)
+    store.add_vectors([str(pid) for pid in ids], vectors, [p.get("page_content", "") for p in payloads],
+                      [p.get("metadata") or {} for p in payloads])
+    dim = vectors.shape[1]
+    rng = np.random.default_rng(args.seed)
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = _normalize(sample + rng.normal(0, args.noise / np.sqrt(dim), size=sample.shape))
+    print(f"✅ {len(ids)} points de dimension {dim} ({args.dtype}), {len(queries)} requêtes")
+
+    def measure(nprobe):
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results = store.search_vectors(query[None], args.k, nprobe=nprobe)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append([doc.metadata["_id"] for doc, _ in results])
+        return found, latencies
+
+    ground_truth, _ = measure(0)
+    results = {}
+    variants = [("exact", 0)]
+    if args.ivf_lists:
+        store.build_ivf(args.ivf_lists)
+        variants += [(f"ivf{args.ivf_lists}_nprobe{nprobe}", nprobe) for nprobe in args.nprobes]
+    for name, nprobe in variants:
+        measure(nprobe)  # Échauffement (pages du mmap, caches)
+        found, latencies = measure(nprobe)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, ground_truth) if t])
+        results[name] = {
+            "nprobe": nprobe,
+            "recall_at_k": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        }
+    start = time.perf_counter()
+    store.search_vectors(queries, args.k, nprobe=0)
+    batch_ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"\n{'Recherche':<22}{'recall@' + str(args.k):>10}{'p50 (ms)':>11}{'p95 (ms)':>11}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['recall_at_k']:>10.4f}{r['p50_ms']:>11.3f}{r['p95_ms']:>11.3f}")
+    print(f"Exacte par lot de {len(queries)} requêtes : {batch_ms_per_query:.3f} ms par requête")
+
+    from benchmark_fakes import git_revision, results_path, save_results
+
+    git = git_revision()
+    save_results({
+        "benchmark": "local_vectors",
+        "git": git,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"nb_points": len(ids), "dim": dim, "dtype": args.dtype, "nb_queries": len(queries),
+                   "k": args.k, "block_rows": SEARCH_BLOCK_ROWS},
+        "store": store.describe(),
+        "batch_exact_ms_per_query": round(batch_ms_per_query, 3),
+        "results": results,
+    }, results_path("local_vectors", git, args.output))
+    if not args.keep:
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        os.rmdir(directory)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Base vectorielle locale de LuXas")
+    parser.add_argument("--directory", default=None, help=f"Dossier de la base (défaut : {LOCAL_VECTOR_DIR})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("info", help="Taille et état de la base locale")
+    import_parser = subparsers.add_parser("import-qdrant", help="Copier une collection Qdrant Cloud")
+    import_parser.add_argument("--collection", default="rag_documents")
+    ivf_parser = subparsers.add_parser("build-ivf", help="Construire l'index IVF")
+    ivf_parser.add_argument("--lists", type=int, default=None, help="Nombre de listes (défaut : 4 x racine(n))")
+    subparsers.add_parser("compact", help="Supprimer les lignes mortes de la matrice des vecteurs")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Recall et latence exacte / IVF")
+    benchmark_parser.add_argument("--source-collection", default=None,
+                                  help="Copier les vecteurs d'une collection Qdrant Cloud (défaut : PDFs)")
+    benchmark_parser.add_argument("--pdf-folder", default="data")
+    benchmark_parser.add_argument("--dim", type=int, default=1536)
+    benchmark_parser.add_argument("--max-points", type=int, default=50000)
+    benchmark_parser.add_argument("--queries", type=int, default=200)
+    benchmark_parser.add_argument("--noise", type=float, default=0.5, help="Bruit relatif ajouté aux requêtes")
+    benchmark_parser.add_argument("--k", type=int, default=10)
+    benchmark_parser.add_argument("--dtype", default=LOCAL_VECTOR_DTYPE, choices=["float16", "float32"])
+    benchmark_parser.add_argument("--ivf-lists", type=int, default=16, help="0 = ne pas mesurer l'IVF")
+    benchmark_parser.add_argument("--nprobes", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8])
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    benchmark_parser.add_argument("--bench-directory", default=os.path.join(RESULTS_DIR, "local_vectors_benchmark"),
+                                  help="Dossier de la base de benchmark, effacé à chaque exécution")
+    benchmark_parser.add_argument("--keep", action="store_true", help="Garder la base de benchmark")
+    benchmark_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "benchmark":
+        run_benchmark(args)
+        return
+
+    store = LocalVectorStore(args.directory or LOCAL_VECTOR_DIR)
+    if args.command == "import-qdrant":
+        print(f"📥 Import de '{args.collection}' depuis Qdrant Cloud...")
+        print(f"✅ {import_from_qdrant(store, args.collection)} points importés")
+    elif args.command == "build-ivf":
+        print(f"✅ Index IVF : {store.build_ivf(args.lists)} listes")
+    elif args.command == "compact":
+        print(f"✅ {store.compact()} lignes libérées")
+    print(json.dumps(store.describe(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
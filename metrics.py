@@ -0,0 +1,318 @@
+"""
+Instrumentation des étapes du RAG et des indexeurs.
+
+Chaque étape est mesurée avec `stage(...)` :
+
+    with stage("generation", input={...}) as s:
+        ...
+        s.record(prompt_tokens=..., completion_tokens=...)
+
+- Métriques locales (sans identifiants Langfuse) : histogramme des durées par étape,
+  compteurs des quantités qui s'accumulent (COUNTED_VALUES : tokens consommés, retries...)
+  et histogrammes des tailles (chunks retenus, tokens du contexte...), au format texte
+  Prometheus. Exposées dans un fichier (METRICS_FILE), sur un port HTTP (METRICS_PORT,
+  route /metrics) et par l'API (GET /metrics).
+- Langfuse : un span par étape (durée et valeurs en sortie), si les clés sont définies.
+
+Si les métriques sont désactivées (METRICS_ENABLED=false) et Langfuse non configuré,
+`stage()` ne fait que mesurer la durée (pour les logs) : ni verrou, ni span.
+"""
+
+import atexit
+import contextlib
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+import tiktoken
+
+# Configuration
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_FILE = os.getenv("METRICS_FILE")  # ex: "metrics.prom" (lu par le textfile collector)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = pas de serveur HTTP
+METRICS_FLUSH_INTERVAL = 15.0  # Secondes entre deux écritures de METRICS_FILE
+LANGFUSE_ENABLED = (
+    bool(os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"))
+    and os.getenv("LANGFUSE_TRACING_ENABLED", "true").lower() != "false"
+)
+
+METRIC_PREFIX = "luxas"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Valeurs enregistrées qui s'accumulent (compteurs luxas_<valeur>_total) ; les autres
+# valeurs numériques sont des tailles par appel (histogrammes luxas_<valeur>)
+COUNTED_VALUES = frozenset({
+    "prompt_tokens", "completion_tokens", "embedding_tokens", "messages", "pdfs", "pages",
+    "retries", "splits", "fallbacks", "filtered_searches", "cache_hits",
+})
+
+
+class MetricsRegistry:
+    """
+    Compteurs et histogrammes étiquetés, rendus au format texte Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], list] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, help_text: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            self._help.setdefault(name, help_text)
+
+    def observe(self, name: str, value: float, help_text: str = "",
+                buckets: Tuple[float, ...] = DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0, buckets]
+                self._help.setdefault(name, help_text)
+            histogram[0][bisect_left(histogram[3], value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def _labels(labels: Iterable[Tuple[str, str]], extra: str = "") -> str:
+        parts = [f'{key}="{value}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """
+        Exposition texte Prometheus de toutes les métriques.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2], h[3]) for key, h in self._histograms.items()}
+            help_texts = dict(self._help)
+
+        lines = []
+        for metric_name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {metric_name} {help_texts.get(metric_name, '')}")
+            lines.append(f"# TYPE {metric_name} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric_name:
+                    lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for metric_name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {metric_name} {help_texts.get(metric_name, '')}")
+            lines.append(f"# TYPE {metric_name} histogram")
+            for (name, labels), (buckets, total, count, bounds) in sorted(histograms.items()):
+                if name != metric_name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(bounds, buckets):
+                    cumulative += bucket_count
+                    bucket_labels = self._labels(labels, 'le="%g"' % bound)
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                inf_labels = self._labels(labels, 'le="+Inf"')
+                lines.append(f"{name}_bucket{inf_labels} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class _Stage:
+    """
+    Mesure d'une étape : durée, valeurs enregistrées, span Langfuse optionnel.
+    """
+
+    __slots__ = ("name", "input", "trace", "values", "duration_ms", "_start", "_paused", "_span_cm", "_span")
+
+    def __init__(self, name: str, input: Optional[dict], trace: bool):
+        self.name = name
+        self.input = input
+        self.trace = trace and LANGFUSE_ENABLED
+        self.values = {}
+        self.duration_ms = 0.0
+        self._paused = 0.0
+        self._span_cm = None
+        self._span = None
+
+    def __enter__(self):
+        if self.trace:
+            from langfuse import get_client
+            self._span_cm = get_client().start_as_current_observation(name=self.name, input=self.input)
+            self._span = self._span_cm.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def record(self, **values):
+        """
+        Ajoute des valeurs à l'étape (les valeurs numériques alimentent les compteurs
+        ou les histogrammes de tailles, voir COUNTED_VALUES).
+        """
+        self.values.update(values)
+
+    @contextlib.contextmanager
+    def paused(self):
+        """
+        Exclut de la durée de l'étape le temps passé dans le bloc (ex: un yield, où le
+        consommateur d'un flux a la main).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._paused += time.perf_counter() - start
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start - self._paused
+        self.duration_ms = elapsed * 1000
+        if METRICS_ENABLED:
+            registry.observe(f"{METRIC_PREFIX}_stage_duration_seconds", elapsed,
+                             "Durée des étapes du RAG et des indexeurs", stage=self.name)
+            for key, value in self.values.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool) or key.endswith("_ms"):
+                    continue
+                if key in COUNTED_VALUES:
+                    registry.inc(f"{METRIC_PREFIX}_{key}_total", value, f"Somme de {key} par étape", stage=self.name)
+                else:
+                    registry.observe(f"{METRIC_PREFIX}_{key}", value, f"Distribution de {key} par appel",
+                                     buckets=SIZE_BUCKETS, stage=self.name)
+            if exc_type is not None:
+                registry.inc(f"{METRIC_PREFIX}_stage_errors_total", 1, "Étapes terminées en erreur", stage=self.name)
+        if self._span is not None:
+            self._span.update(output={**self.values, "duration_ms": round(self.duration_ms, 3)})
+            self._span_cm.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _TimerStage:
+    """
+    Étape réduite à sa durée, utilisée quand métriques et Langfuse sont désactivés.
+    """
+
+    __slots__ = ("duration_ms", "_start", "_paused")
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._paused = 0.0
+        return self
+
+    def record(self, **values):
+        pass
+
+    paused = _Stage.paused
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start - self._paused) * 1000
+        return False
+
+
+def stage(name: str, input: Optional[dict] = None, trace: bool = True):
+    """
+    Mesure une étape (context manager).
+
+    Args:
+        name: Nom de l'étape (label "stage" des métriques, nom du span Langfuse)
+        input: Entrée enregistrée dans le span Langfuse
+        trace: False pour ne produire que les métriques locales (ex: indexeurs)
+    """
+    if not METRICS_ENABLED and not (trace and LANGFUSE_ENABLED):
+        return _TimerStage()
+    return _Stage(name, input, trace)
+
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Nombre de tokens d'un texte (cl100k_base ; ~4 caractères par token si
+    l'encodage n'est pas disponible, par exemple hors ligne).
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encoding = False
+    if _encoding is False:
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def usage_tokens(message) -> Tuple[int, int]:
+    """
+    Tokens (prompt, complétion) rapportés par l'API dans un message LangChain, (0, 0) sinon.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+
+def write_metrics_file(path: Optional[str] = None):
+    """
+    Écrit les métriques de façon atomique (fichier temporaire puis renommage).
+    """
+    path = path or METRICS_FILE
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    """
+    Démarre (une seule fois par processus) l'écriture périodique de METRICS_FILE
+    et le serveur HTTP METRICS_PORT, s'ils sont configurés.
+    """
+    global _exporters_started
+    if not METRICS_ENABLED:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    if METRICS_FILE:
+        def flush_periodically():
+            while True:
+                time.sleep(METRICS_FLUSH_INTERVAL)
+                write_metrics_file()
+
+        threading.Thread(target=flush_periodically, name="metrics_file", daemon=True).start()
+        atexit.register(write_metrics_file)
+        print(f"📈 Métriques écrites dans {METRICS_FILE}")
+
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics_http", daemon=True).start()
+        print(f"📈 Métriques exposées sur http://0.0.0.0:{METRICS_PORT}/metrics")
@@ -0,0 +1,227 @@
+"""
+Cache colonnaire du texte extrait des PDFs (une ligne par page).
+
+L'extraction par PyPDFLoader est l'étape CPU la plus lente de l'indexation, et son
+résultat ne dépend que du contenu du fichier. Les pages sont donc stockées une fois
+dans des fichiers Parquet compressés (zstd), indexées par (hash SHA-256 du PDF,
+numéro de page) : changer CHUNK_SIZE, CHUNK_OVERLAP ou les séparateurs ne demande
+plus qu'une relecture du cache.
+
+- chaque mise à jour ajoute un fichier part-*.parquet (rien n'est réécrit) ; au-delà
+  de PAGE_CACHE_MAX_PARTS fichiers, ils sont fusionnés en un seul
+- les lectures passent par pl.scan_parquet : seules les colonnes utiles sont lues, et
+  le filtre sur file_hash écarte les row groups (chaque fichier est trié par hash)
+- un PDF sans page est enregistré par une ligne sans texte (il n'est pas ré-extrait)
+
+Usage :
+    python page_cache.py build      # Extraire les PDFs de db_local_pdfs/ absents du cache
+    python page_cache.py info
+    python page_cache.py compact    # Fusionner et oublier les PDFs retirés du dossier
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import polars as pl
+
+# Configuration
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "page_cache")
+PAGE_CACHE_MAX_PARTS = 16     # Fichiers Parquet avant fusion
+PAGE_CACHE_ROW_GROUP = 4096   # Pages par row group
+PAGE_CACHE_COMPRESSION = "zstd"
+
+SCHEMA = {
+    "file_hash": pl.Utf8,
+    "source": pl.Utf8,      # Nom du PDF lors de l'extraction (information)
+    "page": pl.Int32,       # None : PDF sans page
+    "text": pl.Utf8,
+    "metadata": pl.Utf8,    # Métadonnées PyPDFLoader de la page, en JSON
+}
+
+
+class PageCache:
+    """
+    Pages extraites des PDFs, stockées dans un dossier de fichiers Parquet.
+    """
+
+    def __init__(self, directory: str = PAGE_CACHE_DIR):
+        self.directory = directory
+        self._hashes: Optional[Set[str]] = None
+
+    def _parts(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, filename)
+            for filename in os.listdir(self.directory)
+            if filename.endswith(".parquet")
+        )
+
+    def _scan(self) -> pl.LazyFrame:
+        parts = self._parts()
+        if not parts:
+            return pl.LazyFrame(schema=SCHEMA)
+        return pl.scan_parquet(parts)
+
+    def _write(self, df: pl.DataFrame) -> str:
+        """
+        Écrit un fichier Parquet de façon atomique (fichier temporaire puis renommage).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"part-{time.time_ns()}.parquet")
+        tmp_path = f"{path}.tmp"
+        df.sort(["file_hash", "page"], nulls_last=True).write_parquet(
+            tmp_path,
+            compression=PAGE_CACHE_COMPRESSION,
+            row_group_size=PAGE_CACHE_ROW_GROUP,
+            statistics=True
+        )
+        os.replace(tmp_path, path)
+        return path
+
+    def cached_hashes(self) -> Set[str]:
+        """
+        Hashes des PDFs présents dans le cache (seule la colonne file_hash est lue).
+        """
+        if self._hashes is None:
+            self._hashes = set(
+                self._scan().select("file_hash").unique().collect().get_column("file_hash").to_list()
+            )
+        return self._hashes
+
+    def add(self, extracted: Iterable[Tuple[str, str, List[Dict]]]) -> int:
+        """
+        Ajoute les pages de PDFs nouvellement extraits.
+
+        Args:
+            extracted: [(hash du fichier, nom du PDF, pages [{"page_content", "metadata"}])]
+
+        Returns:
+            int: Nombre de pages ajoutées
+        """
+        cached = self.cached_hashes()
+        rows = {name: [] for name in SCHEMA}
+        added = set()
+        for file_hash, source, pages in extracted:
+            if file_hash in cached or file_hash in added:
+                continue
+            added.add(file_hash)
+            for page_num, page in enumerate(pages or [None]):
+                rows["file_hash"].append(file_hash)
+                rows["source"].append(source)
+                rows["page"].append(page_num if page is not None else None)
+                rows["text"].append(page["page_content"] if page is not None else None)
+                rows["metadata"].append(json.dumps(page["metadata"], ensure_ascii=False, default=str)
+                                        if page is not None else None)
+        if not added:
+            return 0
+
+        self._write(pl.DataFrame(rows, schema=SCHEMA))
+        cached.update(added)
+        if len(self._parts()) > PAGE_CACHE_MAX_PARTS:
+            self.compact()
+        return sum(1 for text in rows["text"] if text is not None)
+
+    def read_pages(self, file_hashes: Iterable[str]) -> Dict[str, List[Dict]]:
+        """
+        Relit les pages d'un ensemble de PDFs, dans l'ordre des pages.
+
+        Returns:
+            dict: {hash: [{"page_content", "metadata"}]} (PDFs absents du cache omis)
+        """
+        df = (
+            self._scan()
+            .filter(pl.col("file_hash").is_in(list(set(file_hashes))))
+            .select(["file_hash", "page", "text", "metadata"])
+            .unique(subset=["file_hash", "page"], keep="first")
+            .sort(["file_hash", "page"], nulls_last=True)
+            .collect()
+        )
+        pages: Dict[str, List[Dict]] = {}
+        for file_hash, text, metadata in zip(df["file_hash"], df["text"], df["metadata"]):
+            file_pages = pages.setdefault(file_hash, [])
+            if text is not None:
+                file_pages.append({"page_content": text, "metadata": json.loads(metadata)})
+        return pages
+
+    def compact(self, keep_hashes: Optional[Set[str]] = None) -> int:
+        """
+        Fusionne tous les fichiers en un seul, en retirant les doublons.
+
+        Args:
+            keep_hashes: Si fourni, seuls ces PDFs sont conservés
+
+        Returns:
+            int: Nombre de lignes supprimées
+        """
+        parts = self._parts()
+        if not parts:
+            return 0
+        df = pl.read_parquet(parts)
+        before = df.height
+        if keep_hashes is not None:
+            df = df.filter(pl.col("file_hash").is_in(list(keep_hashes)))
+        df = df.unique(subset=["file_hash", "page"], keep="first")
+        self._write(df)
+        for part in parts:
+            os.remove(part)
+        self._hashes = None
+        return before - df.height
+
+    def describe(self) -> Dict:
+        """
+        Taille et contenu du cache.
+        """
+        parts = self._parts()
+        stats = self._scan().select(
+            pl.col("file_hash").n_unique().alias("pdfs"),
+            pl.col("text").is_not_null().sum().alias("pages"),
+            pl.col("text").str.len_bytes().sum().alias("text_bytes"),
+        ).collect().row(0, named=True)
+        return {
+            "directory": self.directory,
+            "files": len(parts),
+            "pdfs": stats["pdfs"],
+            "pages": stats["pages"],
+            "text_mib": round((stats["text_bytes"] or 0) / 2 ** 20, 1),
+            "disk_mib": round(sum(os.path.getsize(part) for part in parts) / 2 ** 20, 1),
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Cache des pages extraites des PDFs")
+    parser.add_argument("--directory", default=PAGE_CACHE_DIR)
+    parser.add_argument("--pdf-folder", default="db_local_pdfs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("info", help="Taille et contenu du cache")
+    build_parser = subparsers.add_parser("build", help="Extraire les PDFs absents du cache")
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    subparsers.add_parser("compact", help="Fusionner les fichiers et oublier les PDFs retirés du dossier")
+
+    args = parser.parse_args(argv)
+    cache = PageCache(args.directory)
+    pdf_files = sorted(Path(args.pdf_folder).glob("*.pdf"))
+
+    if args.command == "build":
+        from pdf_processing import extract_missing_pages
+
+        start = time.perf_counter()
+        errors = extract_missing_pages(cache, pdf_files, num_workers=args.workers)
+        print(f"✅ Extraction terminée en {time.perf_counter() - start:.1f}s ({len(errors)} erreurs)")
+        for pdf_path, error in list(errors.items())[:10]:
+            print(f"   - {pdf_path} : {error}")
+    elif args.command == "compact":
+        from index_manifest import file_sha256
+
+        removed = cache.compact({file_sha256(pdf_file) for pdf_file in pdf_files})
+        print(f"✅ {removed} lignes supprimées")
+    print(json.dumps(cache.describe(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Étape de parsing et de découpage des PDFs, parallélisée sur plusieurs processus.
+
+Les workers reçoivent des chemins de fichiers et renvoient des chunks sérialisés
+(dictionnaires simples, moins coûteux à transférer entre processus que des Document).
+Les résultats sont restitués dans l'ordre des fichiers soumis : deux exécutions
+sur le même dossier produisent donc exactement les mêmes chunks.
+
+Avec un cache de pages (page_cache.py), seuls les PDFs absents du cache passent par
+PyPDFLoader ; le découpage repart des pages stockées.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from index_manifest import file_sha256
+from legal_metadata import METADATA_VERSION, annotate_articles, extract_document_metadata, filter_fields
+from legislative_splitter import LEGISLATIVE_CHUNK_SIZE, LegislativeTextSplitter
+from metrics import stage
+from page_cache import PageCache
+
+# Configuration
+DEFAULT_NUM_WORKERS = os.cpu_count() or 1
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+# "recursive" (taille fixe avec chevauchement) ou "legislative" (un chunk par article, voir legislative_splitter.py)
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "recursive")
+CACHE_GROUP_FILES = 256  # PDFs extraits puis relus du cache en une fois
+
+# Splitter propre à chaque processus worker (créé une seule fois par _init_worker)
+_text_splitter = None
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int, strategy: str = CHUNK_STRATEGY):
+    """
+    Initialise le text splitter dans le processus worker.
+
+    Le découpage structurel ignore chunk_size et chunk_overlap : ses chunks, sans
+    chevauchement, vont jusqu'à LEGISLATIVE_CHUNK_SIZE caractères.
+    """
+    global _text_splitter
+    if strategy == "legislative":
+        _text_splitter = LegislativeTextSplitter(LEGISLATIVE_CHUNK_SIZE)
+        return
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    _text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=SEPARATORS
+    )
+
+
+def chunking_config(chunk_size: int, chunk_overlap: int, strategy: str = CHUNK_STRATEGY) -> Dict:
+    """
+    Paramètres qui déterminent les chunks produits, enregistrés dans le manifeste
+    d'indexation : un changement entraîne la ré-indexation de tous les PDFs.
+    """
+    if strategy == "legislative":
+        sizes = {"chunk_size": LEGISLATIVE_CHUNK_SIZE}
+    else:
+        sizes = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    return {"strategy": strategy, **sizes, "metadata_version": METADATA_VERSION}
+
+
+def load_pdf_pages(pdf_path: str) -> Tuple[str, List[Dict], Optional[str]]:
+    """
+    Extrait le texte de chaque page d'un PDF (exécuté dans un worker).
+
+    Returns:
+        tuple: (chemin, pages sérialisées [{"page_content", "metadata"}], erreur ou None)
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    try:
+        docs = PyPDFLoader(pdf_path).load()
+        return pdf_path, [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs], None
+    except Exception as e:
+        return pdf_path, [], f"{type(e).__name__}: {e}"
+
+
+def chunk_pages(pdf_path: str, pages: List[Dict]) -> Tuple[str, List[Dict], Optional[str]]:
+    """
+    Découpe les pages d'un PDF en chunks (exécuté dans un worker).
+
+    Args:
+        pdf_path: Chemin du fichier PDF
+        pages: Pages sérialisées, issues de load_pdf_pages ou du cache
+
+    Returns:
+        tuple: (chemin, chunks sérialisés [{"page_content", "metadata"}], erreur ou None)
+    """
+    try:
+        docs = deserialize_chunks(pages)
+
+        # Ajouter les métadonnées (source, puis législature, numéro, dépôt, auteurs)
+        document_metadata = extract_document_metadata(Path(pdf_path).name, docs[0].page_content) if docs else {}
+        for doc in docs:
+            doc.metadata["source"] = Path(pdf_path).name
+            doc.metadata.update(document_metadata)
+
+        chunks = _text_splitter.split_documents(docs)
+        if not isinstance(_text_splitter, LegislativeTextSplitter):
+            annotate_articles(chunks)  # Le découpage structurel renseigne déjà les articles
+        for chunk in chunks:
+            chunk.metadata.update(filter_fields([chunk.metadata]))
+        return pdf_path, [
+            {"page_content": chunk.page_content, "metadata": chunk.metadata}
+            for chunk in chunks
+        ], None
+    except Exception as e:
+        return pdf_path, [], f"{type(e).__name__}: {e}"
+
+
+def parse_and_chunk_pdf(pdf_path: str) -> Tuple[str, List[Dict], Optional[str]]:
+    """
+    Charge un PDF et le découpe en chunks (exécuté dans un worker).
+
+    Args:
+        pdf_path: Chemin du fichier PDF
+
+    Returns:
+        tuple: (chemin, chunks sérialisés [{"page_content", "metadata"}], erreur ou None)
+    """
+    pdf_path, pages, error = load_pdf_pages(pdf_path)
+    if error is not None:
+        return pdf_path, [], error
+    return chunk_pages(pdf_path, pages)
+
+
+def deserialize_chunks(serialized_chunks: List[Dict]) -> List[Document]:
+    """
+    Reconstruit les Document LangChain à partir des chunks renvoyés par un worker.
+    """
+    return [
+        Document(page_content=chunk["page_content"], metadata=chunk["metadata"])
+        for chunk in serialized_chunks
+    ]
+
+
+def _ordered_results(executor, fn: Callable, tasks: Iterable[Tuple], max_in_flight: int) -> Iterator:
+    """
+    Applique fn à chaque tâche dans le pool (ou dans le processus courant si executor
+    est None) et restitue les résultats dans l'ordre, avec au plus max_in_flight en attente.
+    """
+    if executor is None:
+        for task in tasks:
+            yield fn(*task)
+        return
+
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, *task))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _extract_into_cache(executor, page_cache: PageCache, paths: List[str], hashes: Dict[str, str],
+                        max_in_flight: int) -> Dict[str, str]:
+    """
+    Extrait les PDFs absents du cache et les y ajoute (par groupes de CACHE_GROUP_FILES).
+
+    Returns:
+        dict: {chemin: erreur} des PDFs dont l'extraction a échoué
+    """
+    cached = page_cache.cached_hashes()
+    missing = {}
+    for path in paths:
+        if hashes[path] not in cached:
+            missing.setdefault(hashes[path], path)
+
+    hash_errors = {}
+    if missing:
+        with stage("pdf_extraction", trace=False) as s:
+            extracted = []
+            nb_pages = 0
+            for pdf_path, pages, error in _ordered_results(
+                executor, load_pdf_pages, ((path,) for path in missing.values()), max_in_flight
+            ):
+                if error is not None:
+                    hash_errors[hashes[pdf_path]] = error
+                    continue
+                extracted.append((hashes[pdf_path], Path(pdf_path).name, pages))
+                nb_pages += len(pages)
+                if len(extracted) >= CACHE_GROUP_FILES:
+                    page_cache.add(extracted)
+                    extracted = []
+            page_cache.add(extracted)
+            s.record(pdfs=len(missing), pages=nb_pages)
+    return {path: hash_errors[hashes[path]] for path in paths if hashes[path] in hash_errors}
+
+
+def _file_hashes(paths: List[str], file_hashes: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """
+    Hash de chaque fichier, repris de file_hashes ({nom: hash}) quand il y figure.
+    """
+    file_hashes = file_hashes or {}
+    return {path: file_hashes.get(Path(path).name) or file_sha256(Path(path)) for path in paths}
+
+
+def extract_missing_pages(
+    page_cache: PageCache,
+    pdf_files: Iterable[Path],
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    file_hashes: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """
+    Remplit le cache de pages avec les PDFs qui n'y sont pas encore, sans les découper.
+
+    Returns:
+        dict: {chemin: erreur} des PDFs dont l'extraction a échoué
+    """
+    paths = [str(pdf_file) for pdf_file in pdf_files]
+    hashes = _file_hashes(paths, file_hashes)
+    with ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else nullcontext() as executor:
+        return _extract_into_cache(executor, page_cache, paths, hashes, num_workers * 4)
+
+
+def _iter_cached_pdfs(executor, page_cache: PageCache, paths: List[str],
+                      file_hashes: Optional[Dict[str, str]], max_in_flight: int):
+    """
+    Découpe les PDFs à partir du cache de pages, par groupes de CACHE_GROUP_FILES :
+    les PDFs absents sont d'abord extraits, puis les pages du groupe sont relues en une requête.
+    """
+    for group_start in range(0, len(paths), CACHE_GROUP_FILES):
+        group = paths[group_start:group_start + CACHE_GROUP_FILES]
+        hashes = _file_hashes(group, file_hashes)
+        errors = _extract_into_cache(executor, page_cache, group, hashes, max_in_flight)
+
+        with stage("page_cache_read", trace=False) as s:
+            pages = page_cache.read_pages(hashes[path] for path in group if path not in errors)
+            s.record(pdfs=len(pages), pages=sum(len(file_pages) for file_pages in pages.values()))
+
+        results = _ordered_results(
+            executor, chunk_pages,
+            ((path, pages.get(hashes[path], [])) for path in group if path not in errors),
+            max_in_flight
+        )
+        for path in group:
+            yield (path, [], errors[path]) if path in errors else next(results)
+
+
+def iter_parsed_pdfs(
+    pdf_files: Iterable[Path],
+    chunk_size: int,
+    chunk_overlap: int,
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    max_in_flight: Optional[int] = None,
+    page_cache: Optional[PageCache] = None,
+    file_hashes: Optional[Dict[str, str]] = None
+) -> Iterator[Tuple[str, List[Dict], Optional[str]]]:
+    """
+    Parse et découpe les PDFs en parallèle, en restituant les résultats dans l'ordre.
+
+    Le nombre de fichiers en cours de traitement est borné pour que les workers
+    ne prennent pas trop d'avance sur l'upload (mémoire maîtrisée).
+
+    Args:
+        pdf_files: Fichiers PDF à traiter (l'ordre est conservé)
+        chunk_size: Taille des chunks
+        chunk_overlap: Chevauchement entre chunks
+        num_workers: Nombre de processus (1 = traitement dans le processus courant)
+        max_in_flight: Nombre maximal de fichiers soumis non encore consommés
+        page_cache: Cache des pages extraites (None = PyPDFLoader sur chaque PDF)
+        file_hashes: {nom du PDF: hash} déjà calculés (manifeste), pour le cache
+
+    Yields:
+        tuple: (chemin, chunks sérialisés, erreur ou None) pour chaque PDF
+    """
+    paths = [str(pdf_file) for pdf_file in pdf_files]
+    max_in_flight = max_in_flight or num_workers * 4
+
+    if num_workers <= 1:
+        _init_worker(chunk_size, chunk_overlap)
+        executor_context = nullcontext()
+    else:
+        executor_context = ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(chunk_size, chunk_overlap)
+        )
+
+    with executor_context as executor:
+        if page_cache is not None:
+            yield from _iter_cached_pdfs(executor, page_cache, paths, file_hashes, max_in_flight)
+        else:
+            yield from _ordered_results(executor, parse_and_chunk_pdf, ((path,) for path in paths), max_in_flight)
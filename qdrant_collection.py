@@ -0,0 +1,640 @@
+"""
+Gestion de la collection Qdrant : mise en page optimisée, migration, benchmark.
+
+Mise en page (configurable par variables d'environnement) :
+- quantization scalaire (int8) ou binaire, gardée en RAM, avec rescoring sur les
+  vecteurs originaux (sur disque) au moment de la recherche
+- HNSW : m et ef_construct ; ef de recherche
+- vecteurs et payload sur disque
+- index keyword sur la source des chunks (filtres par document)
+- option deux étapes (QDRANT_REDUCED_DIM, ex: 256) : le vecteur de recherche est le
+  début renormalisé de l'embedding (text-embedding-3-small est entraîné pour que ses
+  premières dimensions restent utilisables seules) ; le vecteur complet, sur disque
+  et sans graphe HNSW, ne sert qu'à rescorer exactement les meilleurs candidats
+
+Commandes :
+    python qdrant_collection.py info                       # Mise en page actuelle
+    python qdrant_collection.py apply                      # Appliquer en place (réindexation côté serveur)
+    python qdrant_collection.py migrate --swap             # Copier vers une nouvelle collection, sans ré-embedding
+    python qdrant_collection.py migrate --swap --reduced-dim 256   # Passer en recherche deux étapes
+    python qdrant_collection.py benchmark --url http://localhost:6333
+
+Le benchmark compare recall@k et latence (p50/p95) entre la mise en page par
+défaut et la mise en page optimisée, sur une instance Qdrant locale
+(docker run -p 6333:6333 qdrant/qdrant), ainsi que la recherche deux étapes pour
+plusieurs nombres de candidats (courbe recall / latence). Les vecteurs viennent des
+PDFs de data/ (embeddings hors ligne de benchmark_fakes.py, dont les premières
+dimensions ne résument pas le vecteur : recall deux étapes pessimiste) ou, pour des
+chiffres représentatifs, d'une collection existante (--source-collection).
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient, models
+
+# Configuration
+COLLECTION_NAME = "rag_documents"
+VECTOR_SIZE = 1536  # text-embedding-3-small
+QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "scalar")  # "scalar", "binary" ou "none"
+HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "128"))
+SEARCH_HNSW_EF = int(os.getenv("QDRANT_SEARCH_EF", "128"))
+RESCORE_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))  # Candidats quantizés lus par résultat
+ON_DISK = os.getenv("QDRANT_ON_DISK", "true").lower() == "true"
+PAYLOAD_INDEXES = {
+    "metadata.source": models.PayloadSchemaType.KEYWORD,
+    "metadata.sources": models.PayloadSchemaType.KEYWORD,
+    # Métadonnées des propositions de loi (legal_metadata.filter_fields), filtrées à la requête
+    "metadata.legislatures": models.PayloadSchemaType.INTEGER,
+    "metadata.bill_numbers": models.PayloadSchemaType.INTEGER,
+    "metadata.deposit_dates": models.PayloadSchemaType.DATETIME,
+    "metadata.all_author_surnames": models.PayloadSchemaType.KEYWORD,
+    "metadata.bill_articles": models.PayloadSchemaType.KEYWORD,
+}
+REDUCED_DIM = int(os.getenv("QDRANT_REDUCED_DIM", "0"))  # 0 = un seul vecteur complet
+PREFETCH_FACTOR = int(os.getenv("QDRANT_PREFETCH_FACTOR", "4"))  # Candidats réduits rescorés par résultat
+SMALL_VECTOR = "small"
+FULL_VECTOR = "full"
+MIGRATION_BATCH_SIZE = 256
+
+
+def quantization_config(mode: str = QUANTIZATION):
+    """
+    Configuration de quantization Qdrant (None si désactivée).
+    """
+    if mode == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if mode == "none":
+        return None
+    raise ValueError(f"Quantization inconnue : {mode} (scalar, binary ou none)")
+
+
+def search_params(mode: str = QUANTIZATION) -> models.SearchParams:
+    """
+    Paramètres de recherche associés à la mise en page : ef HNSW et, avec
+    quantization, rescoring des candidats sur les vecteurs originaux.
+    """
+    if mode == "none":
+        return models.SearchParams(hnsw_ef=SEARCH_HNSW_EF)
+    return models.SearchParams(
+        hnsw_ef=SEARCH_HNSW_EF,
+        quantization=models.QuantizationSearchParams(rescore=True, oversampling=RESCORE_OVERSAMPLING)
+    )
+
+
+def reduce_vector(vector, dim: int) -> List[float]:
+    """
+    Premières `dim` dimensions d'un embedding, renormalisées (norme 1).
+    """
+    reduced = np.asarray(vector[:dim], dtype=np.float32)
+    norm = np.linalg.norm(reduced)
+    return (reduced / norm if norm else reduced).tolist()
+
+
+def point_vectors(vector, reduced_dim: int = 0):
+    """
+    Vecteur(s) d'un point selon la mise en page : vecteur unique, ou vecteur réduit
+    de recherche + vecteur complet de rescoring.
+    """
+    if not reduced_dim:
+        return vector
+    return {SMALL_VECTOR: reduce_vector(vector, reduced_dim), FULL_VECTOR: list(vector)}
+
+
+def collection_reduced_dim(client: QdrantClient, collection_name: str = COLLECTION_NAME) -> int:
+    """
+    Dimension du vecteur de recherche réduit (0 si la collection n'a qu'un vecteur).
+    """
+    vectors = client.get_collection(collection_name).config.params.vectors
+    if isinstance(vectors, dict) and SMALL_VECTOR in vectors and FULL_VECTOR in vectors:
+        return vectors[SMALL_VECTOR].size
+    return 0
+
+
+def query_arguments(query_vector: List[float], k: int, reduced_dim: int = 0,
+                    params: Optional[models.SearchParams] = None,
+                    prefetch_factor: int = PREFETCH_FACTOR,
+                    query_filter: Optional[models.Filter] = None) -> dict:
+    """
+    Arguments de `query_points` : recherche simple, ou recherche deux étapes
+    (k * prefetch_factor candidats sur le vecteur réduit, rescorés exactement sur
+    le vecteur complet). Le filtre s'applique dès la première étape.
+    """
+    if not reduced_dim:
+        return {"query": query_vector, "query_filter": query_filter, "search_params": params, "limit": k}
+    return {
+        "prefetch": models.Prefetch(
+            query=reduce_vector(query_vector, reduced_dim),
+            using=SMALL_VECTOR,
+            filter=query_filter,
+            limit=k * prefetch_factor,
+            params=params,
+        ),
+        "query": query_vector,
+        "using": FULL_VECTOR,
+        "query_filter": query_filter,
+        "limit": k,
+    }
+
+
+def query_request(query_vector: List[float], k: int, reduced_dim: int = 0,
+                  params: Optional[models.SearchParams] = None,
+                  query_filter: Optional[models.Filter] = None) -> models.QueryRequest:
+    """
+    Même recherche que query_arguments, sous forme de requête de `query_batch_points`
+    (plusieurs recherches en un seul appel).
+    """
+    arguments = query_arguments(query_vector, k, reduced_dim, params, query_filter=query_filter)
+    arguments["filter"] = arguments.pop("query_filter")
+    if "search_params" in arguments:
+        arguments["params"] = arguments.pop("search_params")
+    return models.QueryRequest(with_payload=True, **arguments)
+
+
+def create_collection(client: QdrantClient, collection_name: str = COLLECTION_NAME,
+                      vector_size: int = VECTOR_SIZE, mode: str = QUANTIZATION, on_disk: bool = ON_DISK,
+                      optimizers_config: Optional[models.OptimizersConfigDiff] = None,
+                      reduced_dim: int = REDUCED_DIM):
+    """
+    Crée une collection avec la mise en page optimisée et ses index de payload.
+
+    Avec reduced_dim, la quantization et le graphe HNSW ne portent que sur le
+    vecteur réduit ; le vecteur complet reste sur disque pour le rescoring.
+    """
+    if reduced_dim:
+        vectors_config = {
+            SMALL_VECTOR: models.VectorParams(
+                size=reduced_dim, distance=models.Distance.COSINE, quantization_config=quantization_config(mode)
+            ),
+            FULL_VECTOR: models.VectorParams(
+                size=vector_size, distance=models.Distance.COSINE, on_disk=True,
+                hnsw_config=models.HnswConfigDiff(m=0)
+            ),
+        }
+        collection_quantization = None
+    else:
+        vectors_config = models.VectorParams(size=vector_size, distance=models.Distance.COSINE, on_disk=on_disk)
+        collection_quantization = quantization_config(mode)
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config,
+        hnsw_config=models.HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+        quantization_config=collection_quantization,
+        on_disk_payload=on_disk,
+        optimizers_config=optimizers_config,
+    )
+    ensure_payload_indexes(client, collection_name)
+
+
+class TwoStageQdrantVectorStore(QdrantVectorStore):
+    """
+    QdrantVectorStore pour les collections à deux vecteurs : écrit le vecteur
+    réduit et le vecteur complet, recherche en deux étapes (query_arguments).
+    """
+
+    def __init__(self, client: QdrantClient, collection_name: str, embedding: Embeddings, reduced_dim: int):
+        super().__init__(client=client, collection_name=collection_name, embedding=embedding,
+                         vector_name=FULL_VECTOR, validate_collection_config=False)
+        self.reduced_dim = reduced_dim
+
+    def _build_vectors(self, texts) -> list:
+        return [point_vectors(vector, self.reduced_dim) for vector in self.embeddings.embed_documents(list(texts))]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[models.Filter] = None,
+                                               search_params: Optional[models.SearchParams] = None,
+                                               **kwargs: Any) -> List[tuple]:
+        points = self.client.query_points(
+            collection_name=self.collection_name,
+            with_payload=True,
+            **query_arguments(embedding, k, self.reduced_dim, search_params, query_filter=filter),
+            **kwargs,
+        ).points
+        return [
+            (self._document_from_point(point, self.collection_name, self.content_payload_key,
+                                       self.metadata_payload_key), point.score)
+            for point in points
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+
+def open_vectorstore(client: QdrantClient, collection_name: str, embeddings: Embeddings) -> QdrantVectorStore:
+    """
+    Vectorstore adapté à la mise en page de la collection (un ou deux vecteurs).
+    """
+    reduced_dim = collection_reduced_dim(client, collection_name)
+    if reduced_dim:
+        print(f"🔀 Recherche deux étapes : vecteur réduit {reduced_dim} dimensions, rescoring complet")
+        return TwoStageQdrantVectorStore(client, collection_name, embeddings, reduced_dim)
+    return QdrantVectorStore(client=client, collection_name=collection_name, embedding=embeddings)
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str = COLLECTION_NAME):
+    """
+    Crée les index de payload manquants (PAYLOAD_INDEXES).
+    """
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field_name, schema in PAYLOAD_INDEXES.items():
+        if field_name not in existing:
+            client.create_payload_index(collection_name, field_name=field_name, field_schema=schema)
+            print(f"🔎 Index de payload créé : {field_name} ({schema.value})")
+
+
+def apply_layout(client: QdrantClient, collection_name: str = COLLECTION_NAME,
+                 mode: str = QUANTIZATION, on_disk: bool = ON_DISK):
+    """
+    Applique la mise en page à une collection existante, en place.
+
+    Qdrant reconstruit les segments en arrière-plan : la collection reste
+    interrogeable mais passe en statut "yellow" pendant l'optimisation.
+    """
+    if collection_reduced_dim(client, collection_name):
+        raise ValueError(f"'{collection_name}' a deux vecteurs : utiliser migrate pour changer sa mise en page")
+    quantization = quantization_config(mode)
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=on_disk)},
+        hnsw_config=models.HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED,
+        collection_params=models.CollectionParamsDiff(on_disk_payload=on_disk),
+    )
+    ensure_payload_indexes(client, collection_name)
+    print(f"✅ Mise en page appliquée à '{collection_name}' (optimisation en cours côté serveur)")
+
+
+def resolve_alias(client: QdrantClient, name: str) -> Optional[str]:
+    """
+    Collection pointée par un alias (None si `name` n'est pas un alias).
+    """
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+
+def copy_points(source_client: QdrantClient, source_collection: str,
+                target_client: QdrantClient, target_collection: str,
+                batch_size: int = MIGRATION_BATCH_SIZE, reduced_dim: int = 0) -> int:
+    """
+    Copie points, vecteurs et payloads d'une collection à l'autre (sans ré-embedding).
+
+    Avec reduced_dim, les vecteurs réduits sont dérivés des vecteurs complets copiés.
+
+    Returns:
+        int: Nombre de points copiés
+    """
+    copied = 0
+    offset = None
+    while True:
+        points, offset = source_client.scroll(
+            source_collection, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            target_client.upsert(
+                target_collection,
+                points=[
+                    models.PointStruct(id=p.id, vector=point_vectors(_full_vector(p.vector), reduced_dim),
+                                       payload=p.payload)
+                    for p in points
+                ],
+                wait=True
+            )
+            copied += len(points)
+            print(f"   📦 {copied} points copiés", end="\r")
+        if offset is None:
+            break
+    print()
+    return copied
+
+
+def _full_vector(vector):
+    # Collection source à deux vecteurs : seul le vecteur complet est recopié
+    return vector[FULL_VECTOR] if isinstance(vector, dict) else vector
+
+
+def migrate(client: QdrantClient, name: str = COLLECTION_NAME, target: Optional[str] = None,
+            swap: bool = False, drop_old: bool = False, reduced_dim: int = REDUCED_DIM) -> str:
+    """
+    Migre une collection (ou l'alias `name`) vers une nouvelle collection avec la
+    mise en page optimisée, en recopiant les vecteurs existants.
+
+    - Si `name` est un alias, il est basculé de façon atomique vers la nouvelle collection.
+    - Si `name` est une collection, --swap la supprime et crée un alias du même nom :
+      rag.py et les indexeurs continuent d'utiliser le même nom.
+    - reduced_dim > 0 : nouvelle collection en recherche deux étapes.
+
+    Returns:
+        str: Nom de la nouvelle collection
+    """
+    aliased = resolve_alias(client, name)
+    source = aliased or name
+    target = target or f"{name}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    info = client.get_collection(source)
+    vectors = info.config.params.vectors
+    vector_size = (vectors[FULL_VECTOR] if isinstance(vectors, dict) else vectors).size
+
+    print(f"📦 Migration '{source}' -> '{target}' ({info.points_count} points, dimension {vector_size}"
+          f"{f', recherche sur {reduced_dim} dimensions' if reduced_dim else ''})")
+    create_collection(client, target, vector_size=vector_size, reduced_dim=reduced_dim)
+    start = time.perf_counter()
+    copied = copy_points(client, source, client, target, reduced_dim=reduced_dim)
+    target_count = client.count(target, exact=True).count
+    if target_count != info.points_count:
+        raise RuntimeError(f"Migration incomplète : {target_count}/{info.points_count} points dans '{target}'")
+    print(f"✅ {copied} points copiés en {time.perf_counter() - start:.1f} s")
+
+    if aliased:
+        client.update_collection_aliases(change_aliases_operations=[
+            models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=name)),
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=name)),
+        ])
+        print(f"🔀 Alias '{name}' -> '{target}'")
+        if drop_old:
+            client.delete_collection(source)
+            print(f"🗑️ Ancienne collection '{source}' supprimée")
+    elif swap:
+        # Les recherches sur `name` échouent entre la suppression et la création de l'alias
+        client.delete_collection(source)
+        client.update_collection_aliases(change_aliases_operations=[
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=name)),
+        ])
+        print(f"🔀 Collection '{source}' remplacée par l'alias '{name}' -> '{target}'")
+    else:
+        print(f"ℹ️ '{name}' inchangée : relancer avec --swap pour basculer vers '{target}'")
+    return target
+
+
+def describe(client: QdrantClient, name: str = COLLECTION_NAME) -> dict:
+    """
+    Résumé de la mise en page d'une collection (ou de la collection d'un alias).
+    """
+    collection = resolve_alias(client, name) or name
+    info = client.get_collection(collection)
+    params = info.config.params
+    vectors = params.vectors if isinstance(params.vectors, dict) else {"": params.vectors}
+    return {
+        "collection": collection,
+        "status": str(info.status.value if hasattr(info.status, "value") else info.status),
+        "points": info.points_count,
+        "indexed_vectors": info.indexed_vectors_count,
+        "vectors": {name or "default": {"size": v.size, "on_disk": v.on_disk} for name, v in vectors.items()},
+        "payload_on_disk": params.on_disk_payload,
+        "hnsw": {"m": info.config.hnsw_config.m, "ef_construct": info.config.hnsw_config.ef_construct},
+        "quantization": type(info.config.quantization_config).__name__ if info.config.quantization_config else None,
+        "payload_indexes": sorted((info.payload_schema or {}).keys()),
+    }
+
+
+def estimated_vector_ram_mib(nb_points: int, vector_size: int, mode: str, on_disk: bool,
+                             reduced_dim: int = 0) -> float:
+    """
+    RAM des vecteurs (hors graphe HNSW) : originaux en RAM, ou seulement leur version
+    quantizée quand les originaux sont sur disque. En deux étapes, seul le vecteur
+    réduit (et sa version quantizée) est en RAM.
+    """
+    searched_size = reduced_dim or vector_size
+    original = nb_points * searched_size * 4
+    quantized = {"scalar": nb_points * searched_size, "binary": nb_points * searched_size / 8, "none": 0}[mode]
+    return ((0 if on_disk and not reduced_dim else original) + quantized) / 2 ** 20
+
+
+def _wait_until_indexed(client: QdrantClient, collection_name: str, timeout_s: float = 600):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_s:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(0.5)
+    print(f"⚠️ '{collection_name}' toujours en optimisation après {timeout_s:.0f} s")
+
+
+def _benchmark_vectors(args) -> tuple:
+    """
+    Points du benchmark : collection existante (Qdrant Cloud) ou PDFs de data/.
+
+    Returns:
+        tuple: (ids, vecteurs, payloads)
+    """
+    if args.source_collection:
+        from config import QDRANT_API_KEY, QDRANT_CLOUD_URL
+        source_client = QdrantClient(url=QDRANT_CLOUD_URL, api_key=QDRANT_API_KEY, timeout=60)
+        ids, vectors, payloads, offset = [], [], [], None
+        while len(ids) < args.max_points:
+            points, offset = source_client.scroll(
+                args.source_collection, limit=MIGRATION_BATCH_SIZE, offset=offset,
+                with_payload=True, with_vectors=True
+            )
+            for p in points:
+                ids.append(p.id)
+                vectors.append(p.vector)
+                payloads.append(p.payload)
+            if offset is None:
+                break
+        return ids[:args.max_points], np.asarray(vectors[:args.max_points], dtype=np.float32), payloads
+
+    from benchmark_fakes import HashingFakeEmbeddings, load_local_vectorstore
+    vectorstore = load_local_vectorstore(args.pdf_folder, HashingFakeEmbeddings(dim=args.dim), "benchmark_source")
+    points, _ = vectorstore.client.scroll(
+        "benchmark_source", limit=args.max_points, with_payload=True, with_vectors=True
+    )
+    return [p.id for p in points], np.asarray([p.vector for p in points], dtype=np.float32), \
+        [p.payload for p in points]
+
+
+def _measure(client: QdrantClient, collection_name: str, queries: np.ndarray, k: int,
+             params: Optional[models.SearchParams], reduced_dim: int = 0,
+             prefetch_factor: int = PREFETCH_FACTOR) -> tuple:
+    """
+    Recherche chaque requête et mesure sa latence.
+
+    Returns:
+        tuple: (ids trouvés par requête, latences en ms)
+    """
+    found, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response = client.query_points(
+            collection_name, **query_arguments(query.tolist(), k, reduced_dim, params, prefetch_factor)
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([point.id for point in response.points])
+    return found, latencies
+
+
+def run_benchmark(args):
+    """
+    Recall@k et latence : mise en page par défaut vs optimisée, sur Qdrant local.
+    """
+    client = QdrantClient(location=args.url) if args.url == ":memory:" else QdrantClient(url=args.url, timeout=60)
+    if args.url == ":memory:":
+        print("⚠️ Mode local de qdrant-client : HNSW et quantization ne sont pas appliqués "
+              "(recherche exacte), seul le code est vérifié")
+
+    print("🔧 Chargement des vecteurs...")
+    ids, vectors, payloads = _benchmark_vectors(args)
+    dim = vectors.shape[1]
+    rng = np.random.default_rng(args.seed)
+    # Requêtes : vecteurs stockés bruités (proches mais distincts des points indexés)
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = sample + rng.normal(0, args.noise / np.sqrt(dim), size=sample.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    print(f"✅ {len(ids)} points de dimension {dim}, {len(queries)} requêtes")
+
+    # Index construit même pour un petit corpus (seuil par défaut : 10 000 Ko)
+    optimizers = models.OptimizersConfigDiff(indexing_threshold=1)
+    # "default" : collection actuelle, recherche simple sans paramètres (as_retriever)
+    layouts = {
+        "default": dict(mode="none", on_disk=False, reduced_dim=0, prefetch_factors=[None]),
+        "tuned": dict(mode=args.quantization, on_disk=True, reduced_dim=0, prefetch_factors=[None]),
+    }
+    if args.reduced_dim:
+        layouts[f"two_stage_{args.reduced_dim}"] = dict(
+            mode=args.quantization, on_disk=True, reduced_dim=args.reduced_dim,
+            prefetch_factors=args.prefetch_factors
+        )
+    results = {}
+    ground_truth = None
+    for layout_name, layout in layouts.items():
+        collection_name = f"benchmark_{layout_name}"
+        if client.collection_exists(collection_name):
+            client.delete_collection(collection_name)
+        if layout_name == "default":
+            client.create_collection(
+                collection_name,
+                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE),
+                optimizers_config=optimizers
+            )
+        else:
+            create_collection(client, collection_name, vector_size=dim, mode=layout["mode"],
+                              on_disk=layout["on_disk"], optimizers_config=optimizers,
+                              reduced_dim=layout["reduced_dim"])
+        for start in range(0, len(ids), MIGRATION_BATCH_SIZE):
+            client.upsert(collection_name, points=[
+                models.PointStruct(id=pid, vector=point_vectors(vector.tolist(), layout["reduced_dim"]),
+                                   payload=payload)
+                for pid, vector, payload in zip(
+                    ids[start:start + MIGRATION_BATCH_SIZE],
+                    vectors[start:start + MIGRATION_BATCH_SIZE],
+                    payloads[start:start + MIGRATION_BATCH_SIZE]
+                )
+            ])
+        _wait_until_indexed(client, collection_name)
+
+        if ground_truth is None:
+            ground_truth, _ = _measure(client, collection_name, queries, args.k, models.SearchParams(exact=True))
+        params = search_params(layout["mode"]) if layout_name != "default" else None
+        for prefetch_factor in layout["prefetch_factors"]:
+            variant = f"{layout_name}_x{prefetch_factor}" if prefetch_factor else layout_name
+            measure_args = (args.k, params, layout["reduced_dim"], prefetch_factor or PREFETCH_FACTOR)
+            _measure(client, collection_name, queries[:args.warmup], *measure_args)
+            found, latencies = _measure(client, collection_name, queries, *measure_args)
+            recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, ground_truth) if t])
+            results[variant] = {
+                "quantization": layout["mode"],
+                "on_disk": layout["on_disk"],
+                "reduced_dim": layout["reduced_dim"],
+                "prefetch_limit": args.k * prefetch_factor if prefetch_factor else None,
+                "recall_at_k": round(float(recall), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "estimated_vector_ram_mib": round(estimated_vector_ram_mib(
+                    len(ids), dim, layout["mode"], layout["on_disk"], layout["reduced_dim"]), 2),
+            }
+        if not args.keep:
+            client.delete_collection(collection_name)
+
+    print(f"\n{'Mise en page':<22}{'recall@' + str(args.k):>10}{'p50 (ms)':>11}{'p95 (ms)':>11}{'RAM vect. (Mio)':>17}")
+    for layout_name, r in results.items():
+        print(f"{layout_name:<22}{r['recall_at_k']:>10.4f}{r['p50_ms']:>11.3f}{r['p95_ms']:>11.3f}"
+              f"{r['estimated_vector_ram_mib']:>17.2f}")
+
+    from benchmark_fakes import git_revision, results_path, save_results
+
+    git = git_revision()
+    save_results({
+        "benchmark": "collection_layout",
+        "git": git,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "url": args.url, "nb_points": len(ids), "dim": dim, "nb_queries": len(queries), "k": args.k,
+            "hnsw_m": HNSW_M, "hnsw_ef_construct": HNSW_EF_CONSTRUCT, "search_ef": SEARCH_HNSW_EF,
+            "oversampling": RESCORE_OVERSAMPLING, "reduced_dim": args.reduced_dim,
+        },
+        "layouts": results,
+    }, results_path("collection", git, args.output))
+    return results
+
+
+def _cloud_client() -> QdrantClient:
+    from config import QDRANT_API_KEY, QDRANT_CLOUD_URL
+    return QdrantClient(url=QDRANT_CLOUD_URL, api_key=QDRANT_API_KEY, timeout=120)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Gestion de la collection Qdrant de LuXas")
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="Collection ou alias")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("info", help="Afficher la mise en page actuelle")
+    subparsers.add_parser("apply", help="Appliquer la mise en page en place")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Copier vers une nouvelle collection optimisée")
+    migrate_parser.add_argument("--target", default=None, help="Nom de la nouvelle collection")
+    migrate_parser.add_argument("--swap", action="store_true", help="Remplacer la collection par un alias")
+    migrate_parser.add_argument("--drop-old", action="store_true", help="Supprimer l'ancienne collection (alias)")
+    migrate_parser.add_argument("--reduced-dim", type=int, default=REDUCED_DIM,
+                                help="Dimension du vecteur de recherche (0 = un seul vecteur complet)")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Recall et latence avant/après sur Qdrant local")
+    benchmark_parser.add_argument("--url", default=os.getenv("QDRANT_LOCAL_URL", "http://localhost:6333"),
+                                  help="Instance Qdrant locale (\":memory:\" pour vérifier le code seulement)")
+    benchmark_parser.add_argument("--source-collection", default=None,
+                                  help="Copier les vecteurs d'une collection Qdrant Cloud (défaut : PDFs)")
+    benchmark_parser.add_argument("--pdf-folder", default="data")
+    benchmark_parser.add_argument("--dim", type=int, default=VECTOR_SIZE)
+    benchmark_parser.add_argument("--max-points", type=int, default=50000)
+    benchmark_parser.add_argument("--queries", type=int, default=200)
+    benchmark_parser.add_argument("--noise", type=float, default=0.5, help="Bruit relatif ajouté aux requêtes")
+    benchmark_parser.add_argument("--k", type=int, default=10)
+    benchmark_parser.add_argument("--warmup", type=int, default=20)
+    benchmark_parser.add_argument("--quantization", default=QUANTIZATION, choices=["scalar", "binary", "none"])
+    benchmark_parser.add_argument("--reduced-dim", type=int, default=REDUCED_DIM or 256,
+                                  help="Dimension de la recherche deux étapes (0 = ne pas la mesurer)")
+    benchmark_parser.add_argument("--prefetch-factors", type=lambda v: [int(x) for x in v.split(",")],
+                                  default=[1, 2, 4, 8], help="Candidats réduits par résultat, ex: 2,4,8")
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    benchmark_parser.add_argument("--keep", action="store_true", help="Garder les collections de benchmark")
+    benchmark_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "benchmark":
+        run_benchmark(args)
+        return
+
+    client = _cloud_client()
+    if args.command == "info":
+        print(json.dumps(describe(client, args.collection), indent=2, ensure_ascii=False))
+    elif args.command == "apply":
+        apply_layout(client, resolve_alias(client, args.collection) or args.collection)
+    elif args.command == "migrate":
+        migrate(client, args.collection, target=args.target, swap=args.swap, drop_old=args.drop_old,
+                reduced_dim=args.reduced_dim)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Heuristiques locales pour éviter ou anticiper l'appel LLM de reformulation.
+
+- is_standalone_query : détecte (sans appel réseau) une question déjà autonome
+- query_similarity : compare la question brute et sa reformulation, pour décider
+  si les résultats d'une recherche spéculative sur la question brute sont réutilisables
+"""
+
+import re
+import unicodedata
+
+# Configuration
+MIN_STANDALONE_WORDS = 4  # En dessous, une question est presque toujours une relance
+
+# Débuts de phrase typiques d'une question de suivi ("Et pour les enfants ?")
+FOLLOW_UP_PREFIXES = (
+    "et ", "mais ", "alors ", "donc ", "aussi ", "ok ", "d'accord", "pourquoi ca",
+    "qu'en est-il", "qu en est-il", "et si ",
+)
+
+# Expressions qui renvoient à un élément de la conversation précédente
+FOLLOW_UP_MARKERS = (
+    "peux-tu preciser", "peux tu preciser", "precise", "developpe", "plus de details",
+    "plus en detail", "explique davantage", "la meme", "le meme", "les memes",
+    "cette loi", "cette proposition", "ce texte", "cet article", "ces articles",
+    "ce document", "ces documents", "cette mesure", "ces mesures", "ce dispositif",
+    "ci-dessus", "precedent", "precedente", "mentionne", "mentionnee", "tu as dit",
+    "vous avez dit", "dans ta reponse", "l'autre", "les autres",
+)
+
+# Pronoms dont l'antécédent se trouve probablement dans l'historique
+REFERRING_WORDS = {
+    "il", "elle", "ils", "elles", "ca", "cela", "ceci", "celle", "celui", "ceux",
+    "celles", "celle-ci", "celui-ci", "ceux-ci", "celles-ci", "lui", "leur", "leurs",
+}
+
+
+def _normalize(text: str) -> str:
+    """
+    Minuscules, sans accents, apostrophes typographiques unifiées.
+    """
+    text = unicodedata.normalize("NFKD", text.lower().replace("’", "'"))
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def _words(text: str) -> list:
+    return re.findall(r"[\w'-]+", _normalize(text))
+
+
+def is_standalone_query(query: str) -> bool:
+    """
+    Indique si une question peut être recherchée telle quelle, sans reformulation.
+
+    Conservateur : au moindre indice de référence à la conversation, on renvoie
+    False et la reformulation LLM est conservée.
+    """
+    normalized = _normalize(query)
+    words = _words(query)
+
+    if len(words) < MIN_STANDALONE_WORDS:
+        return False
+    if normalized.startswith(FOLLOW_UP_PREFIXES):
+        return False
+    if any(marker in normalized for marker in FOLLOW_UP_MARKERS):
+        return False
+    if REFERRING_WORDS.intersection(words):
+        return False
+    return True
+
+
+def query_similarity(query: str, other: str) -> float:
+    """
+    Similarité de Jaccard entre les mots significatifs (3 lettres et plus) de deux questions.
+    """
+    first = {word for word in _words(query) if len(word) >= 3}
+    second = {word for word in _words(other) if len(word) >= 3}
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
@@ -1,12 +1,27 @@
 import os
+import time
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from langfuse.langchain import CallbackHandler
 from langfuse import observe, get_client
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
 from langchain_openai import ChatOpenAI
-# from sentence_transformers import CrossEncoder
+from embedding_cache import CachedEmbeddings
+from query_reformulation import is_standalone_query, query_similarity
+from lexical_index import get_lexical_index, reciprocal_rank_fusion
+from reranking import RERANK_CANDIDATES, load_reranker
+from qdrant_collection import open_vectorstore, search_params
+from local_vectorstore import LOCAL_VECTOR_DIR, VECTOR_BACKEND, LocalVectorStore
+from context_packing import pack_context
+from legal_metadata import detect_constraints, sort_by_recency
+from conversation_memory import role_label, split_summary
+from metrics import LANGFUSE_ENABLED, METRICS_ENABLED, count_tokens, registry, stage, start_exporters, usage_tokens
 
 # Note: config.py loads all API keys into environment variables via load_dotenv()
 # Libraries read them automatically from os.environ
@@ -15,83 +30,192 @@ from langchain_openai import ChatOpenAI
 embeddings = None
 vectorstore = None
 llm = None
-# reranker = None  # Modèle de reranking
+reformulation_llm = None  # LLM dédié à la reformulation (None = même LLM que la réponse)
+reranker = None  # Reranker (None = ordre de la recherche vectorielle)
 collection_name = "rag_documents"
+init_duration_ms = None  # Durée de la dernière initialisation (None = pas encore initialisé)
+
+# Les composants sont créés une seule fois par processus et partagés par toutes les
+# sessions Streamlit ; les clients OpenAI partagent un même pool de connexions HTTP
+HTTP_MAX_CONNECTIONS = 20
+_components_lock = threading.Lock()
+_components_ready = False
+
+# Reformulation des questions de suivi :
+# - "always" : reformulation LLM dès qu'il y a un historique
+# - "heuristic" : pas d'appel LLM si la question est jugée autonome localement
+# - "speculative" : heuristique + recherche sur la question brute pendant la reformulation
+REFORMULATION_MODE = os.getenv("REFORMULATION_MODE", "always")
+REFORMULATION_MODEL = os.getenv("REFORMULATION_MODEL")  # ex: "gpt-4o-mini" (plus rapide)
+SPECULATIVE_SIMILARITY_THRESHOLD = 0.6  # Similarité minimale pour garder la recherche spéculative
+
+# Recherche hybride : index lexical BM25 (construit par les indexeurs) fusionné avec Qdrant
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "false").lower() == "true"
+LEXICAL_K = 10  # Résultats lexicaux fusionnés avec les résultats denses
+SEARCH_K = 10  # Documents récupérés sans reranker (avec : RERANK_CANDIDATES)
+SEARCH_PARAMS = search_params()  # ef HNSW et rescoring (voir qdrant_collection.py)
+
+NO_DOCUMENTS_MESSAGE = "⚠️ Aucun document pertinent trouvé. Veuillez d'abord indexer des documents."
+
+_speculative_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative_search")
+_hybrid_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dense_search")
 
 langfuse_handler = CallbackHandler()
 
-def initialize_components():
+@dataclass
+class RAGAnswer:
+    """
+    Réponse structurée du RAG.
+
+    Seul `answer` doit être conservé dans l'historique de conversation ;
+    `sources_section` est le rendu Markdown des sources, pour l'affichage.
+    """
+    answer: str
+    sources: List[Dict] = field(default_factory=list)     # [{"source", "chunk_ids", "excerpts"}]
+    chunk_ids: List[str] = field(default_factory=list)    # Identifiants Qdrant des chunks envoyés au LLM
+    sources_section: str = ""
+
+    def __str__(self):
+        return f"{self.answer}{self.sources_section}"
+
+    def to_dict(self) -> dict:
+        return {
+            "answer": self.answer,
+            "sources": self.sources,
+            "chunk_ids": self.chunk_ids,
+            "sources_section": self.sources_section,
+        }
+
+def stream_to_string(chunks: list) -> str:
     """
-    Initialise les composants : embeddings, LLM, Qdrant Cloud, et reranker.
+    Sortie complète d'un flux de réponse (tokens, puis RAGAnswer final) pour Langfuse.
     """
-    global embeddings, llm, vectorstore #, reranker
+    return "".join(chunk if isinstance(chunk, str) else chunk.sources_section for chunk in chunks)
 
-    if not os.getenv("OPENAI_API_KEY"):
-        raise ValueError("OPENAI_API_KEY not found in environment variables!")
+def initialize_components(force: bool = False):
+    """
+    Initialise les composants : embeddings, LLM, base vectorielle (Qdrant Cloud,
+    ou base locale si VECTOR_BACKEND=local) et reranker.
 
-    print("🔧 Initialisation des composants RAG...")
-    
-    # 1. Créer les embeddings OpenAI (lit OPENAI_API_KEY depuis os.environ)
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    print("✅ Embeddings créés")
-    
-    # 2. Créer le LLM (lit OPENAI_API_KEY depuis os.environ)
-    llm = ChatOpenAI(model="gpt-4", temperature=0.1)
-    print("✅ LLM créé")
-
-    # 3. Créer le client Qdrant Cloud avec timeout augmenté
-    client = QdrantClient(
-        url=os.getenv("QDRANT_CLOUD_URL"), 
-        api_key=os.getenv("QDRANT_API_KEY"),
-        timeout=60  # Timeout de 60 secondes au lieu de 5 par défaut
-    )    
-    # 4. Créer le vectorstore LangChain
-    vectorstore = QdrantVectorStore(
-        client=client,
-        collection_name=collection_name,
-        embedding=embeddings
-    )
-    print("✅ Vectorstore prêt")
-    
-    # 6. Charger le modèle de reranking
-    # print("🔄 Chargement du reranker...")
-    # reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-    # print("✅ Reranker prêt")
-    
-    return "✅ Components initialized successfully!"
+    Thread-safe et idempotent : seul le premier appel du processus crée les
+    composants, les suivants ne coûtent rien.
 
-@observe()
-def rag_agent_with_sources_conversational(query: str, chat_history: list = None):
-    """
-    Agent RAG conversationnel avec mémoire de conversation.
-    
-    Gère les questions de suivi en tenant compte de l'historique.
-    
     Args:
-        query: Question actuelle de l'utilisateur
-        chat_history: Liste des messages précédents [{"role": "user/assistant", "content": "..."}]
-        
-    Returns:
-        str: Réponse avec sources
+        force: Recrée les composants même s'ils existent déjà
     """
-    global vectorstore, llm
-    langfuse = get_client()
+    global embeddings, llm, reformulation_llm, vectorstore, reranker
+    global init_duration_ms, _components_ready
 
-    if vectorstore is None or llm is None:
-        return "⚠️ Components not initialized!"
+    if _components_ready and not force:
+        return "✅ Components already initialized"
 
-    if chat_history is None:
-        chat_history = []
+    with _components_lock:
+        if _components_ready and not force:
+            return "✅ Components already initialized"
+        _components_ready = False
 
-    # 1. Reformuler la question en tenant compte du contexte conversationnel
-    if chat_history:
-        # Construire le contexte conversationnel
-        conversation_context = "\n".join([
-            f"{'Utilisateur' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
-            for msg in chat_history[-6:]  # Garder seulement les 6 derniers messages
-        ])
-        
-        reformulation_prompt = f"""Contexte de conversation précédente :
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError("OPENAI_API_KEY not found in environment variables!")
+
+        print("🔧 Initialisation des composants RAG...")
+        start = time.perf_counter()
+
+        # Pools de connexions partagés par les embeddings et les LLM (sync et async)
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS
+        )
+        http_client = httpx.Client(limits=limits, timeout=60)
+        http_async_client = httpx.AsyncClient(limits=limits, timeout=60)
+
+        # 1. Créer les embeddings OpenAI (lit OPENAI_API_KEY depuis os.environ),
+        #    derrière le cache disque partagé avec les indexeurs
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(
+            model="text-embedding-3-small",
+            http_client=http_client,
+            http_async_client=http_async_client
+        ))
+        print("✅ Embeddings créés")
+
+        # 2. Créer le LLM (lit OPENAI_API_KEY depuis os.environ)
+        llm = ChatOpenAI(
+            model="gpt-4",
+            temperature=0.1,
+            stream_usage=True,  # Tokens consommés aussi en streaming (métriques)
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        if REFORMULATION_MODEL:
+            reformulation_llm = ChatOpenAI(
+                model=REFORMULATION_MODEL,
+                temperature=0,
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+        print("✅ LLM créé")
+
+        if VECTOR_BACKEND == "local":
+            # 3-4. Base locale mappée en mémoire (sans réseau ni identifiants Qdrant)
+            vectorstore = LocalVectorStore(LOCAL_VECTOR_DIR, embeddings)
+            print(f"✅ Vectorstore local prêt ({len(vectorstore)} chunks, {vectorstore.dtype.name})")
+        else:
+            # 3. Créer le client Qdrant Cloud avec timeout augmenté
+            client = QdrantClient(
+                url=os.getenv("QDRANT_CLOUD_URL"), 
+                api_key=os.getenv("QDRANT_API_KEY"),
+                timeout=60  # Timeout de 60 secondes au lieu de 5 par défaut
+            )    
+            # 4. Créer le vectorstore LangChain
+            vectorstore = open_vectorstore(client, collection_name, embeddings)
+            print("✅ Vectorstore prêt")
+
+        # 6. Charger le reranker (backend choisi par RERANKER)
+        print("🔄 Chargement du reranker...")
+        reranker = load_reranker()
+        print(f"✅ Reranker prêt ({reranker.scorer.name if reranker else 'désactivé'})")
+
+        start_exporters()
+        init_duration_ms = (time.perf_counter() - start) * 1000
+        _components_ready = True
+        print(f"⏱️ Composants initialisés en {init_duration_ms:.0f} ms")
+
+    return "✅ Components initialized successfully!"
+
+def warm_up():
+    """
+    Initialise les composants puis ouvre les connexions (OpenAI, Qdrant) et charge
+    l'index lexical, pour que la première question ne paie pas ces coûts.
+
+    Returns:
+        float: Durée de l'initialisation et du préchauffage, en millisecondes
+    """
+    start = time.perf_counter()
+    initialize_components()
+    try:
+        # Appel direct (hors cache disque) pour ouvrir la connexion OpenAI
+        embeddings.underlying.embed_query("préchauffage")
+        if not isinstance(vectorstore, LocalVectorStore):
+            vectorstore.client.get_collection(collection_name)
+    except Exception as e:
+        print(f"⚠️ Préchauffage incomplet : {e}")
+    if HYBRID_SEARCH:
+        get_lexical_index()
+    duration_ms = (time.perf_counter() - start) * 1000
+    print(f"🔥 Composants préchauffés en {duration_ms:.0f} ms")
+    return duration_ms
+
+def _reformulation_messages(query: str, chat_history: list) -> list:
+    """
+    Construit les messages de l'appel LLM de reformulation.
+    """
+    # Construire le contexte conversationnel : résumé glissant + 6 derniers messages
+    summary, messages = split_summary(chat_history)
+    conversation_context = "\n".join([
+        f"{role_label(msg['role'])}: {msg['content']}"
+        for msg in ([summary] if summary else []) + messages[-6:]
+    ])
+    
+    reformulation_prompt = f"""Contexte de conversation précédente :
 {conversation_context}
 
 Question actuelle : {query}
@@ -103,82 +227,277 @@ Si la question est déjà autonome, retourne-la telle quelle.
 
 Retourne UNIQUEMENT la question reformulée, sans explication."""
 
-        reformulation_messages = [
-            SystemMessage(content="Tu es un assistant qui reformule les questions pour les rendre autonomes."),
-            HumanMessage(content=reformulation_prompt)
-        ]
-        
-        reformulated = llm.invoke(
-            reformulation_messages,
+    return [
+        SystemMessage(content="Tu es un assistant qui reformule les questions pour les rendre autonomes."),
+        HumanMessage(content=reformulation_prompt)
+    ]
+
+def _reformulate(query: str, chat_history: list) -> str:
+    """
+    Reformule une question de suivi en question autonome (appel LLM).
+    """
+    with stage("reformulation", input={"query": query}, trace=False) as s:
+        reformulated = (reformulation_llm or llm).invoke(
+            _reformulation_messages(query, chat_history),
             config={"callbacks": [langfuse_handler]}
             )
-        search_query = reformulated.content.strip()
-    else:
-        search_query = query
+        prompt_tokens, completion_tokens = usage_tokens(reformulated)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    print(f"✅ Question reformulée en {s.duration_ms:.0f} ms")
+    return reformulated.content.strip()
 
-    # 2. Recherche vectorielle avec la question (reformulée ou originale)
-    # Récupérer les 10 documents les plus pertinents (20 cross encoder)
-    # Créer un span pour tracker l'appel à Qdrant (Langfuse v3)
-    with langfuse.start_as_current_observation(
-        name="vector_search",
-        input={"query": search_query, "k": 10}
-    ) as span:
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-        initial_docs = retriever.invoke(search_query)
-        
-        # Ajouter les résultats au span
-        span.update(
-            output={
-                "nb_docs_retrieved": len(initial_docs),
-                "nb_unique_sources": len(set(doc.metadata.get("source", "Unknown") for doc in initial_docs)),
-                "sources": list(set(doc.metadata.get("source", "Unknown") for doc in initial_docs))
-            }
+def _embed_query(search_query: str) -> list:
+    """
+    Embedding de la requête de recherche (étape "query_embedding").
+    """
+    with stage("query_embedding", input={"query": search_query}) as s:
+        vector = embeddings.embed_query(search_query)
+        s.record(embedding_tokens=count_tokens(search_query) if METRICS_ENABLED else 0)
+    return vector
+
+def _dense_search(search_query: str, k: int, constraints=None) -> Tuple[list, bool]:
+    """
+    Embedding de la requête puis recherche dense dans Qdrant, filtrée par les
+    contraintes détectées (voir legal_metadata.py). Sans résultat filtré, la
+    recherche est relancée sans filtre.
+
+    Returns:
+        tuple: (documents, True si le filtre a été abandonné)
+    """
+    query_vector = _embed_query(search_query)
+    query_filter = constraints.to_filter() if constraints else None
+    docs = vectorstore.similarity_search_by_vector(query_vector, k=k, filter=query_filter, search_params=SEARCH_PARAMS)
+    if not docs and query_filter is not None:
+        print("⚠️ Aucun chunk ne correspond aux filtres détectés, recherche sans filtre")
+        return vectorstore.similarity_search_by_vector(query_vector, k=k, search_params=SEARCH_PARAMS), True
+    return docs, False
+
+def _points_to_documents(points) -> list:
+    """
+    Documents construits à partir de points Qdrant bruts (client async, requêtes
+    groupées), sous la même forme que ceux de QdrantVectorStore (_id et _collection_name).
+    """
+    return [
+        vectorstore._document_from_point(
+            point, vectorstore.collection_name, vectorstore.content_payload_key, vectorstore.metadata_payload_key
         )
+        for point in points
+    ]
 
-    if not initial_docs:
-        return "⚠️ Aucun document pertinent trouvé. Veuillez d'abord indexer des documents."
-
-    # 3. Reranking : améliorer la pertinence des résultats (DÉSACTIVÉ pour vitesse)
-    # print(f"🔄 Reranking {len(initial_docs)} documents...")
-    # if reranker is not None and len(initial_docs) > 0:
-    #     # Créer les paires (query, document) pour le reranker
-    #     pairs = [[search_query, doc.page_content] for doc in initial_docs]
-    #     
-    #     # Calculer les scores de pertinence
-    #     scores = reranker.predict(pairs)
-    #     
-    #     # Associer chaque document avec son score
-    #     docs_with_scores = list(zip(initial_docs, scores))
-    #     
-    #     # Trier par score décroissant et garder les 10 meilleurs
-    #     docs_with_scores.sort(key=lambda x: x[1], reverse=True)
-    #     docs = [doc for doc, score in docs_with_scores[:10]]
-    #     
-    #     print(f"✅ Top 10 documents après reranking (scores: {[f'{s:.3f}' for _, s in docs_with_scores[:10]]})")
-    # else:
-    #     # Fallback si le reranker n'est pas disponible
-    docs = initial_docs[:10]
-    print("✅ Utilisation des 10 premiers résultats (reranking désactivé)")
-
-    # 4. Organiser les documents par source
-    sources_dict = {}
+def _fetch_texts(docs: list) -> list:
+    """
+    Relit dans la base vectorielle le texte des résultats lexicaux (l'index BM25
+    ne stocke que les métadonnées). Les chunks absents de la base sont écartés.
+    """
+    missing = [doc.metadata["_id"] for doc in docs if not doc.page_content]
+    if not missing:
+        return docs
+    texts = {str(doc.metadata["_id"]): doc.page_content for doc in vectorstore.get_by_ids(missing)}
     for doc in docs:
-        source = doc.metadata.get("source", "Unknown")
-        if source not in sources_dict:
-            sources_dict[source] = []
-        sources_dict[source].append(doc)
+        if not doc.page_content:
+            doc.page_content = texts.get(str(doc.metadata["_id"]), "")
+    return [doc for doc in docs if doc.page_content]
 
-    # 5. Créer le contexte documentaire
-    context_parts = []
-    for source, source_docs in sources_dict.items():
-        for idx, doc in enumerate(source_docs, 1):
-            context_parts.append(
-                f"[Document: {source} | Chunk {idx}]\n{doc.page_content[:500]}"
+def _lexical_search(lexical_index, search_query: str, constraints=None,
+                    fetch_texts: bool = True) -> Tuple[list, float]:
+    """
+    Recherche BM25 (étape "lexical_search"), avec les mêmes contraintes que la
+    recherche dense appliquées aux résultats. Sans candidat satisfaisant les
+    contraintes, aucun résultat n'est renvoyé : c'est à l'appelant de relancer
+    sans contraintes si la recherche dense a elle aussi abandonné le filtre.
+
+    Args:
+        fetch_texts: Relire le texte des résultats (sinon à la charge de l'appelant, voir _fetch_texts)
+
+    Returns:
+        tuple: (documents, durée de la recherche en ms)
+    """
+    with stage("lexical_search", trace=False) as s:
+        if constraints:
+            candidates = [doc for doc, _ in lexical_index.search(search_query, k=LEXICAL_K * 4)]
+            lexical_docs = [doc for doc in candidates if constraints.matches(doc.metadata)][:LEXICAL_K]
+        else:
+            lexical_docs = [doc for doc, _ in lexical_index.search(search_query, k=LEXICAL_K)]
+        if fetch_texts:
+            lexical_docs = _fetch_texts(lexical_docs)
+        s.record(chunks=len(lexical_docs))
+    return lexical_docs, s.duration_ms
+
+def _vector_search(search_query: str) -> list:
+    """
+    Recherche vectorielle dans Qdrant, tracée dans un span Langfuse.
+
+    Si HYBRID_SEARCH est activé, l'index lexical BM25 est interrogé pendant
+    l'appel à Qdrant et les deux classements sont fusionnés (RRF).
+    """
+    lexical_index = get_lexical_index() if HYBRID_SEARCH else None
+    k = RERANK_CANDIDATES if reranker is not None else SEARCH_K
+    constraints = detect_constraints(search_query)
+
+    # Récupérer les k documents les plus pertinents (sur-échantillonnés si reranking)
+    with stage(
+        "vector_search",
+        input={"query": search_query, "k": k, "hybrid": lexical_index is not None,
+               "filters": constraints.describe()}
+    ) as s:
+        if lexical_index is None:
+            initial_docs, _ = _dense_search(search_query, k, constraints)
+        else:
+            dense_search = _hybrid_executor.submit(
+                contextvars.copy_context().run, _dense_search, search_query, k, constraints
             )
+            lexical_docs, lexical_ms = _lexical_search(lexical_index, search_query, constraints)
+            dense_docs, unfiltered = dense_search.result()
+            if unfiltered:
+                # Filtre abandonné par la recherche dense : BM25 sans filtre aussi
+                lexical_docs, retry_ms = _lexical_search(lexical_index, search_query)
+                lexical_ms += retry_ms
+            initial_docs = reciprocal_rank_fusion([dense_docs, lexical_docs])[:k]
+            s.record(nb_lexical_docs=len(lexical_docs), lexical_ms=round(lexical_ms, 3))
+
+        # Ajouter les résultats au span
+        s.record(chunks=len(initial_docs), filtered_searches=int(bool(constraints)), **_search_summary(initial_docs))
+    if constraints:
+        print(f"🎯 Filtres détectés : {constraints.describe()}")
+    return initial_docs
+
+def _search_summary(docs: list) -> dict:
+    """
+    Résumé des résultats d'une recherche, pour le span Langfuse.
+    """
+    sources = set(doc.metadata.get("source", "Unknown") for doc in docs)
+    return {"nb_docs_retrieved": len(docs), "nb_unique_sources": len(sources), "sources": list(sources)}
 
-    doc_context = "\n\n---\n\n".join(context_parts)
+def _resolution_path(query: str, chat_history: list) -> str:
+    """
+    Choisit comment obtenir la requête de recherche (voir _resolve_and_search).
 
-    # 6. Construire le prompt avec historique conversationnel
+    Returns:
+        str: "no_history", "standalone", "speculative" ou "reformulated"
+    """
+    if not chat_history:
+        return "no_history"
+    if REFORMULATION_MODE in ("heuristic", "speculative") and is_standalone_query(query):
+        return "standalone"
+    if REFORMULATION_MODE == "speculative":
+        return "speculative"
+    return "reformulated"
+
+@observe(name="query_resolution", capture_output=False)
+def _resolve_and_search(query: str, chat_history: list):
+    """
+    Détermine la requête de recherche selon REFORMULATION_MODE et lance la recherche.
+
+    Chemins possibles (enregistrés avec leur latence dans Langfuse) :
+    - "no_history" : première question, recherche directe
+    - "standalone" : question jugée autonome par l'heuristique locale, pas d'appel LLM
+    - "reformulated" : reformulation LLM puis recherche
+    - "speculative_kept" / "speculative_discarded" : recherche lancée sur la question
+      brute pendant la reformulation, résultats gardés ou relancés selon l'écart
+
+    Returns:
+        tuple: (requête de recherche, documents)
+    """
+    start = time.perf_counter()
+    timings = {}
+
+    path = _resolution_path(query, chat_history)
+    if path in ("no_history", "standalone"):
+        search_query = query
+    elif path == "speculative":
+        # Recherche sur la question brute en parallèle de la reformulation
+        context = contextvars.copy_context()
+        speculative_search = _speculative_executor.submit(context.run, _vector_search, query)
+        search_query = _reformulate(query, chat_history)
+        timings["reformulation_ms"] = (time.perf_counter() - start) * 1000
+        speculative_docs = speculative_search.result()
+        similarity = query_similarity(query, search_query)
+        if similarity >= SPECULATIVE_SIMILARITY_THRESHOLD:
+            path = "speculative_kept"
+            initial_docs = speculative_docs
+        else:
+            path = "speculative_discarded"
+            initial_docs = _vector_search(search_query)
+        timings["similarity"] = round(similarity, 3)
+    else:
+        search_query = _reformulate(query, chat_history)
+        timings["reformulation_ms"] = (time.perf_counter() - start) * 1000
+
+    if not path.startswith("speculative"):
+        search_start = time.perf_counter()
+        initial_docs = _vector_search(search_query)
+        timings["search_ms"] = (time.perf_counter() - search_start) * 1000
+
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    _record_resolution(path, timings)
+    return search_query, initial_docs
+
+def _record_resolution(path: str, timings: dict):
+    """
+    Enregistre le chemin de résolution et sa latence (Langfuse et métriques locales).
+    """
+    if LANGFUSE_ENABLED:
+        get_client().update_current_span(metadata={"reformulation_path": path, **timings})
+    if METRICS_ENABLED:
+        registry.inc("luxas_query_resolution_total", 1, "Requêtes par chemin de résolution", path=path)
+        registry.observe("luxas_stage_duration_seconds", timings["total_ms"] / 1000,
+                         "Durée des étapes du RAG et des indexeurs", stage="query_resolution")
+    print(f"⏱️ Requête résolue via '{path}' en {timings['total_ms']:.0f} ms")
+
+def _prepare_generation(query: str, chat_history: list):
+    """
+    Reformule la question, interroge Qdrant et construit les messages pour le LLM.
+
+    Returns:
+        tuple: (messages, sources_dict, docs), ou un message d'avertissement (str)
+    """
+    # 1-2. Reformuler la question si besoin puis rechercher dans Qdrant
+    search_query, initial_docs = _resolve_and_search(query, chat_history)
+
+    if not initial_docs:
+        return NO_DOCUMENTS_MESSAGE
+
+    # 3. Reranking
+    docs = _rerank(search_query, initial_docs)
+
+    # 4-6. Construire le prompt
+    with stage("context_building", trace=False) as s:
+        messages, sources_dict, docs, context_report = _build_messages(query, chat_history, docs)
+        _record_context(s, context_report)
+    return messages, sources_dict, docs
+
+def _rerank(search_query: str, initial_docs: list) -> list:
+    """
+    Garde les meilleurs chunks dans le budget de latence (span Langfuse "rerank").
+    """
+    if reranker is not None:
+        with stage("rerank", input={"query": search_query, "nb_candidates": len(initial_docs)}) as s:
+            docs, rerank_info = reranker.rerank(search_query, initial_docs)
+            s.record(chunks=len(docs), fallbacks=int(rerank_info["fallback"]), **rerank_info)
+        if rerank_info["fallback"]:
+            print(f"⚠️ Budget de reranking dépassé ({rerank_info['rerank_ms']:.0f} ms), ordre vectoriel conservé")
+        else:
+            print(f"✅ Top {len(docs)} documents après reranking en {rerank_info['rerank_ms']:.0f} ms "
+                  f"(scores: {rerank_info['scores']})")
+    else:
+        docs = initial_docs[:SEARCH_K]
+        print(f"✅ Utilisation des {len(docs)} premiers résultats (reranking désactivé)")
+
+    # "La dernière proposition..." : les dépôts les plus récents en tête du contexte
+    if detect_constraints(search_query).recent:
+        docs = sort_by_recency(docs)
+
+    return docs
+
+def _build_messages(query: str, chat_history: list, docs: list):
+    """
+    Construit les messages pour le LLM à partir des documents retenus, dans le
+    budget de tokens du prompt (voir context_packing.py).
+
+    Returns:
+        tuple: (messages, sources_dict, docs effectivement inclus, rapport de tokens)
+    """
+    # 4. Prompt système
     system_prompt = """Tu es LuXas, un assistant juridique pédagogue spécialisé dans les propositions de loi de l'Assemblée Nationale française.
 
 INSTRUCTIONS CRITIQUES - ANTI-HALLUCINATION :
@@ -193,36 +512,60 @@ INSTRUCTIONS CRITIQUES - ANTI-HALLUCINATION :
 
 RÈGLE D'OR : En cas de doute, dis que tu n'as pas l'information plutôt que d'inventer."""
 
-    # Construire l'historique conversationnel pour le contexte
-    conversation_context = ""
-    if chat_history:
-        conversation_context = "Historique de conversation :\n"
-        for msg in chat_history[-4:]:  # Garder les 4 derniers échanges
-            role = "Utilisateur" if msg['role'] == 'user' else "Assistant"
-            conversation_context += f"{role}: {msg['content'][:200]}...\n"
-        conversation_context += "\n"
+    question_part = f"""Question actuelle : {query}
 
-    user_prompt = f"""{conversation_context}Documents disponibles :
+Réponds à la question en te basant UNIQUEMENT sur les documents fournis. Cite tes sources."""
 
-{doc_context}
+    # 5. Remplir le budget : historique récent, puis chunks par ordre de pertinence
+    packed = pack_context(docs, chat_history, fixed_prompt=f"{system_prompt}\n{question_part}")
 
-Question actuelle : {query}
+    # 6. Construire le prompt avec historique conversationnel
+    user_prompt = f"""{packed.conversation_context}Documents disponibles :
 
-Réponds à la question en te basant UNIQUEMENT sur les documents fournis. Cite tes sources."""
+{packed.doc_context}
+
+{question_part}"""
 
     messages = [
         SystemMessage(content=system_prompt),
         HumanMessage(content=user_prompt)
     ]
 
-    # 7. Générer la réponse
-    response = llm.invoke(
-        messages,
-        config={"callbacks": [langfuse_handler]}
-        )
-    answer = response.content
+    return messages, packed.sources_dict, packed.docs, packed.report
 
-    # 8. Ajouter les sources
+def _record_context(s, report: dict):
+    """
+    Enregistre le rapport de tokens du prompt dans l'étape context_building.
+    """
+    s.record(chunks=report["chunks_included"], **report)
+    print(f"🧮 Prompt : ~{report['prompt_tokens_estimate']} tokens "
+          f"(documents {report['document_tokens']}, historique {report['history_tokens']}, "
+          f"fixe {report['fixed_tokens']}) ; {report['chunks_included']} chunks dont "
+          f"{report['chunks_truncated']} tronqués, {report['chunks_dropped']} écartés")
+
+def _build_answer(answer: str, sources_dict: dict, docs: list) -> RAGAnswer:
+    """
+    Assemble la réponse structurée : texte, sources, identifiants des chunks.
+    """
+    sources = [
+        {
+            "source": source,
+            "chunk_ids": [str(doc.metadata.get("_id")) for doc in source_docs],
+            "excerpts": [doc.page_content[:120].replace("\n", " ").strip() for doc in source_docs[:2]],
+        }
+        for source, source_docs in sources_dict.items()
+    ]
+    return RAGAnswer(
+        answer=answer,
+        sources=sources,
+        chunk_ids=[str(doc.metadata.get("_id")) for doc in docs],
+        sources_section=_format_sources_section(sources_dict, docs)
+    )
+
+def _format_sources_section(sources_dict: dict, docs: list) -> str:
+    """
+    Construit la section "Sources Consultées" affichée après la réponse.
+    """
     unique_sources = list(sources_dict.keys())
     source_count = len(unique_sources)
     chunk_count = len(docs)
@@ -240,4 +583,107 @@ Réponds à la question en te basant UNIQUEMENT sur les documents fournis. Cite
             sources_section += f"   • ... et {len(source_docs) - 2} autre(s) extrait(s)\n"
         sources_section += "\n"
 
-    return f"{answer}{sources_section}"
+    return sources_section
+
+@observe()
+def rag_agent_with_sources_conversational(query: str, chat_history: list = None):
+    """
+    Agent RAG conversationnel avec mémoire de conversation.
+    
+    Gère les questions de suivi en tenant compte de l'historique.
+    
+    Args:
+        query: Question actuelle de l'utilisateur
+        chat_history: Liste des messages précédents [{"role": "user/assistant", "content": "..."}]
+        
+    Returns:
+        RAGAnswer: Réponse, sources et chunks utilisés (str(...) donne le rendu complet)
+    """
+    if vectorstore is None or llm is None:
+        return RAGAnswer(answer="⚠️ Components not initialized!")
+
+    if chat_history is None:
+        chat_history = []
+
+    prepared = _prepare_generation(query, chat_history)
+    if isinstance(prepared, str):
+        return RAGAnswer(answer=prepared)
+    messages, sources_dict, docs = prepared
+
+    # 7. Générer la réponse (la génération Langfuse vient du CallbackHandler)
+    with stage("generation", trace=False) as s:
+        response = llm.invoke(
+            messages,
+            config={"callbacks": [langfuse_handler]}
+            )
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    answer = response.content
+    print(f"✅ Réponse générée en {s.duration_ms:.0f} ms ({completion_tokens} tokens)")
+
+    # 8. Ajouter les sources
+    with stage("sources_formatting", trace=False):
+        return _build_answer(answer, sources_dict, docs)
+
+@observe(transform_to_string=stream_to_string)
+def rag_agent_with_sources_conversational_stream(query: str, chat_history: list = None):
+    """
+    Variante en streaming de rag_agent_with_sources_conversational.
+
+    Produit les tokens de la réponse au fur et à mesure de leur génération,
+    puis la réponse structurée (RAGAnswer, avec la section des sources à afficher).
+    La trace Langfuse enregistre la sortie complète.
+
+    Args:
+        query: Question actuelle de l'utilisateur
+        chat_history: Liste des messages précédents [{"role": "user/assistant", "content": "..."}]
+
+    Yields:
+        str: Morceaux de la réponse, puis un RAGAnswer en dernier élément
+    """
+    if vectorstore is None or llm is None:
+        yield "⚠️ Components not initialized!"
+        yield RAGAnswer(answer="⚠️ Components not initialized!")
+        return
+
+    if chat_history is None:
+        chat_history = []
+
+    prepared = _prepare_generation(query, chat_history)
+    if isinstance(prepared, str):
+        yield prepared
+        yield RAGAnswer(answer=prepared)
+        return
+    messages, sources_dict, docs = prepared
+
+    # 7. Générer la réponse token par token
+    with stage("generation", trace=False) as s:
+        start = time.perf_counter()
+        first_token_ms = None
+        prompt_tokens = completion_tokens = 0
+        answer_parts = []
+        for chunk in llm.stream(
+            messages,
+            config={"callbacks": [langfuse_handler]}
+            ):
+            chunk_prompt_tokens, chunk_completion_tokens = usage_tokens(chunk)
+            prompt_tokens += chunk_prompt_tokens
+            completion_tokens += chunk_completion_tokens
+            if chunk.content:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                    if METRICS_ENABLED:
+                        registry.observe("luxas_time_to_first_token_seconds", first_token_ms / 1000,
+                                         "Délai avant le premier token de la réponse")
+                answer_parts.append(chunk.content)
+                # Le temps du consommateur n'appartient pas à la génération
+                with s.paused():
+                    yield chunk.content
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    print(f"✅ Réponse générée en {s.duration_ms:.0f} ms (premier token à {first_token_ms or 0:.0f} ms, "
+          f"{completion_tokens} tokens)")
+
+    # 8. Ajouter les sources
+    with stage("sources_formatting", trace=False):
+        rag_answer = _build_answer("".join(answer_parts), sources_dict, docs)
+    yield rag_answer
@@ -0,0 +1,349 @@
+"""
+Variante asynchrone de l'agent RAG, utilisée par l'API HTTP (api.py).
+
+Mêmes étapes que rag.py (reformulation, recherche, reranking, prompt, génération)
+mais sans bloquer de thread : embeddings et LLM via leurs méthodes async (pool
+httpx async partagé créé par rag.initialize_components), Qdrant via AsyncQdrantClient.
+
+Chaque service amont a sa propre limite de concurrence (sémaphore) : un pic de
+conversations ne dépasse jamais OPENAI_LLM_CONCURRENCY générations en parallèle, etc.
+"""
+
+import asyncio
+import os
+import time
+from typing import Tuple
+
+from langfuse import observe
+from qdrant_client import AsyncQdrantClient
+
+import rag
+from conversation_memory import summary_messages
+from legal_metadata import detect_constraints
+from lexical_index import get_lexical_index, reciprocal_rank_fusion
+from local_vectorstore import LocalVectorStore
+from metrics import METRICS_ENABLED, count_tokens, registry, stage, usage_tokens
+from query_reformulation import query_similarity
+from qdrant_collection import query_arguments
+from reranking import RERANK_CANDIDATES
+
+# Configuration
+OPENAI_LLM_CONCURRENCY = int(os.getenv("OPENAI_LLM_CONCURRENCY", "16"))
+OPENAI_EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDING_CONCURRENCY", "32"))
+QDRANT_CONCURRENCY = int(os.getenv("QDRANT_CONCURRENCY", "32"))
+
+# Composants async (créés dans la boucle d'événements du serveur)
+async_qdrant_client = None  # Reste None avec la base locale (VECTOR_BACKEND=local)
+_limits = {}
+components_ready = False  # Initialisation terminée, quel que soit le backend
+_STREAM_END = object()  # Marqueur de fin de la file des tokens générés
+
+
+async def initialize_async_components():
+    """
+    Initialise les composants partagés (rag.initialize_components), puis le client
+    Qdrant async et les limites de concurrence par service amont.
+
+    À appeler une fois, depuis la boucle d'événements qui servira les requêtes.
+    """
+    global async_qdrant_client, _limits, components_ready
+
+    await asyncio.to_thread(rag.warm_up)
+    if not isinstance(rag.vectorstore, LocalVectorStore):
+        async_qdrant_client = AsyncQdrantClient(
+            url=os.getenv("QDRANT_CLOUD_URL"),
+            api_key=os.getenv("QDRANT_API_KEY"),
+            timeout=60
+        )
+    _limits = {
+        "llm": asyncio.Semaphore(OPENAI_LLM_CONCURRENCY),
+        "embeddings": asyncio.Semaphore(OPENAI_EMBEDDING_CONCURRENCY),
+        "qdrant": asyncio.Semaphore(QDRANT_CONCURRENCY),
+    }
+    components_ready = True
+    print(f"✅ Composants async prêts (LLM: {OPENAI_LLM_CONCURRENCY}, embeddings: "
+          f"{OPENAI_EMBEDDING_CONCURRENCY}, Qdrant: {QDRANT_CONCURRENCY} appels simultanés)")
+
+
+async def close_async_components():
+    """
+    Ferme le client Qdrant async.
+    """
+    global components_ready
+
+    components_ready = False
+    if async_qdrant_client is not None:
+        await async_qdrant_client.close()
+
+
+async def _areformulate(query: str, chat_history: list) -> str:
+    """
+    Reformule une question de suivi en question autonome (appel LLM async).
+    """
+    with stage("reformulation", input={"query": query}, trace=False) as s:
+        async with _limits["llm"]:
+            reformulated = await (rag.reformulation_llm or rag.llm).ainvoke(
+                rag._reformulation_messages(query, chat_history),
+                config={"callbacks": [rag.langfuse_handler]}
+            )
+        prompt_tokens, completion_tokens = usage_tokens(reformulated)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return reformulated.content.strip()
+
+
+async def _aqdrant_search(query_vector: list, k: int, query_filter) -> Tuple[list, bool]:
+    """
+    Recherche dans Qdrant avec le client async (sans filtre si aucun résultat filtré).
+
+    Returns:
+        tuple: (documents, True si le filtre a été abandonné)
+    """
+    unfiltered = False
+    reduced_dim = getattr(rag.vectorstore, "reduced_dim", 0)
+    async with _limits["qdrant"]:
+        response = await async_qdrant_client.query_points(
+            collection_name=rag.collection_name,
+            with_payload=True,
+            **query_arguments(query_vector, k, reduced_dim, rag.SEARCH_PARAMS, query_filter=query_filter)
+        )
+        if not response.points and query_filter is not None:
+            print("⚠️ Aucun chunk ne correspond aux filtres détectés, recherche sans filtre")
+            unfiltered = True
+            response = await async_qdrant_client.query_points(
+                collection_name=rag.collection_name,
+                with_payload=True,
+                **query_arguments(query_vector, k, reduced_dim, rag.SEARCH_PARAMS)
+            )
+    return rag._points_to_documents(response.points), unfiltered
+
+
+async def _avector_search(search_query: str) -> list:
+    """
+    Recherche vectorielle async dans Qdrant (+ BM25 et RRF si HYBRID_SEARCH).
+    """
+    lexical_index = get_lexical_index() if rag.HYBRID_SEARCH else None
+    k = RERANK_CANDIDATES if rag.reranker is not None else rag.SEARCH_K
+    constraints = detect_constraints(search_query)
+    query_filter = constraints.to_filter()
+
+    with stage(
+        "vector_search",
+        input={"query": search_query, "k": k, "hybrid": lexical_index is not None,
+               "filters": constraints.describe()}
+    ) as s:
+        # BM25 (et relecture des textes dans la base) pendant l'embedding et la recherche dense
+        lexical_search = asyncio.create_task(asyncio.to_thread(
+            rag._lexical_search, lexical_index, search_query, constraints
+        )) if lexical_index is not None else None
+        with stage("query_embedding", input={"query": search_query}) as embedding_stage:
+            async with _limits["embeddings"]:
+                query_vector = await rag.embeddings.aembed_query(search_query)
+            embedding_stage.record(embedding_tokens=count_tokens(search_query) if METRICS_ENABLED else 0)
+        if async_qdrant_client is None:
+            # Base locale : recherche en mémoire, hors de la boucle d'événements
+            initial_docs = await asyncio.to_thread(
+                rag.vectorstore.similarity_search_by_vector, query_vector, k, filter=query_filter
+            )
+            unfiltered = not initial_docs and query_filter is not None
+            if unfiltered:
+                print("⚠️ Aucun chunk ne correspond aux filtres détectés, recherche sans filtre")
+                initial_docs = await asyncio.to_thread(rag.vectorstore.similarity_search_by_vector, query_vector, k)
+        else:
+            initial_docs, unfiltered = await _aqdrant_search(query_vector, k, query_filter)
+
+        if lexical_search is not None:
+            lexical_docs, lexical_ms = await lexical_search
+            if unfiltered:
+                # Filtre abandonné par la recherche dense : BM25 sans filtre aussi
+                lexical_docs, retry_ms = await asyncio.to_thread(rag._lexical_search, lexical_index, search_query)
+                lexical_ms += retry_ms
+            initial_docs = reciprocal_rank_fusion([initial_docs, lexical_docs])[:k]
+            s.record(nb_lexical_docs=len(lexical_docs), lexical_ms=round(lexical_ms, 3))
+
+        s.record(chunks=len(initial_docs), filtered_searches=int(bool(constraints)),
+                 **rag._search_summary(initial_docs))
+    if constraints:
+        print(f"🎯 Filtres détectés : {constraints.describe()}")
+    return initial_docs
+
+
+@observe(name="query_resolution", capture_output=False)
+async def _aresolve_and_search(query: str, chat_history: list):
+    """
+    Version async de rag._resolve_and_search (mêmes chemins et mêmes métriques).
+
+    Returns:
+        tuple: (requête de recherche, documents)
+    """
+    start = time.perf_counter()
+    timings = {}
+
+    path = rag._resolution_path(query, chat_history)
+    if path in ("no_history", "standalone"):
+        search_query = query
+    elif path == "speculative":
+        # Recherche sur la question brute pendant la reformulation
+        speculative_search = asyncio.create_task(_avector_search(query))
+        search_query = await _areformulate(query, chat_history)
+        timings["reformulation_ms"] = (time.perf_counter() - start) * 1000
+        speculative_docs = await speculative_search
+        similarity = query_similarity(query, search_query)
+        if similarity >= rag.SPECULATIVE_SIMILARITY_THRESHOLD:
+            path = "speculative_kept"
+            initial_docs = speculative_docs
+        else:
+            path = "speculative_discarded"
+            initial_docs = await _avector_search(search_query)
+        timings["similarity"] = round(similarity, 3)
+    else:
+        search_query = await _areformulate(query, chat_history)
+        timings["reformulation_ms"] = (time.perf_counter() - start) * 1000
+
+    if not path.startswith("speculative"):
+        search_start = time.perf_counter()
+        initial_docs = await _avector_search(search_query)
+        timings["search_ms"] = (time.perf_counter() - search_start) * 1000
+
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    rag._record_resolution(path, timings)
+    return search_query, initial_docs
+
+
+async def _aprepare_generation(query: str, chat_history: list):
+    """
+    Version async de rag._prepare_generation.
+
+    Returns:
+        tuple: (messages, sources_dict, docs), ou un message d'avertissement (str)
+    """
+    search_query, initial_docs = await _aresolve_and_search(query, chat_history)
+    if not initial_docs:
+        return rag.NO_DOCUMENTS_MESSAGE
+
+    # Reranking CPU (cross-encoder) hors de la boucle d'événements
+    docs = await asyncio.to_thread(rag._rerank, search_query, initial_docs)
+    with stage("context_building", trace=False) as s:
+        messages, sources_dict, docs, context_report = rag._build_messages(query, chat_history, docs)
+        rag._record_context(s, context_report)
+    return messages, sources_dict, docs
+
+
+@observe()
+async def arag_agent_with_sources_conversational(query: str, chat_history: list = None):
+    """
+    Version async de rag.rag_agent_with_sources_conversational.
+
+    Args:
+        query: Question actuelle de l'utilisateur
+        chat_history: Liste des messages précédents [{"role": "user/assistant", "content": "..."}]
+
+    Returns:
+        rag.RAGAnswer: Réponse, sources et chunks utilisés
+    """
+    if not components_ready or rag.llm is None:
+        return rag.RAGAnswer(answer="⚠️ Components not initialized!")
+
+    prepared = await _aprepare_generation(query, chat_history or [])
+    if isinstance(prepared, str):
+        return rag.RAGAnswer(answer=prepared)
+    messages, sources_dict, docs = prepared
+
+    with stage("generation", trace=False) as s:
+        async with _limits["llm"]:
+            response = await rag.llm.ainvoke(messages, config={"callbacks": [rag.langfuse_handler]})
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    with stage("sources_formatting", trace=False):
+        return rag._build_answer(response.content, sources_dict, docs)
+
+
+@observe(transform_to_string=rag.stream_to_string)
+async def arag_agent_with_sources_conversational_stream(query: str, chat_history: list = None):
+    """
+    Version async en streaming : tokens de la réponse, puis la réponse structurée.
+
+    Yields:
+        str: Morceaux de la réponse, puis un rag.RAGAnswer en dernier élément
+    """
+    if not components_ready or rag.llm is None:
+        yield "⚠️ Components not initialized!"
+        yield rag.RAGAnswer(answer="⚠️ Components not initialized!")
+        return
+
+    prepared = await _aprepare_generation(query, chat_history or [])
+    if isinstance(prepared, str):
+        yield prepared
+        yield rag.RAGAnswer(answer=prepared)
+        return
+    messages, sources_dict, docs = prepared
+
+    # Le LLM est lu par une tâche à part : un client SSE lent n'occupe pas de place sous _limits["llm"]
+    tokens: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(_astream_generation(messages, tokens))
+    producer.add_done_callback(lambda _: tokens.put_nowait(_STREAM_END))
+    try:
+        while True:
+            content = await tokens.get()
+            if content is _STREAM_END:
+                break
+            yield content
+        answer = producer.result()
+    finally:
+        # Client déconnecté : inutile de continuer la génération
+        producer.cancel()
+
+    with stage("sources_formatting", trace=False):
+        rag_answer = rag._build_answer(answer, sources_dict, docs)
+    yield rag_answer
+
+
+async def _astream_generation(messages: list, tokens: asyncio.Queue) -> str:
+    """
+    Lit la réponse du LLM en streaming sous la limite de concurrence et pousse
+    chaque morceau dans une file non bornée, vidée au rythme du client.
+
+    Returns:
+        str: Réponse complète
+    """
+    with stage("generation", trace=False) as s:
+        start = time.perf_counter()
+        first_token = True
+        prompt_tokens = completion_tokens = 0
+        answer_parts = []
+        async with _limits["llm"]:
+            async for chunk in rag.llm.astream(messages, config={"callbacks": [rag.langfuse_handler]}):
+                chunk_prompt_tokens, chunk_completion_tokens = usage_tokens(chunk)
+                prompt_tokens += chunk_prompt_tokens
+                completion_tokens += chunk_completion_tokens
+                if chunk.content:
+                    if first_token and METRICS_ENABLED:
+                        registry.observe("luxas_time_to_first_token_seconds", time.perf_counter() - start,
+                                         "Délai avant le premier token de la réponse")
+                    first_token = False
+                    answer_parts.append(chunk.content)
+                    tokens.put_nowait(chunk.content)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return "".join(answer_parts)
+
+
+async def asummarize_history(summary: str, messages: list) -> str:
+    """
+    Résumé glissant pour un client léger (route /summary de l'API) : même appel
+    que ConversationMemory.update_summary, sur le modèle de reformulation s'il existe.
+
+    Args:
+        summary: Résumé actuel ("" au premier résumé)
+        messages: Messages à intégrer [{"role": "user/assistant", "content": "..."}]
+
+    Returns:
+        str: Nouveau résumé
+    """
+    with stage("history_summary", input={"nb_messages": len(messages)}, trace=False) as s:
+        async with _limits["llm"]:
+            response = await (rag.reformulation_llm or rag.llm).ainvoke(
+                summary_messages(summary, messages), config={"callbacks": [rag.langfuse_handler]}
+            )
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, messages=len(messages))
+    return response.content.strip()
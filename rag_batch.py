@@ -0,0 +1,300 @@
+"""
+Traitement par lots de questions (évaluation de non-régression, rapports en masse).
+
+Mêmes étapes que rag.py, mais regroupées sur tout le lot au lieu d'être répétées
+question par question :
+1. reformulation des questions de suivi (appels LLM en parallèle)
+2. un seul appel embed_documents pour toutes les requêtes de recherche distinctes
+3. une seule recherche Qdrant (query_batch_points) ; base locale : un parcours de
+   la matrice par filtre distinct
+4. reranking et prompt question par question
+5. générations en parallèle, BATCH_CONCURRENCY appels LLM au plus
+
+La recherche spéculative (REFORMULATION_MODE=speculative) n'a pas de sens en lot :
+les questions de suivi non autonomes sont toujours reformulées.
+
+Les résultats sont rendus dans l'ordre des questions, avec les durées par question ;
+une question en échec (erreur LLM...) n'interrompt pas les autres.
+
+Usage :
+    python rag_batch.py questions.jsonl --output reponses.jsonl --concurrency 16
+      (une question par ligne : {"query": "...", "chat_history": [...]})
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langfuse import observe
+
+import rag
+from legal_metadata import detect_constraints
+from lexical_index import get_lexical_index, reciprocal_rank_fusion
+from local_vectorstore import LocalVectorStore
+from metrics import METRICS_ENABLED, count_tokens, registry, stage, usage_tokens
+from qdrant_collection import query_request
+from reranking import RERANK_CANDIDATES
+
+# Configuration
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # Appels LLM simultanés
+
+
+@dataclass
+class BatchResult:
+    """
+    Résultat d'une question du lot.
+
+    `timings` donne les durées en millisecondes : reformulation_ms, rerank_ms,
+    context_ms et generation_ms pour la question ; embedding_ms et search_ms pour
+    l'appel groupé du lot ; total_ms depuis le début du lot.
+    """
+    index: int
+    query: str
+    search_query: str = ""
+    resolution_path: str = ""
+    answer: Optional[rag.RAGAnswer] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "query": self.query,
+            "search_query": self.search_query,
+            "resolution_path": self.resolution_path,
+            **(self.answer.to_dict() if self.answer is not None else {"answer": None}),
+            "error": self.error,
+            "timings": {name: round(ms, 1) for name, ms in self.timings.items()},
+        }
+
+
+def _run_all(executor: ThreadPoolExecutor, fn: Callable, results: List[BatchResult],
+             args: Sequence[tuple], batch_start: float):
+    """
+    Exécute fn(result, *args) pour chaque question encore sans erreur, dans le pool.
+    """
+    def run(result: BatchResult, item_args: tuple):
+        try:
+            fn(result, *item_args)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            print(f"❌ Question {result.index} : {result.error}")
+        result.timings["total_ms"] = (time.perf_counter() - batch_start) * 1000
+
+    futures = [
+        executor.submit(contextvars.copy_context().run, run, result, item_args)
+        for result, item_args in zip(results, args)
+        if result.error is None
+    ]
+    for future in futures:
+        future.result()
+
+
+def _resolve_search_query(result: BatchResult, chat_history: list):
+    """
+    Requête de recherche d'une question (reformulation LLM si besoin).
+    """
+    path = rag._resolution_path(result.query, chat_history)
+    if path in ("no_history", "standalone"):
+        result.search_query = result.query
+    else:
+        path = "reformulated"
+        start = time.perf_counter()
+        result.search_query = rag._reformulate(result.query, chat_history)
+        result.timings["reformulation_ms"] = (time.perf_counter() - start) * 1000
+    result.resolution_path = path
+    if METRICS_ENABLED:
+        registry.inc("luxas_query_resolution_total", 1, "Requêtes par chemin de résolution", path=path)
+
+
+def _dense_search_batch(vectors: List[List[float]], filters: list, k: int) -> List[List[Document]]:
+    """
+    Recherche dense de plusieurs requêtes : un seul appel Qdrant, ou un parcours
+    de la base locale par filtre distinct.
+    """
+    if not vectors:
+        return []
+    if isinstance(rag.vectorstore, LocalVectorStore):
+        groups = {}
+        for i, query_filter in enumerate(filters):
+            groups.setdefault(repr(query_filter), (query_filter, []))[1].append(i)
+        docs = [[] for _ in vectors]
+        for query_filter, indices in groups.values():
+            hits = rag.vectorstore.search_vectors([vectors[i] for i in indices], k, query_filter=query_filter)
+            for i, query_hits in zip(indices, hits):
+                docs[i] = [doc for doc, _ in query_hits]
+        return docs
+
+    reduced_dim = getattr(rag.vectorstore, "reduced_dim", 0)
+    responses = rag.vectorstore.client.query_batch_points(
+        collection_name=rag.collection_name,
+        requests=[
+            query_request(vector, k, reduced_dim, rag.SEARCH_PARAMS, query_filter=query_filter)
+            for vector, query_filter in zip(vectors, filters)
+        ]
+    )
+    return [rag._points_to_documents(response.points) for response in responses]
+
+
+def _search_batch(search_queries: List[str]) -> Tuple[Dict[str, list], float, float]:
+    """
+    Embedding groupé des requêtes distinctes puis recherche groupée
+    (+ BM25 et RRF par requête si HYBRID_SEARCH).
+
+    Returns:
+        tuple: ({requête: documents}, durée de l'embedding, durée de la recherche) en ms
+    """
+    queries = list(dict.fromkeys(search_queries))
+    lexical_index = get_lexical_index() if rag.HYBRID_SEARCH else None
+    k = RERANK_CANDIDATES if rag.reranker is not None else rag.SEARCH_K
+    constraints = [detect_constraints(query) for query in queries]
+    filters = [query_constraints.to_filter() for query_constraints in constraints]
+
+    with stage("query_embedding", input={"nb_queries": len(queries)}) as embedding_stage:
+        vectors = rag.embeddings.embed_documents(queries) if queries else []
+        embedding_stage.record(
+            embedding_tokens=sum(count_tokens(query) for query in queries) if METRICS_ENABLED else 0
+        )
+
+    with stage("vector_search", input={"nb_queries": len(queries), "k": k,
+                                       "hybrid": lexical_index is not None}) as s:
+        docs = _dense_search_batch(vectors, filters, k)
+
+        # Sans résultat filtré, la recherche est relancée sans filtre (un seul appel)
+        retry = [i for i, (found, query_filter) in enumerate(zip(docs, filters))
+                 if not found and query_filter is not None]
+        if retry:
+            print(f"⚠️ {len(retry)} requête(s) sans chunk correspondant aux filtres détectés, recherche sans filtre")
+            unfiltered = _dense_search_batch([vectors[i] for i in retry], [None] * len(retry), k)
+            for i, found in zip(retry, unfiltered):
+                docs[i] = found
+
+        if lexical_index is not None:
+            for i, query in enumerate(queries):
+                # Filtre abandonné par la recherche dense : BM25 sans filtre aussi
+                query_constraints = None if i in retry else constraints[i]
+                lexical_docs, _ = rag._lexical_search(lexical_index, query, query_constraints, fetch_texts=False)
+                docs[i] = reciprocal_rank_fusion([docs[i], lexical_docs])[:k]
+            # Textes des résultats lexicaux retenus : une seule lecture pour tout le lot
+            rag._fetch_texts([doc for found in docs for doc in found])
+            docs = [[doc for doc in found if doc.page_content] for found in docs]
+
+        s.record(chunks=sum(len(found) for found in docs),
+                 filtered_searches=sum(1 for query_filter in filters if query_filter is not None))
+    return dict(zip(queries, docs)), embedding_stage.duration_ms, s.duration_ms
+
+
+def _answer(result: BatchResult, chat_history: list, initial_docs: list):
+    """
+    Reranking, prompt et génération de la réponse d'une question.
+    """
+    if not initial_docs:
+        result.answer = rag.RAGAnswer(answer=rag.NO_DOCUMENTS_MESSAGE)
+        return
+
+    start = time.perf_counter()
+    docs = rag._rerank(result.search_query, list(initial_docs))
+    result.timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+
+    with stage("context_building", trace=False) as s:
+        messages, sources_dict, docs, context_report = rag._build_messages(result.query, chat_history, docs)
+        rag._record_context(s, context_report)
+    result.timings["context_ms"] = s.duration_ms
+
+    with stage("generation", trace=False) as s:
+        response = rag.llm.invoke(messages, config={"callbacks": [rag.langfuse_handler]})
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        s.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    result.timings["generation_ms"] = s.duration_ms
+
+    with stage("sources_formatting", trace=False):
+        result.answer = rag._build_answer(response.content, sources_dict, docs)
+
+
+@observe(name="rag_batch", capture_input=False, capture_output=False)
+def rag_agent_batch(items: Sequence[Tuple[str, Optional[list]]],
+                    concurrency: int = BATCH_CONCURRENCY) -> List[BatchResult]:
+    """
+    Répond à un lot de questions indépendantes.
+
+    Args:
+        items: [(question, historique [{"role", "content"}] ou None)]
+        concurrency: Appels LLM simultanés (reformulations, puis générations)
+
+    Returns:
+        list: Un BatchResult par question, dans l'ordre de `items`
+    """
+    histories = [chat_history or [] for _, chat_history in items]
+    results = [BatchResult(index=i, query=query) for i, (query, _) in enumerate(items)]
+    if rag.vectorstore is None or rag.llm is None:
+        for result in results:
+            result.answer = rag.RAGAnswer(answer="⚠️ Components not initialized!")
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="rag_batch") as executor:
+        # 1. Requêtes de recherche (reformulations en parallèle)
+        _run_all(executor, _resolve_search_query, results, [(history,) for history in histories], start)
+
+        # 2-3. Un embedding et une recherche pour tout le lot
+        active = [result for result in results if result.error is None]
+        docs_by_query, embedding_ms, search_ms = _search_batch([result.search_query for result in active])
+        for result in active:
+            result.timings.update(embedding_ms=embedding_ms, search_ms=search_ms)
+        print(f"✅ {len(docs_by_query)} requêtes distinctes : embedding en {embedding_ms:.0f} ms, "
+              f"recherche en {search_ms:.0f} ms")
+
+        # 4-8. Reranking, prompt et génération, en parallèle
+        _run_all(executor, _answer, results,
+                 [(history, docs_by_query.get(result.search_query, []))
+                  for result, history in zip(results, histories)], start)
+
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for result in results if result.error is not None)
+    print(f"✅ {len(results)} questions en {elapsed:.1f} s ({len(results) / max(elapsed, 1e-9):.1f} questions/s, "
+          f"{errors} erreurs)")
+    return results
+
+
+def _read_items(path: str) -> List[Tuple[str, list]]:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                items.append((record["query"], record.get("chat_history") or []))
+    return items
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Réponses RAG pour un lot de questions")
+    parser.add_argument("input", help="Fichier JSON lines : {\"query\", \"chat_history\"} par ligne")
+    parser.add_argument("--output", default="batch_answers.jsonl", help="Réponses, une ligne JSON par question")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    items = _read_items(args.input)
+    print(f"📋 {len(items)} questions à traiter ({args.concurrency} appels LLM simultanés)")
+    rag.warm_up()
+    results = rag_agent_batch(items, concurrency=args.concurrency)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+
+    latencies = [result.timings["total_ms"] for result in results if "total_ms" in result.timings]
+    if latencies:
+        print(f"⏱️ Latence par question : p50 {np.percentile(latencies, 50):.0f} ms, "
+              f"p95 {np.percentile(latencies, 95):.0f} ms")
+    print(f"💾 Réponses : {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Reranking des chunks récupérés, avec un budget de latence.
+
+La recherche sur-échantillonne RERANK_CANDIDATES chunks, le reranker les reclasse
+et seuls les RERANK_TOP_K meilleurs sont envoyés au LLM (prompt plus court).
+
+Backends (variable d'environnement RERANKER) :
+- "lexical" : recouvrement des termes de la question (tokenisation de l'index BM25),
+  sans dépendance ni modèle
+- "cross-encoder" : CrossEncoder sentence-transformers chargé depuis un dossier local
+  (RERANKER_MODEL_PATH), inférence CPU par lots
+- "none" : pas de reranking, ordre de la recherche vectorielle
+
+Si le budget (RERANK_BUDGET_MS) est dépassé avant la fin du scoring, l'ordre de la
+recherche vectorielle est conservé. Les scores (question, chunk) sont gardés dans un
+cache LRU : les lots déjà calculés servent aux requêtes suivantes.
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from lexical_index import tokenize
+
+# Configuration
+RERANKER = os.getenv("RERANKER", "lexical")
+RERANKER_MODEL_PATH = os.getenv("RERANKER_MODEL_PATH", "models/cross-encoder-ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # Chunks récupérés avant reranking
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "5"))              # Chunks envoyés au LLM
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+RERANK_BATCH_SIZE = 16         # Paires scorées par lot (granularité du contrôle du budget)
+SCORE_CACHE_SIZE = 20_000      # Scores (question, chunk) gardés en mémoire
+BIGRAM_WEIGHT = 0.5            # Poids des paires de termes consécutifs (scorer lexical)
+
+
+class LexicalOverlapScorer:
+    """
+    Score = part des termes de la question présents dans le chunk
+    (+ part des paires de termes consécutifs, pour favoriser les expressions exactes).
+    """
+
+    name = "lexical"
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_terms = tokenize(query)
+        terms = set(query_terms)
+        bigrams = set(zip(query_terms, query_terms[1:]))
+        if not terms:
+            return [0.0] * len(texts)
+
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            present = terms.intersection(tokens)
+            # Termes rares de la question : log amortit les chunks qui répètent un seul terme
+            frequency = sum(math.log1p(tokens.count(term)) for term in present) / len(terms)
+            score = len(present) / len(terms) + 0.1 * frequency
+            if bigrams:
+                score += BIGRAM_WEIGHT * len(bigrams.intersection(zip(tokens, tokens[1:]))) / len(bigrams)
+            scores.append(score)
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    CrossEncoder sentence-transformers exécuté sur CPU, chargé depuis un dossier local.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_path: str = RERANKER_MODEL_PATH, batch_size: int = RERANK_BATCH_SIZE):
+        # Dépendance optionnelle : importée seulement si ce backend est choisi
+        from sentence_transformers import CrossEncoder
+
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"Modèle de reranking introuvable : {model_path}")
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_path, device="cpu", max_length=512)
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        scores = self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        return [float(s) for s in scores]
+
+
+class Reranker:
+    """
+    Reclasse les documents avec un scorer, dans un budget de latence, avec cache de scores.
+    """
+
+    def __init__(self, scorer, top_k: int = RERANK_TOP_K, budget_ms: float = RERANK_BUDGET_MS,
+                 batch_size: int = RERANK_BATCH_SIZE, cache_size: int = SCORE_CACHE_SIZE):
+        self.scorer = scorer
+        self.top_k = top_k
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        return doc.metadata.get("_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+    def _cached(self, keys: List[Tuple[str, str]]) -> List[Optional[float]]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def _store(self, keys: List[Tuple[str, str]], scores: List[float]):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, docs: List[Document]) -> Tuple[List[Document], dict]:
+        """
+        Reclasse les documents et garde les top_k meilleurs.
+
+        Args:
+            query: Question (reformulée) utilisée pour la recherche
+            docs: Documents dans l'ordre de la recherche vectorielle
+
+        Returns:
+            tuple: (documents retenus, informations pour Langfuse : backend, scores,
+                    nombre de scores en cache, durée, repli éventuel)
+        """
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+        keys = [(self.scorer.name, query, self._doc_key(doc)) for doc in docs]
+        scores = self._cached(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        info = {"backend": self.scorer.name, "nb_candidates": len(docs), "cache_hits": len(docs) - len(missing)}
+
+        for batch_start in range(0, len(missing), self.batch_size):
+            if time.perf_counter() > deadline:
+                break
+            batch = missing[batch_start:batch_start + self.batch_size]
+            batch_scores = self.scorer.score(query, [docs[i].page_content for i in batch])
+            self._store([keys[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+
+        info["rerank_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if any(score is None for score in scores):
+            # Budget dépassé : ordre vectoriel (les lots calculés restent en cache)
+            info["fallback"] = True
+            return docs[:self.top_k], info
+
+        # Tri stable : à score égal, l'ordre de la recherche vectorielle est conservé
+        ranked = sorted(range(len(docs)), key=lambda i: -scores[i])[:self.top_k]
+        info["fallback"] = False
+        info["scores"] = [round(scores[i], 4) for i in ranked]
+        return [docs[i] for i in ranked], info
+
+
+def load_reranker(backend: str = RERANKER) -> Optional[Reranker]:
+    """
+    Construit le reranker configuré.
+
+    Returns:
+        Reranker, ou None si backend vaut "none"
+    """
+    if backend == "none":
+        return None
+    if backend == "lexical":
+        return Reranker(LexicalOverlapScorer())
+    if backend == "cross-encoder":
+        return Reranker(CrossEncoderScorer())
+    raise ValueError(f"RERANKER inconnu : {backend} (attendu : none, lexical, cross-encoder)")
@@ -0,0 +1,36 @@
+from chunk_dedup import ChunkDeduplicator
+from legal_metadata import detect_constraints, filter_fields
+
+GAGE = (
+    "Article 2 La charge pour l'État est compensée, à due concurrence, par la création d'une taxe "
+    "additionnelle à l'accise sur les tabacs prévue au chapitre IV du titre Ier du livre III du "
+    "code des impositions sur les biens et services."
+)
+
+
+def _metadata(legislature, bill_number, deposit_date, article):
+    metadata = {"legislature": legislature, "bill_number": bill_number, "deposit_date": deposit_date,
+                "author_surnames": [f"AUTEUR{bill_number}"], "articles": [article]}
+    return {**metadata, **filter_fields([metadata])}
+
+
+def test_article_partage_par_deux_propositions(tmp_path):
+    dedup = ChunkDeduplicator(path=str(tmp_path / "dedup_index.npz"))
+    point_id = dedup.add("p2108", "l17b2108.pdf", GAGE, _metadata(17, 2108, "2025-11-10", 3))
+    assert dedup.add("p2110", "l17b2110.pdf", GAGE, _metadata(17, 2110, "2025-11-12", 2)) == point_id
+
+    payload = dedup.pop_payload_updates()[0].set_payload.payload
+    assert payload["bill_numbers"] == [2108, 2110]
+    assert payload["bill_articles"] == ["2108:3", "2110:2"]
+    assert detect_constraints("Que dit l'article 2 de la proposition 2110 ?").matches(payload)
+    assert not detect_constraints("Que dit l'article 3 de la proposition 2110 ?").matches(payload)
+    assert detect_constraints("Propositions déposées par M. Jean AUTEUR2110").matches(payload)
+
+    # Retrait de la première source : les champs simples décrivent la suivante
+    dedup.remove_source("l17b2108.pdf")
+    dedup.save()
+    payload = ChunkDeduplicator(path=dedup.path).payload(point_id)
+    assert payload["source"] == "l17b2110.pdf"
+    assert payload["bill_number"] == 2110
+    assert payload["bill_numbers"] == [2110]
+    assert not detect_constraints("l'article 3 de la proposition 2108").matches(payload)
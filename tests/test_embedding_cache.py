@@ -0,0 +1,22 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache, cache_key
+
+
+def test_ligne_partagee_entre_processus(tmp_path):
+    k0, k1, k2 = (cache_key("model", text) for text in ("a", "b", "c"))
+    v0, v1, v2 = (np.full(4, value, dtype=np.float32) for value in (0.0, 1.0, 2.0))
+    first = EmbeddingCache("model", directory=str(tmp_path), max_mb=1)
+    first.put_many([k0], [v0])
+    second = EmbeddingCache("model", directory=str(tmp_path), max_mb=1)
+    second.get_many([k0])
+
+    # Chaque processus a sa propre liste de lignes libres : la ligne prise par l'autre est sautée
+    second.put_many([k2], [v2])
+    first.put_many([k1], [v1])
+    reader = EmbeddingCache("model", directory=str(tmp_path), max_mb=1)
+    assert [vector.tolist() for vector in reader.get_many([k0, k1, k2])] == [v0.tolist(), v1.tolist(), v2.tolist()]
+
+    # Vecteur d'un autre texte écrit dans la ligne de k1 : défaut de cache, pas de mauvais vecteur
+    reader._vectors[reader._slots[k1]] = v2
+    assert reader.get_many([k1]) == [None]
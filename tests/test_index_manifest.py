@@ -0,0 +1,29 @@
+import json
+
+from index_manifest import IndexManifest, file_sha256
+
+RECURSIVE = {"strategy": "recursive", "chunk_size": 1000, "chunk_overlap": 200, "metadata_version": 2}
+LEGISLATIVE = {"strategy": "legislative", "chunk_size": 2000, "metadata_version": 2}
+
+
+def test_changement_de_decoupage_reindexe_tout(tmp_path):
+    pdf = tmp_path / "l17b2110.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    path = str(tmp_path / "manifest.json")
+    manifest = IndexManifest(path, RECURSIVE)
+    manifest.record(pdf.name, file_sha256(pdf), ["old"])
+    manifest.save()
+
+    assert IndexManifest(path, RECURSIVE).plan([pdf])[0] == []
+    changed = IndexManifest(path, LEGISLATIVE)
+    assert changed.plan([pdf])[0] == [pdf]
+    assert changed.stale_point_ids(pdf.name, ["new"]) == ["old"]
+
+    # Interruption avant la ré-indexation : le PDF reste à refaire
+    changed.save()
+    assert IndexManifest(path, LEGISLATIVE).plan([pdf])[0] == [pdf]
+
+    # Ancien format, sans configuration enregistrée
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({pdf.name: {"hash": file_sha256(pdf), "point_ids": ["old"]}}, f)
+    assert IndexManifest(path, RECURSIVE).plan([pdf])[0] == [pdf]
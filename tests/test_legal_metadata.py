@@ -0,0 +1,32 @@
+from legal_metadata import detect_constraints
+
+
+def test_date_de_loi_non_filtree():
+    assert detect_constraints("Que change la loi du 5 mars 2007 ?").deposit_range is None
+
+
+def test_reference_de_loi_non_numero_de_proposition():
+    constraints = detect_constraints("Que modifie la loi n° 2016-297 ?")
+    assert not constraints.bill_numbers
+    assert constraints.deposit_range is None
+
+
+def test_annee_de_contexte_non_filtree():
+    assert detect_constraints("Quel est l'impact du Brexit en 2020 ?").deposit_range is None
+
+
+def test_propositions_deposees_en_annee():
+    constraints = detect_constraints("Propositions de loi déposées en 2024 sur les animaux")
+    assert constraints.deposit_range == ("2024-01-01", "2025-01-01")
+
+
+def test_proposition_de_loi_du_jour():
+    constraints = detect_constraints("Que dit la proposition de loi du 5 mars 2024 ?")
+    assert constraints.deposit_range == ("2024-03-05", "2024-03-06")
+
+
+def test_numero_de_proposition():
+    assert detect_constraints("La proposition de loi n° 2112").bill_numbers == [2112]
+    constraints = detect_constraints("l17b2108")
+    assert constraints.bill_numbers == [2108]
+    assert constraints.legislature == 17
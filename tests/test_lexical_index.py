@@ -0,0 +1,23 @@
+from langchain_core.documents import Document
+
+from lexical_index import LexicalIndexWriter, get_lexical_index
+
+
+def _chunk(text, source):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_rechargement_apres_nouvelle_validation(tmp_path):
+    directory = str(tmp_path)
+    assert get_lexical_index(directory) is None
+
+    writer = LexicalIndexWriter(directory)
+    writer.upsert(["a"], [_chunk("compensation de la perte de recettes", "l17b2108.pdf")])
+    writer.save()
+    assert [doc.metadata["_id"] for doc, _ in get_lexical_index(directory).search("recettes")] == ["a"]
+
+    # Nouveau segment validé par un indexeur : visible sans redémarrer
+    writer.upsert(["b"], [_chunk("perte de recettes pour l'État", "l17b2110.pdf")])
+    writer.delete(["a"])
+    writer.save()
+    assert [doc.metadata["_id"] for doc, _ in get_lexical_index(directory).search("recettes")] == ["b"]
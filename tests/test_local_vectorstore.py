@@ -0,0 +1,64 @@
+import numpy as np
+
+from local_vectorstore import LocalVectorStore
+
+
+def _store(path):
+    return LocalVectorStore(str(path), dtype="float32", nprobe=0)
+
+
+def _ids(results):
+    return [doc.metadata["_id"] for doc, _ in results]
+
+
+def test_lecteur_apres_compaction_et_remplacement(tmp_path):
+    vectors = np.eye(4, dtype=np.float32)
+    writer = _store(tmp_path)
+    writer.add_vectors(["a", "b", "c", "d"], vectors, ["A", "B", "C", "D"], [{} for _ in range(4)])
+    reader = _store(tmp_path)
+    assert _ids(reader.search_vectors(vectors[1], k=1)[0]) == ["b"]
+
+    writer.delete(["a"])
+    assert writer.compact() == 1
+    (doc, score), = reader.search_vectors(vectors[1], k=1)[0]
+    assert (doc.page_content, round(score, 4)) == ("B", 1.0)
+    assert _ids(reader.search_vectors(vectors[3], k=1)[0]) == ["d"]
+    assert "a" not in _ids(reader.search_vectors(vectors[0], k=4)[0])
+
+    # Point remplacé par un autre processus : nouvelle ligne au-delà de celles du lecteur
+    writer.add_vectors(["b"], vectors[:1], ["B2"], [{}])
+    (doc, score), = reader.search_vectors(vectors[0], k=1)[0]
+    assert (doc.page_content, round(score, 4)) == ("B2", 1.0)
+    assert len(reader) == 3
+
+
+def test_filtres_indexes_apres_mise_a_jour_et_compaction(tmp_path):
+    from qdrant_client import models
+
+    def condition(field, match):
+        return models.FieldCondition(key=f"metadata.{field}", match=match)
+
+    store = _store(tmp_path)
+    vectors = np.eye(3, dtype=np.float32)
+    metadatas = [
+        {"bill_numbers": ["2108"], "legislatures": [17], "type": "gage"},
+        {"bill_numbers": ["2109"], "legislatures": [17], "type": "article"},
+        {"bill_numbers": ["2110"], "legislatures": [16], "type": "article"},
+    ]
+    store.add_vectors(["a", "b", "c"], vectors, ["A", "B", "C"], metadatas)
+
+    def matching(query_filter):
+        return sorted(_ids(store.search_vectors(vectors[0], k=3, query_filter=query_filter)[0]))
+
+    assert matching(models.Filter(must=[condition("legislatures", models.MatchValue(value=17))],
+                                  must_not=[condition("type", models.MatchValue(value="gage"))])) == ["b"]
+    assert matching(models.Filter(should=[condition("bill_numbers", models.MatchValue(value="2108")),
+                                          condition("bill_numbers", models.MatchValue(value="2110"))])) == ["a", "c"]
+
+    # Article de gage dédupliqué : il appartient désormais aussi à la proposition 2110
+    store.apply_payload_updates([models.SetPayloadOperation(set_payload=models.SetPayload(
+        payload={"bill_numbers": ["2108", "2110"]}, points=["a"], key="metadata"))])
+    store.delete(["b"])
+    store.compact()
+    assert matching(models.Filter(must=[condition("bill_numbers", models.MatchAny(any=["2110"]))])) == ["a", "c"]
+    assert matching(models.Filter(must_not=[condition("legislatures", models.MatchValue(value=16))])) == ["a"]
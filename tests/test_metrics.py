@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    fresh = MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", fresh)
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "LANGFUSE_ENABLED", False)
+    return fresh
+
+
+def test_compteurs_et_histogrammes_de_tailles(registry):
+    with metrics.stage("context_building") as s:
+        s.record(prompt_tokens=120, chunks=4, document_tokens=900, rerank_ms=12.0, fallback=False)
+    rendered = registry.render()
+
+    assert "# TYPE luxas_prompt_tokens_total counter" in rendered
+    assert 'luxas_prompt_tokens_total{stage="context_building"} 120' in rendered
+    assert "# TYPE luxas_chunks histogram" in rendered
+    assert 'luxas_chunks_bucket{stage="context_building",le="5"} 1' in rendered
+    assert 'luxas_document_tokens_sum{stage="context_building"} 900.000000' in rendered
+    assert "luxas_chunks_total" not in rendered
+    assert "rerank_ms" not in rendered and "fallback" not in rendered
+
+
+def test_temps_du_consommateur_exclu(registry):
+    def stream():
+        with metrics.stage("generation") as s:
+            for token in ("a", "b"):
+                with s.paused():
+                    yield token
+
+    for _ in stream():
+        time.sleep(0.05)
+    rendered = registry.render()
+    total = float(rendered.split('luxas_stage_duration_seconds_sum{stage="generation"} ')[1].split()[0])
+    assert total < 0.05
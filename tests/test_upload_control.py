@@ -0,0 +1,66 @@
+import httpx
+
+from upload_control import classify_error
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code, message=""):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def test_erreur_inconnue_fatale():
+    assert classify_error(ValueError("payload invalide")) == "fatal"
+    assert classify_error(KeyError("metadata")) == "fatal"
+
+
+def test_erreurs_reseau_et_5xx_reessayees():
+    assert classify_error(httpx.ConnectError("connexion refusée")) == "transient"
+    assert classify_error(ConnectionResetError()) == "transient"
+    assert classify_error(_StatusError(503)) == "transient"
+
+
+def test_cause_reseau_enveloppee():
+    try:
+        try:
+            raise httpx.ReadTimeout("lecture")
+        except httpx.ReadTimeout as e:
+            raise RuntimeError("upsert") from e
+    except RuntimeError as e:
+        assert classify_error(e) == "timeout"
+
+
+def test_payload_trop_gros():
+    assert classify_error(_StatusError(413)) == "too_large"
+    assert classify_error(_StatusError(
+        400, "Payload error: JSON payload (40000000 bytes) is larger than allowed (limit: 33554432 bytes)."
+    )) == "too_large"
+    assert classify_error(_StatusError(400, "Requested 400000 tokens, max 300000 tokens per request")) == "too_large"
+
+
+def test_requete_invalide_mentionnant_payload_fatale():
+    assert classify_error(_StatusError(400, "Wrong input: payload field 'metadata' is not indexed")) == "fatal"
+    assert classify_error(RuntimeError("payload")) == "fatal"
+
+
+def test_ecriture_async_coupee_et_reessayee(monkeypatch):
+    import asyncio
+
+    import upload_control
+    from upload_control import AdaptiveBatchSize, awrite_with_split
+
+    monkeypatch.setattr(upload_control, "UPLOAD_RETRY_BASE_DELAY", 0.0)
+    written, failures = [], iter([httpx.ConnectError("connexion refusée")])
+
+    async def write(chunks, ids):
+        if len(chunks) > 2:
+            raise _StatusError(413)
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        written.extend(ids)
+
+    sizer = AdaptiveBatchSize(initial=8, minimum=1, maximum=8)
+    stats = asyncio.run(awrite_with_split(write, list("abcdefgh"), list("abcdefgh"), sizer))
+    assert written == list("abcdefgh")
+    assert stats == {"retries": 1, "splits": 3}
@@ -0,0 +1,321 @@
+"""
+Contrôle des uploads de l'indexation : journal, taille de batch adaptative et
+réessais avec découpe. Les fonctions a* sont les variantes du pipeline asynchrone
+(async_ingestion.py).
+
+- le journal (INDEX_JOURNAL_PATH, JSON lines) trace chaque lancement et chaque batch
+  validé ou en échec ; un lancement interrompu est signalé au suivant. Le point de
+  reprise reste le manifeste : un PDF n'y entre qu'une fois ses points écrits, donc
+  une relance ne retraite que les batches non validés.
+- la taille des batches suit le débit observé (viser UPLOAD_TARGET_SECONDS par écriture)
+  et est divisée par deux à chaque limite de débit (429) ou timeout.
+- une écriture en échec est réessayée avec backoff ; sur un payload trop gros ou un
+  timeout, le batch est coupé en deux et chaque moitié est réécrite (IDs déterministes :
+  les points déjà écrits sont simplement écrasés).
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Configuration
+INDEX_JOURNAL_PATH = os.getenv("INDEX_JOURNAL_PATH", "index_journal.jsonl")
+JOURNAL_KEEP_RUNS = 20                                                   # Lancements conservés dans le journal
+UPLOAD_BATCH_INITIAL = int(os.getenv("UPLOAD_BATCH_INITIAL", "1000"))   # Chunks du premier batch
+UPLOAD_BATCH_MIN = 50
+UPLOAD_BATCH_MAX = int(os.getenv("UPLOAD_BATCH_MAX", "5000"))
+UPLOAD_TARGET_SECONDS = float(os.getenv("UPLOAD_TARGET_SECONDS", "30"))  # Durée visée d'une écriture
+UPLOAD_MAX_ATTEMPTS = 5       # Tentatives par (demi-)batch
+UPLOAD_RETRY_BASE_DELAY = 2.0  # Secondes, doublées à chaque nouvel essai (avec jitter)
+
+# Classification des erreurs (par nom de classe : OpenAI, httpx et qdrant-client n'ont pas de base commune).
+# Seules ces erreurs réseau et les statuts 5xx sont réessayées : une erreur inconnue est fatale.
+_TIMEOUT_ERRORS = {"TimeoutError", "ReadTimeout", "WriteTimeout", "ConnectTimeout", "PoolTimeout",
+                   "TimeoutException", "APITimeoutError"}
+_TRANSIENT_ERRORS = {"ConnectionError", "ConnectionResetError", "ConnectionAbortedError", "ConnectionRefusedError",
+                     "BrokenPipeError", "ConnectError", "ReadError", "WriteError", "RemoteProtocolError",
+                     "APIConnectionError", "ResponseHandlingException", "InternalServerError",
+                     "ServiceUnavailableError"}
+# Messages de taille exacts : Qdrant ("JSON payload (N bytes) is larger than allowed"),
+# OpenAI ("max N tokens per request", code max_tokens_per_request), proxys HTTP
+_TOO_LARGE_MARKERS = ("is larger than allowed", "tokens per request", "max_tokens_per_request",
+                      "request entity too large", "payload too large")
+
+
+def _error_chain(error: BaseException):
+    while error is not None:
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Catégorie d'une erreur d'écriture.
+
+    Returns:
+        str: "rate_limit", "too_large", "timeout", "transient" (réessayer)
+             ou "fatal" (identifiants, requête invalide, erreur inconnue : inutile de réessayer)
+    """
+    for err in _error_chain(error):
+        status = _status_code(err)
+        name = type(err).__name__
+        message = str(err).lower()
+        if status == 429 or name == "RateLimitError":
+            return "rate_limit"
+        if status == 413 or any(marker in message for marker in _TOO_LARGE_MARKERS):
+            return "too_large"
+        if name in _TIMEOUT_ERRORS or status in (408, 504):
+            return "timeout"
+        if name in _TRANSIENT_ERRORS or (status is not None and status >= 500):
+            return "transient"
+        if status is not None:
+            return "fatal"
+    return "fatal"
+
+
+def _retry_delay(attempt: int) -> float:
+    """
+    Attente avant le nouvel essai : doublée à chaque tentative, avec jitter.
+    """
+    return UPLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1) * (0.5 + random.random())
+
+
+class AdaptiveBatchSize:
+    """
+    Nombre de chunks par batch, ajusté au débit observé et aux erreurs.
+    """
+
+    def __init__(self, initial: int = UPLOAD_BATCH_INITIAL, minimum: int = UPLOAD_BATCH_MIN,
+                 maximum: int = UPLOAD_BATCH_MAX, target_seconds: float = UPLOAD_TARGET_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.size = self._clamp(initial)
+
+    def _clamp(self, size: float) -> int:
+        return int(max(self.minimum, min(self.maximum, size)))
+
+    def observe(self, nb_chunks: int, duration_s: float):
+        """
+        Écriture réussie : rapproche la taille de celle qui prendrait target_seconds
+        au débit observé (au plus un doublement par batch).
+        """
+        ideal = nb_chunks / max(duration_s, 1e-3) * self.target_seconds
+        self.size = self._clamp(min(2 * self.size, (self.size + ideal) / 2))
+
+    def shrink(self):
+        """
+        Limite de débit, timeout ou payload trop gros : taille divisée par deux.
+        """
+        self.size = self._clamp(self.size // 2)
+
+
+def call_with_retry(fn: Callable, description: str, max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+                    sizer: Optional[AdaptiveBatchSize] = None):
+    """
+    Appelle fn en réessayant avec backoff les erreurs non fatales.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == "fatal" or attempt == max_attempts:
+                raise
+            if kind == "rate_limit" and sizer is not None:
+                sizer.shrink()
+            delay = _retry_delay(attempt)
+            print(f"   ↻ {description} : {kind} ({type(e).__name__}), nouvel essai dans {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def acall_with_retry(fn: Callable[[], Awaitable], description: str, max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+                           sizer: Optional[AdaptiveBatchSize] = None):
+    """
+    Variante async de call_with_retry : fn renvoie une coroutine, recréée à chaque essai.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == "fatal" or attempt == max_attempts:
+                raise
+            if kind == "rate_limit" and sizer is not None:
+                sizer.shrink()
+            delay = _retry_delay(attempt)
+            print(f"   ↻ {description} : {kind} ({type(e).__name__}), nouvel essai dans {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def write_with_split(write: Callable, chunks: List, ids: List[str], sizer: AdaptiveBatchSize,
+                     stats: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Écrit un batch ; sur un payload trop gros ou un timeout, le coupe en deux et
+    écrit chaque moitié, sinon réessaie avec backoff.
+
+    Args:
+        write: Fonction write(chunks, ids) (upsert idempotent)
+        chunks: Documents à écrire
+        ids: IDs des documents
+        sizer: Taille adaptative, informée des durées et des erreurs
+        stats: Compteurs à compléter ({"retries", "splits"})
+
+    Returns:
+        dict: Compteurs de réessais et de découpes
+
+    Raises:
+        Exception: La dernière erreur, si une partie du batch n'a pas pu être écrite
+    """
+    stats = stats if stats is not None else {"retries": 0, "splits": 0}
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        start = time.perf_counter()
+        try:
+            write(chunks, ids)
+            sizer.observe(len(chunks), time.perf_counter() - start)
+            return stats
+        except Exception as e:
+            kind = classify_error(e)
+            if kind in ("too_large", "timeout") and len(chunks) > 1:
+                sizer.shrink()
+                stats["splits"] += 1
+                middle = len(chunks) // 2
+                print(f"   ✂️ {kind} ({type(e).__name__}) sur {len(chunks)} chunks : découpe en deux")
+                write_with_split(write, chunks[:middle], ids[:middle], sizer, stats)
+                write_with_split(write, chunks[middle:], ids[middle:], sizer, stats)
+                return stats
+            if kind == "fatal" or attempt == UPLOAD_MAX_ATTEMPTS:
+                raise
+            if kind in ("rate_limit", "timeout"):
+                sizer.shrink()
+            stats["retries"] += 1
+            delay = _retry_delay(attempt)
+            print(f"   ↻ {kind} ({type(e).__name__}) sur {len(chunks)} chunks, nouvel essai dans {delay:.1f}s")
+            time.sleep(delay)
+    return stats
+
+
+async def awrite_with_split(write: Callable[[List, List[str]], Awaitable], chunks: List, ids: List[str],
+                            sizer: AdaptiveBatchSize, stats: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Variante async de write_with_split : write(chunks, ids) renvoie une coroutine.
+    Les deux moitiés d'un batch coupé sont écrites l'une après l'autre.
+    """
+    stats = stats if stats is not None else {"retries": 0, "splits": 0}
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        start = time.perf_counter()
+        try:
+            await write(chunks, ids)
+            sizer.observe(len(chunks), time.perf_counter() - start)
+            return stats
+        except Exception as e:
+            kind = classify_error(e)
+            if kind in ("too_large", "timeout") and len(chunks) > 1:
+                sizer.shrink()
+                stats["splits"] += 1
+                middle = len(chunks) // 2
+                print(f"   ✂️ {kind} ({type(e).__name__}) sur {len(chunks)} chunks : découpe en deux")
+                await awrite_with_split(write, chunks[:middle], ids[:middle], sizer, stats)
+                await awrite_with_split(write, chunks[middle:], ids[middle:], sizer, stats)
+                return stats
+            if kind == "fatal" or attempt == UPLOAD_MAX_ATTEMPTS:
+                raise
+            if kind in ("rate_limit", "timeout"):
+                sizer.shrink()
+            stats["retries"] += 1
+            delay = _retry_delay(attempt)
+            print(f"   ↻ {kind} ({type(e).__name__}) sur {len(chunks)} chunks, nouvel essai dans {delay:.1f}s")
+            await asyncio.sleep(delay)
+    return stats
+
+
+class IndexJournal:
+    """
+    Journal des lancements d'indexation et de leurs batches (une ligne JSON par événement).
+    """
+
+    def __init__(self, path: str = INDEX_JOURNAL_PATH):
+        self.path = path
+        self.run_id: Optional[str] = None
+        self.events: List[Dict] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.events.append(json.loads(line))
+                    except ValueError:
+                        break  # Dernière ligne tronquée par un arrêt brutal
+
+    def _append(self, event: str, **fields):
+        record = {"event": event, "run": self.run_id,
+                  "time": datetime.now(timezone.utc).isoformat(timespec="seconds"), **fields}
+        self.events.append(record)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def last_run(self) -> Optional[Dict]:
+        """
+        Bilan du dernier lancement : interrompu ou non, batches validés, PDFs en échec.
+        """
+        starts = [i for i, event in enumerate(self.events) if event["event"] == "run_start"]
+        if not starts:
+            return None
+        events = self.events[starts[-1]:]
+        committed = set()
+        failed = set()
+        for event in events:
+            if event["event"] == "batch_committed":
+                committed.update(event["sources"])
+                failed.difference_update(event["sources"])
+            elif event["event"] == "batch_failed":
+                failed.update(event["sources"])
+        return {
+            "run": events[0]["run"],
+            "started": events[0]["time"],
+            "interrupted": events[-1]["event"] != "run_end",
+            "committed_batches": sum(1 for event in events if event["event"] == "batch_committed"),
+            "committed_pdfs": len(committed),
+            "failed_sources": sorted(failed),
+        }
+
+    def start_run(self, **info) -> Optional[Dict]:
+        """
+        Ouvre un lancement (en ne gardant que les JOURNAL_KEEP_RUNS derniers).
+
+        Returns:
+            dict: Bilan du lancement précédent (voir last_run), ou None
+        """
+        previous = self.last_run()
+        starts = [i for i, event in enumerate(self.events) if event["event"] == "run_start"]
+        if len(starts) >= JOURNAL_KEEP_RUNS:
+            self.events = self.events[starts[len(starts) - JOURNAL_KEEP_RUNS + 1]:]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in self.events)
+            os.replace(tmp_path, self.path)
+        self.run_id = uuid.uuid4().hex[:12]
+        self._append("run_start", **info)
+        return previous
+
+    def batch_committed(self, batch_num: int, sources: List[str], nb_chunks: int, **details):
+        self._append("batch_committed", batch=batch_num, sources=sources, chunks=nb_chunks, **details)
+
+    def batch_failed(self, batch_num: int, sources: List[str], nb_chunks: int, error: str):
+        self._append("batch_failed", batch=batch_num, sources=sources, chunks=nb_chunks, error=error)
+
+    def end_run(self, **summary):
+        self._append("run_end", **summary)